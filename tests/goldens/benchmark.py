@@ -3,29 +3,84 @@
 ``--record`` appends a line to bench.jsonl per run: the timings, which are
 only comparable against other lines carrying the same ``machine`` digest,
 and the call counts, which are comparable against every line.
+
+``--copies`` counts the bytes the receive buffer copies instead of timing,
+against the bytearray buffer it replaced; ``--peak`` measures the memory a
+replay peaks at with rectangles decoded whole and in row bands.
+``--callbacks`` counts the paint callbacks -- ``updateRectangle``,
+``fillRectangle``, ``copyRectangle`` -- a fixture makes per update.
+``--keystrokes`` counts the transport writes typing takes, per 1000 keys.
+``--sans-io`` times a bare ``session.RFBSession`` instead of the Twisted
+client: parsing and decoding alone, with no transport and no framebuffer.
+``--dispatch N`` times the per-rectangle cost of one synthetic update of N
+16x16 rectangles, each as small as its encoding can send, as a
+Hextile-heavy server sends them.
+``--scroll N`` replays a terminal scrolling N lines, sent as Raw alone and
+as CopyRect plus the new line, and compares wire bytes and decode time.
+``--fill N`` times N fill-heavy RRE updates -- a wallpaper and a few solid
+dialogs -- painted natively and through the ``color * w * h`` fallback; RRE
+paints subrectangles into its rectangle's buffer, so the two differ only
+where a rectangle is one colour.
+``--wire`` counts the bytes repainting each committed scene takes as Raw and
+in every encoding ``tests/goldens/transcode.py`` writes.
+``--stall N`` replays the scenes as 1920x1080 TightPNG images to N asyncio
+sessions on one loop, decoding them where the session parses and on
+``session.decode_pool()``, and times how late a 1 ms timer runs meanwhile:
+how long one session's images keep the loop from every other session.
+``--paint N`` times N updates of Raw rectangles, a 640x480 one and 32 small
+ones, on a 1920x1080 desktop with a cursor, the screen read after every
+update, every tenth, and only at the end: what painting costs with the
+image made when read.
+``--region N`` counts the bytes ``expectRegion`` receives waiting on a
+200x50 label on a 3840x2160 desktop that changes after N ticks of a video
+and a clock elsewhere, asking for the whole screen and for the label.
+``--expect N`` times N updates painting a video and a clock with an expect
+on a label elsewhere compared after each, and reading the expect's target
+image with and without the cache.
+``--offload N`` replays the synthetic ZRLE, Tight and RRE fixtures to N
+asyncio sessions the same way, decoding where the session parses and with
+each session's ``decode_executor`` a thread pool and a process pool.
+
+Every fixture timing ends with the bytes per update it read and the rate
+it decoded them at; ``--fixture synthetic-tight-bgrx8888`` is the same
+scenes as the default fixture, in Tight, and ``synthetic-rre-bgrx8888``
+sends them as tens of thousands of RRE subrectangles.
 """
 from __future__ import annotations
 
 import argparse
+import asyncio
 import cProfile
+import functools
 import gc
 import gzip
 import hashlib
+import io
 import json
 import os
 import platform
+import random
 import pstats
 import subprocess
+import tempfile
 import time
+import timeit
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional
+from struct import pack, unpack
+from typing import Callable, Dict, List, Optional, Union
 from unittest import mock
 
 import PIL
+from PIL import Image
 
 import vncdotool
-from vncdotool import client
+from tests.goldens import scenes, transcode
+from vncdotool import aio, client, framebuffer, session
+from vncdotool.const import AuthTypes, Encoding
+from vncdotool.damage import overlaps
 
 REPO_ROOT = Path(__file__).resolve().parent.parent.parent
 FIXTURE_ROOT = REPO_ROOT / "tests" / "unit" / "fixtures" / "goldens"
@@ -40,14 +95,456 @@ def _make_client() -> client.VNCDoToolClient:
     for name in ("shared", "nocursor", "pseudocursor", "pseudodesktop", "last_rect", "qemu_extended_key"):
         setattr(cli.factory, name, False)
     cli.factory.password = None
+    # Images decode in place: what is timed is the decode, on this thread.
+    cli.decodeInBackground = functools.partial(session.RFBSession.decodeInBackground, cli)  # type: ignore[method-assign]
     return cli
 
 
-def _replay(init: bytes, steps: List[bytes]) -> None:
+def _make_session() -> session.RFBSession:
+    return session.RFBSession()
+
+
+def _replay(
+    init: bytes,
+    steps: List[bytes],
+    make: Callable[[], Union[client.VNCDoToolClient, session.RFBSession]] = _make_client,
+) -> None:
+    cli = make()
+    cli.feed(init)
+    for step in steps:
+        cli.feed(step)
+
+
+class _BytearrayBuffer:
+    """The receive buffer before ``rfb.ReceiveBuffer``: one bytearray, each
+    block sliced off the front. Kept here to count what it copied.
+    """
+
+    def __init__(self) -> None:
+        self._packet = bytearray()
+        self.copied = 0
+
+    def __len__(self) -> int:
+        return len(self._packet)
+
+    def extend(self, data: bytes) -> None:
+        self._packet.extend(data)
+        self.copied += len(data)
+
+    def clear(self) -> None:
+        self._packet.clear()
+
+    def peek(self, size: int) -> bytes:
+        return bytes(self._packet[:size])
+
+    def take(self, size: int) -> bytes:
+        # The slice and bytes() each copy the block, and the deletion moves
+        # everything behind it to the front.
+        block = bytes(self._packet[:size])
+        del self._packet[:size]
+        self.copied += 2 * size + len(self._packet)
+        return block
+
+
+def _peak_bytes(init: bytes, steps: List[bytes], chunk: int, band_rows: Optional[int]) -> int:
+    """Peak bytes allocated replaying the steps in ``chunk``-sized reads, the
+    framebuffer left out: it is the same size whatever the pump does.
+    """
     cli = _make_client()
+    cli.BAND_ROWS = band_rows
+    cli._decoders = {
+        encoding: (decoder, cli._pumpFor(decoder))
+        for encoding, (decoder, _) in cli._decoders.items()
+    }
     cli.dataReceived(init)
+    cli.dataReceived(steps[0])  # allocate the framebuffer before measuring
+    tracemalloc.start()
+    try:
+        for step in steps[1:]:
+            for offset in range(0, len(step), chunk):
+                cli.dataReceived(step[offset:offset + chunk])
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _bytes_copied(init: bytes, steps: List[bytes], chunk: int, legacy: bool) -> int:
+    """Bytes the receive buffer copied replaying the steps, delivered in
+    ``chunk``-sized reads the way a socket would hand them over.
+    """
+    cli = _make_client()
+    if legacy:
+        cli._packet = _BytearrayBuffer()
+    cli.dataReceived(init)
+    before = cli._packet.copied
+    for step in steps:
+        for offset in range(0, len(step), chunk):
+            cli.dataReceived(step[offset:offset + chunk])
+    return cli._packet.copied - before
+
+
+def _transport_writes(keys: int, mode: str) -> int:
+    """Transport writes, one syscall each, that typing ``keys`` keys takes:
+    a write per key event, one per key press, or one for the lot.
+    """
+    cli = _make_client()
+    if mode == "event":
+        for _ in range(keys):
+            cli.keyEvent(0x61, down=True)
+            cli.keyEvent(0x61, down=False)
+    elif mode == "press":
+        for _ in range(keys):
+            cli.keyPress("a")
+    else:
+        with cli.batch():
+            for _ in range(keys):
+                cli.keyPress("a")
+    return cli.transport.write.call_count + cli.transport.writeSequence.call_count
+
+
+# The smallest body each encoding can paint a rectangle with: one Hextile
+# tile with its background, an RRE background and no subrectangles.
+_SMALL_BODIES = {
+    "hextile": (Encoding.HEXTILE, pack("!B", 0x02) + bytes(4)),
+    "rre": (Encoding.RRE, pack("!I", 0) + bytes(4)),
+}
+
+
+def _dispatch_seconds(rects: int, name: str, repeat: int) -> float:
+    """Best time, of ``repeat``, a bare session takes to parse one update of
+    ``rects`` 16x16 rectangles, filling nothing: what is left is reading
+    each header and finding and running its decoder.
+    """
+    encoding, body = _SMALL_BODIES[name]
+    side = 16 * int(rects ** 0.5 + 1)
+    init = (
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", side, side, session.PixelFormat().to_bytes(), 0)
+    )
+    update = pack("!BxH", 0, rects) + b"".join(
+        pack("!HHHHi", 16 * (i % (side // 16)), 16 * (i // (side // 16)), 16, 16, encoding) + body
+        for i in range(rects)
+    )
+    best = float("inf")
+    for _ in range(repeat):
+        sess = _make_session()
+        sess.fillRectangle = lambda *args: None  # type: ignore[method-assign]
+        sess.feed(init)
+        start = time.perf_counter()
+        sess.feed(update)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# An 80x24 terminal of 8x16 character cells.
+_TERMINAL = (640, 384)
+_LINE = 16
+
+
+def _scroll_replay(lines: int, copyrect: bool) -> tuple[bytes, List[bytes]]:
+    """A terminal scrolling up ``lines`` lines, one update each: the whole
+    screen as Raw, or the old lines moved with CopyRect and only the new
+    one sent.
+    """
+    width, height = _TERMINAL
+    pixel_format = session.PixelFormat()
+    init = (
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", width, height, pixel_format.to_bytes(), 0)
+    )
+    noise = random.Random(0)
+
+    def line() -> bytes:
+        return noise.randbytes(width * _LINE * pixel_format.bypp)
+
+    def raw(y: int, h: int, pixels: bytes) -> bytes:
+        return pack("!HHHHi", 0, y, width, h, Encoding.RAW) + pixels
+
+    screen = [line() for _ in range(height // _LINE)]
+    steps = [pack("!BxH", 0, 1) + raw(0, height, b"".join(screen))]
+    for _ in range(lines):
+        screen = screen[1:] + [line()]
+        if copyrect:
+            steps.append(
+                pack("!BxH", 0, 2)
+                + pack("!HHHHi", 0, 0, width, height - _LINE, Encoding.COPY_RECTANGLE)
+                + pack("!HH", 0, _LINE)
+                + raw(height - _LINE, _LINE, screen[-1])
+            )
+        else:
+            steps.append(pack("!BxH", 0, 1) + raw(0, height, b"".join(screen)))
+    return init, steps
+
+
+def _fill_replay(updates: int) -> tuple[bytes, List[bytes]]:
+    """A 1920x1080 screen repainted ``updates`` times in RRE: one wallpaper
+    colour, then a dozen solid dialogs, each with a title bar.
+    """
+    width, height = 1920, 1080
+    pixel_format = session.PixelFormat()
+    init = (
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", width, height, pixel_format.to_bytes(), 0)
+    )
+    shapes = random.Random(0)
+    steps = []
+    for _ in range(updates):
+        subrects = []
+        for _ in range(12):
+            w, h = shapes.randrange(200, 800), shapes.randrange(100, 500)
+            x, y = shapes.randrange(width - w), shapes.randrange(height - h)
+            subrects.append(shapes.randbytes(3) + b"\x00" + pack("!HHHH", x, y, w, h))
+            subrects.append(shapes.randbytes(3) + b"\x00" + pack("!HHHH", x, y, w, 24))
+        steps.append(
+            pack("!BxH", 0, 1)
+            + pack("!HHHHi", 0, 0, width, height, Encoding.RRE)
+            + pack("!I", len(subrects)) + b"\x20\x40\x60\x00" + b"".join(subrects)
+        )
+    return init, steps
+
+
+_DESKTOP = (1920, 1080)
+
+
+def _paint_replay(updates: int) -> tuple[bytes, List[bytes]]:
+    """A 1920x1080 desktop and a cursor shape, then ``updates`` updates of
+    Raw rectangles: a 640x480 video playing, and 32 small ones -- text, a
+    clock, progress bars -- scattered over the rest."""
+    width, height = _DESKTOP
+    pixel_format = session.PixelFormat()
+    init = (
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", width, height, pixel_format.to_bytes(), 0)
+    )
+    noise = random.Random(0)
+    steps = [
+        pack("!BxH", 0, 2) + pack("!HHHHi", 0, 0, width, height, Encoding.RAW)
+        + bytes(width * height * pixel_format.bypp)
+        + pack("!HHHHi", 0, 0, 16, 16, Encoding.PSEUDO_CURSOR)
+        + b"\xff" * (16 * 16 * pixel_format.bypp) + b"\xc0\x00" * 16
+    ]
+    for _ in range(updates):
+        rects = [
+            pack("!HHHHi", 64, 64, 640, 480, Encoding.RAW) + noise.randbytes(640 * 480 * pixel_format.bypp)
+        ]
+        for _ in range(32):
+            w, h = noise.randrange(16, 128), noise.randrange(8, 32)
+            x, y = noise.randrange(width - w), noise.randrange(height - h)
+            rects.append(
+                pack("!HHHHi", x, y, w, h, Encoding.RAW) + noise.randbytes(w * h * pixel_format.bypp)
+            )
+        steps.append(pack("!BxH", 0, len(rects)) + b"".join(rects))
+    return init, steps
+
+
+def _paint_seconds(init: bytes, steps: List[bytes], read_every: int) -> float:
+    """Seconds replaying ``steps``, reading the screen after every
+    ``read_every`` updates, and once at the end."""
+    cli = _make_client()
+    cli.feed(init)
+    start = time.perf_counter()
+    for i, step in enumerate(steps, 1):
+        cli.feed(step)
+        if i % read_every == 0:
+            cli.screen
+    cli.screen
+    return time.perf_counter() - start
+
+
+_4K = (3840, 2160)
+# A status label an expect waits on, a video and a clock elsewhere.
+_LABEL = (1800, 1000, 200, 50)
+_CHURN = [(64, 64, 640, 480), (3700, 2100, 100, 30)]
+
+
+def _requested(cli: client.VNCDoToolClient) -> List[tuple[int, ...]]:
+    """The (incremental, x, y, width, height) update requests ``cli`` has
+    written since last asked."""
+    sent = b"".join(
+        b"".join(args[0]) if name == "writeSequence" else args[0]
+        for name, args, _ in cli.transport.mock_calls  # type: ignore[attr-defined]
+    )
+    cli.transport.reset_mock()  # type: ignore[attr-defined]
+    return [unpack("!xBHHHH", sent[i:i + 10]) for i in range(0, len(sent), 10) if sent[i] == 3]
+
+
+def _region_expect(ticks: int, regions: bool) -> tuple[int, int, float]:
+    """Bytes received, updates and seconds for ``expectRegion`` waiting on a
+    200x50 label on a 3840x2160 desktop, asking for the label or for the
+    whole screen, while a video plays and a clock ticks elsewhere. The
+    label turns white on the ``ticks``-th tick.
+
+    The server plays one that keeps what changed for each client: a request
+    is answered with what it covers of the tick's changes, or held until a
+    tick changes some of it.
+    """
+    width, height = _4K
+    pixel_format = session.PixelFormat()
+    cli = _make_client()
+    cli.region_requests = regions
+    cli.feed(
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", width, height, pixel_format.to_bytes(), 0)
+    )
+    _requested(cli)
+    x, y, w, h = _LABEL
+    cli.expected = Image.new("RGB", (w, h), "white").histogram()
+    start = time.perf_counter()
+    matched: list = []
+    cli._expectCompare(None, (x, y, x + w, y + h), 0).addCallback(matched.append)
+    pending: List[tuple[int, ...]] = []
+    received = updates = tick = 0
+    while not matched:
+        pending += _requested(cli)
+        tick += 1
+        changes = _CHURN + ([_LABEL] if tick >= ticks else [])
+        rects = []
+        for incremental, *area in pending:
+            if not incremental:
+                rects.append(tuple(area))
+                continue
+            for change in changes:
+                left, top = max(area[0], change[0]), max(area[1], change[1])
+                right = min(area[0] + area[2], change[0] + change[2])
+                bottom = min(area[1] + area[3], change[1] + change[3])
+                if left < right and top < bottom:
+                    rects.append((left, top, right - left, bottom - top))
+        if not rects:
+            continue
+        pending = []
+        data = pack("!BxH", 0, len(rects))
+        for rect in rects:
+            pixel = b"\xff\xff\xff\x00" if tick >= ticks and overlaps(rect, _LABEL) else b"\x80\x80\x80\x00"
+            data += pack("!HHHHi", *rect, Encoding.RAW) + pixel * (rect[2] * rect[3])
+        received += len(data)
+        updates += 1
+        cli.feed(data)
+    return received, updates, time.perf_counter() - start
+
+
+def _expect_replay(updates: int) -> tuple[bytes, List[bytes]]:
+    """A 1920x1080 desktop, then ``updates`` updates of a 640x480 video and
+    a clock, Raw, neither inside ``_LABEL``."""
+    width, height = _DESKTOP
+    pixel_format = session.PixelFormat()
+    init = (
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", width, height, pixel_format.to_bytes(), 0)
+    )
+    noise = random.Random(0)
+    steps = [
+        pack("!BxH", 0, 1) + pack("!HHHHi", 0, 0, width, height, Encoding.RAW)
+        + bytes(width * height * pixel_format.bypp)
+    ]
+    for _ in range(updates):
+        rects = [
+            pack("!HHHHi", x, y, w, h, Encoding.RAW) + noise.randbytes(w * h * pixel_format.bypp)
+            for x, y, w, h in ((64, 64, 640, 480), (1800, 20, 100, 30))
+        ]
+        steps.append(pack("!BxH", 0, len(rects)) + b"".join(rects))
+    return init, steps
+
+
+def _expect_seconds(init: bytes, steps: List[bytes]) -> tuple[float, float]:
+    """Seconds replaying ``steps`` with ``expectRegion``'s comparison, for a
+    white label that never appears, after every update: in all, and in the
+    comparisons alone."""
+    cli = _make_client()
+    cli.feed(init)
+    x, y, w, h = _LABEL
+    box = (x, y, x + w, y + h)
+    expected = Image.new("RGB", (w, h), "white").histogram()
+    # The first comparison converts the whole desktop, whatever it skips.
+    cli.feed(steps[0])
+    cli._matches(box, 0, expected)
+    comparing = 0.0
+    start = time.perf_counter()
+    for step in steps[1:]:
+        cli.feed(step)
+        before = time.perf_counter()
+        cli._matches(box, 0, expected)
+        comparing += time.perf_counter() - before
+    return time.perf_counter() - start, comparing
+
+
+def _image_replay(kind: str) -> tuple[bytes, List[bytes]]:
+    """Each scene stretched to 1920x1080 and sent as one TightPNG ``kind``
+    image, an update each."""
+    width, height = _DESKTOP
+    init = (
+        b"RFB 003.003\n" + pack("!I", AuthTypes.NONE)
+        + pack("!HH16sI", width, height, session.PixelFormat().to_bytes(), 0)
+    )
+    control = {"jpeg": b"\x90", "png": b"\xa0"}[kind]
+    steps = []
+    for _, screen in transcode.screens():
+        fp = io.BytesIO()
+        screen.convert("RGB").resize(_DESKTOP).save(fp, format=kind)
+        data = fp.getvalue()
+        steps.append(
+            pack("!BxH", 0, 1)
+            + pack("!HHHHi", 0, 0, width, height, Encoding.TIGHT_PNG)
+            + control + transcode._compact(len(data)) + data
+        )
+    return init, steps
+
+
+class _InlineAsyncClient(aio.AsyncVNCClient):
+    """Decodes images where it parses them, as every decode was before."""
+
+    decodeInBackground = session.RFBSession.decodeInBackground  # type: ignore[assignment]
+
+
+# Fixtures --offload replays: encodings whose rectangles a session with a
+# decode executor reads whole and decodes on it.
+_OFFLOADED = ("synthetic-zrle-bgrx8888", "synthetic-tight-bgrx8888", "synthetic-rre-bgrx8888")
+
+
+async def _stall(
+    init: bytes, steps: List[bytes], sessions: int, make: Callable[[], aio.AsyncVNCClient]
+) -> tuple[List[float], float]:
+    """Feed each step to every session, one session a turn of the loop, and
+    time how late a 1 ms timer runs until every update is committed: the
+    lateness of each tick, and the seconds the whole replay took."""
+    clients = [make() for _ in range(sessions)]
+    remaining = [sessions * len(steps)]
+
+    def committed(rectangles: object = None) -> None:
+        remaining[0] -= 1
+
+    for cli in clients:
+        cli.feed(init)
+        cli.commitUpdate = committed  # type: ignore[method-assign]
+
+    stalls: List[float] = []
+
+    async def tick() -> None:
+        while remaining[0]:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - start - 0.001)
+
+    start = time.perf_counter()
+    ticker = asyncio.ensure_future(tick())
     for step in steps:
-        cli.dataReceived(step)
+        for cli in clients:
+            cli.feed(step)
+            await asyncio.sleep(0)
+    await ticker
+    return stalls, time.perf_counter() - start
+
+
+def _fixture(name: str) -> tuple[bytes, List[bytes]]:
+    """A committed fixture's handshake and its updates."""
+    fixture = FIXTURE_ROOT / name
+    init = gzip.decompress((fixture / "init.bin.gz").read_bytes())
+    return init, [gzip.decompress(p.read_bytes()) for p in sorted(fixture.glob("step-*.bin.gz"))]
+
+
+def _make_fallback_client() -> client.VNCDoToolClient:
+    cli = _make_client()
+    cli.fillRectangle = functools.partial(session.RFBSession.fillRectangle, cli)  # type: ignore[method-assign]
+    return cli
 
 
 def _call_counts(init: bytes, steps: List[bytes]) -> Dict[str, int]:
@@ -69,6 +566,44 @@ def _call_counts(init: bytes, steps: List[bytes]) -> Dict[str, int]:
     return dict(sorted(counts.items()))
 
 
+def _wire_bytes() -> Dict[str, float]:
+    """Bytes per update repainting the whole screen with each scene in turn,
+    as Raw and in each encoding transcode.py has an encoder for; streams
+    carry on from one scene to the next, as on a connection."""
+    width, height = scenes.SIZE
+    counts = {"raw": float(len(pack("!BxHHHHHi", 0, 1, 0, 0, width, height, 0)) + width * height * 4)}
+    for name, make in sorted(transcode.ENCODERS.items()):
+        encoder = make()
+        sizes = [len(transcode.update(encoder, screen)) for _, screen in transcode.screens()]
+        counts[name] = sum(sizes) / len(sizes)
+    return counts
+
+
+# What a decoder asks of the client per rectangle; each paints the screen.
+_CALLBACKS = ("updateRectangle", "fillRectangle", "copyRectangle")
+
+
+def _callbacks(init: bytes, steps: List[bytes]) -> Dict[str, int]:
+    """How many times the client is asked to paint, by callback."""
+    cli = _make_client()
+    counts = dict.fromkeys(_CALLBACKS, 0)
+
+    def counted(name: str) -> Callable[..., None]:
+        paint = getattr(cli, name)
+
+        def count(*args: object) -> None:
+            counts[name] += 1
+            paint(*args)
+        return count
+
+    for name in _CALLBACKS:
+        setattr(cli, name, counted(name))
+    cli.feed(init)
+    for step in steps:
+        cli.feed(step)
+    return counts
+
+
 def _git(*args: str) -> Optional[str]:
     return _run("git", "-C", str(REPO_ROOT), *args)
 
@@ -142,7 +677,8 @@ def _dirty(record_path: Path) -> bool:
         exempt = record_path.resolve().relative_to(REPO_ROOT).as_posix()
     except ValueError:
         exempt = None
-    return any(line[3:].strip() != exempt for line in status.splitlines())
+    # Each line is "XY path"; _git strips the first line's leading blank.
+    return any(line.split(None, 1)[-1] != exempt for line in status.splitlines())
 
 
 def _record(path: Path, entry: Dict[str, object]) -> None:
@@ -155,23 +691,226 @@ def main() -> int:
     parser.add_argument("--fixture", default="tigervnc-raw-bgrx8888")
     parser.add_argument("--repeat", type=int, default=300)
     parser.add_argument("--profile", type=int, metavar="RUNS", default=0)
+    parser.add_argument(
+        "--copies", action="store_true",
+        help="count bytes the receive buffer copies per update instead of timing",
+    )
+    parser.add_argument(
+        "--peak", action="store_true",
+        help="measure peak memory decoding whole rectangles and in row bands",
+    )
+    parser.add_argument(
+        "--sans-io", action="store_true",
+        help="time a bare protocol session, without Twisted or a framebuffer",
+    )
+    parser.add_argument(
+        "--keystrokes", type=int, metavar="KEYS", default=0,
+        help="count transport writes per 1000 keystrokes typing KEYS keys",
+    )
+    parser.add_argument(
+        "--dispatch", type=int, metavar="RECTS", default=0,
+        help="time per-rectangle dispatch over one update of RECTS small rectangles",
+    )
+    parser.add_argument(
+        "--scroll", type=int, metavar="LINES", default=0,
+        help="compare Raw alone with CopyRect on a terminal scrolling LINES lines",
+    )
+    parser.add_argument(
+        "--fill", type=int, metavar="UPDATES", default=0,
+        help="time UPDATES fill-heavy updates painted natively and by the fallback",
+    )
+    parser.add_argument(
+        "--wire", action="store_true",
+        help="compare the bytes repainting each scene takes in each encoding",
+    )
+    parser.add_argument(
+        "--stall", type=int, metavar="SESSIONS", default=0,
+        help="time how long SESSIONS sessions' TightPNG images hold up one event loop",
+    )
+    parser.add_argument(
+        "--paint", type=int, metavar="UPDATES", default=0,
+        help="time UPDATES updates of small rectangles, reading the screen more and less often",
+    )
+    parser.add_argument(
+        "--region", type=int, metavar="TICKS", default=0,
+        help="count the bytes an expectRegion receives waiting TICKS ticks for a label to change",
+    )
+    parser.add_argument(
+        "--expect", type=int, metavar="UPDATES", default=0,
+        help="time an expect compared after each of UPDATES updates painting elsewhere",
+    )
+    parser.add_argument(
+        "--offload", type=int, metavar="SESSIONS", default=0,
+        help="time how long SESSIONS sessions' ZRLE, Tight and RRE hold up one event loop",
+    )
+    parser.add_argument(
+        "--callbacks", action="store_true",
+        help="count the paint callbacks per update instead of timing",
+    )
+    parser.add_argument(
+        "--chunk", type=int, default=65536, metavar="BYTES",
+        help="read size --copies and --peak deliver the steps in [%(default)s]",
+    )
     parser.add_argument(
         "--record", nargs="?", const=str(RECORD_PATH), default=None, metavar="PATH",
         help=f"append one JSON line per run to PATH (default {RECORD_PATH.name})",
     )
     args = parser.parse_args()
+    if args.sans_io and args.record:
+        # bench.jsonl rows are compared line to line; a sans-IO row would
+        # read as a speedup of the client.
+        parser.error("--record times the client, not --sans-io")
+
+    if args.keystrokes:
+        print(f"{args.keystrokes} keystrokes")
+        for label, mode in (("per event", "event"), ("per press", "press"), ("one batch", "batch")):
+            writes = _transport_writes(args.keystrokes, mode)
+            print(f"  {label:9} {writes * 1000 / args.keystrokes:10.1f} writes per 1000 keystrokes")
+        return 0
 
-    fixture = FIXTURE_ROOT / args.fixture
-    init = gzip.decompress((fixture / "init.bin.gz").read_bytes())
-    steps = [gzip.decompress(p.read_bytes()) for p in sorted(fixture.glob("step-*.bin.gz"))]
+    if args.dispatch:
+        repeat = max(1, args.repeat // 30)
+        print(f"{args.dispatch} rectangles of 16x16 in one update, best of {repeat}")
+        for name in _SMALL_BODIES:
+            seconds = _dispatch_seconds(args.dispatch, name, repeat)
+            print(f"  {name:9} {seconds * 1e6 / args.dispatch:8.2f} us per rectangle")
+        return 0
+
+    if args.scroll:
+        repeat = max(1, args.repeat // 30)
+        print(f"{_TERMINAL[0]}x{_TERMINAL[1]} terminal scrolling {args.scroll} lines, best of {repeat}")
+        for label, copyrect in (("raw", False), ("copyrect", True)):
+            init, steps = _scroll_replay(args.scroll, copyrect)
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _replay(init, steps)
+                best = min(best, time.perf_counter() - start)
+            wire = sum(map(len, steps[1:])) / args.scroll
+            print(f"  {label:9} {wire:12.0f} bytes per line {best * 1e6 / len(steps):10.1f} us per update")
+        return 0
+
+    if args.wire:
+        counts = _wire_bytes()
+        print(f"each of the scenes repainted at {scenes.SIZE[0]}x{scenes.SIZE[1]}, bgrx8888")
+        for name, count in sorted(counts.items(), key=lambda item: item[1]):
+            print(f"  {name:9} {count:10.0f} bytes per update {count / counts['raw']:8.1%} of raw")
+        return 0
+
+    if args.stall:
+        print(f"{args.stall} sessions on one loop, each sent the scenes as "
+              f"{_DESKTOP[0]}x{_DESKTOP[1]} TightPNG images, "
+              f"{os.cpu_count() or 1} decode threads")
+        for kind in ("png", "jpeg"):
+            init, steps = _image_replay(kind)
+            for label, make_async in (("inline", _InlineAsyncClient), ("pool", aio.AsyncVNCClient)):
+                stalls, seconds = asyncio.run(_stall(init, steps, args.stall, make_async))
+                stalls.sort()
+                print(f"  {kind:4} {label:9} {stalls[-1] * 1e3:8.1f} ms longest stall"
+                      f" {stalls[len(stalls) // 2] * 1e3:6.1f} ms median"
+                      f" {seconds * 1e3 / (args.stall * len(steps)):8.2f} ms per update")
+        return 0
 
+    if args.paint:
+        repeat = max(1, args.repeat // 30)
+        init, steps = _paint_replay(args.paint)
+        print(f"{args.paint} updates of a 640x480 and 32 small Raw rectangles on "
+              f"{_DESKTOP[0]}x{_DESKTOP[1]}, best of {repeat}")
+        for label, read_every in (("every", 1), ("tenth", 10), ("end", len(steps) + 1)):
+            best = min(_paint_seconds(init, steps, read_every) for _ in range(repeat))
+            print(f"  read {label:6} {best * 1e3 / args.paint:10.3f} ms per update")
+        return 0
+
+    if args.region:
+        print(f"expectRegion on a {_LABEL[2]}x{_LABEL[3]} label on {_4K[0]}x{_4K[1]}, "
+              f"matching after {args.region} ticks of a video and a clock elsewhere")
+        for label, regions in (("screen", False), ("region", True)):
+            received, updates, seconds = _region_expect(args.region, regions)
+            print(f"  {label:9} {received / 1e6:10.2f} MB received {updates:6} updates {seconds * 1e3:10.1f} ms")
+        return 0
+
+    if args.expect:
+        repeat = max(1, args.repeat // 30)
+        init, steps = _expect_replay(args.expect)
+        print(f"{args.expect} updates of a 640x480 video and a clock on {_DESKTOP[0]}x{_DESKTOP[1]}, "
+              f"an expect on a {_LABEL[2]}x{_LABEL[3]} label after each, best of {repeat}")
+        total, comparing = min(_expect_seconds(init, steps) for _ in range(repeat))
+        print(f"  {total * 1e3 / args.expect:10.3f} ms per update {comparing * 1e6 / args.expect:10.1f} us comparing")
+        with tempfile.TemporaryDirectory() as directory:
+            target = os.path.join(directory, "label.png")
+            Image.new("RGB", _LABEL[2:], "white").save(target)
+            for label, load in (("cached", framebuffer.load_target), ("uncached", framebuffer._load_target)):
+                seconds = min(timeit.repeat(functools.partial(load, target), number=100, repeat=repeat))
+                print(f"  target {label:9} {seconds * 1e4:10.1f} us per read")
+        return 0
+
+    if args.offload:
+        workers = os.cpu_count() or 1
+        print(f"{args.offload} sessions on one loop, each sent a fixture's updates, {workers} decode workers")
+        with ThreadPoolExecutor(workers) as threads, ProcessPoolExecutor(workers) as processes:
+            # Started before the clock, not by the first session's first job.
+            for _ in range(workers):
+                processes.submit(int).result()
+            for name in _OFFLOADED:
+                init, steps = _fixture(name)
+                for label, make_async in (
+                    ("inline", _InlineAsyncClient),
+                    ("threads", functools.partial(aio.AsyncVNCClient, decode_executor=threads)),
+                    ("processes", functools.partial(aio.AsyncVNCClient, decode_executor=processes)),
+                ):
+                    stalls, seconds = asyncio.run(_stall(init, steps, args.offload, make_async))
+                    stalls.sort()
+                    print(f"  {name.split('-')[1]:5} {label:9} {stalls[-1] * 1e3:8.1f} ms longest stall"
+                          f" {stalls[len(stalls) // 2] * 1e3:6.1f} ms median"
+                          f" {seconds * 1e3 / (args.offload * len(steps)):8.2f} ms per update")
+        return 0
+
+    if args.fill:
+        repeat = max(1, args.repeat // 30)
+        init, steps = _fill_replay(args.fill)
+        print(f"{args.fill} fill-heavy 1920x1080 RRE updates, best of {repeat}")
+        for label, make_fill in (("fallback", _make_fallback_client), ("native", _make_client)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _replay(init, steps, make_fill)
+                best = min(best, time.perf_counter() - start)
+            print(f"  {label:9} {best * 1e3 / args.fill:10.2f} ms per update")
+        return 0
+
+    init, steps = _fixture(args.fixture)
+
+    make = _make_session if args.sans_io else _make_client
     _replay(init, steps)  # warm PIL's plugin registry and the import graph
 
+    if args.copies:
+        received = sum(map(len, steps))
+        print(f"{args.fixture}: {len(steps)} updates, {received} bytes in {args.chunk}-byte reads")
+        for label, legacy in (("bytearray", True), ("chunked", False)):
+            copied = _bytes_copied(init, steps, args.chunk, legacy)
+            print(f"  {label:9} {copied // len(steps):12} bytes copied per update"
+                  f"  ({copied / received:.2f}x received)")
+        return 0
+
+    if args.callbacks:
+        counts = _callbacks(init, steps)
+        print(f"{args.fixture}: {len(steps)} updates")
+        for name, count in counts.items():
+            print(f"  {name:16} {count / len(steps):8.1f} per update")
+        return 0
+
+    if args.peak:
+        print(f"{args.fixture}: {len(steps) - 1} updates in {args.chunk}-byte reads")
+        for label, band_rows in (("whole", None), ("64 rows", 64)):
+            peak = _peak_bytes(init, steps, args.chunk, band_rows)
+            print(f"  {label:9} {peak:12} bytes peak")
+        return 0
+
     if args.profile:
         profiler = cProfile.Profile()
         profiler.enable()
         for _ in range(args.profile):
-            _replay(init, steps)
+            _replay(init, steps, make)
         profiler.disable()
         stats = pstats.Stats(profiler)
         print(f"{args.fixture}: {len(steps)} updates x {args.profile} profiled runs")
@@ -182,7 +921,7 @@ def main() -> int:
     timings = []
     for _ in range(args.repeat):
         start = time.perf_counter()
-        _replay(init, steps)
+        _replay(init, steps, make)
         timings.append(time.perf_counter() - start)
 
     timings.sort()
@@ -190,13 +929,19 @@ def main() -> int:
     def us(fraction: float) -> float:
         return timings[int(fraction * (len(timings) - 1))] * 1e6
 
-    print(f"{args.fixture}: {len(steps)} updates x {args.repeat} runs")
+    mode = " (sans-IO)" if args.sans_io else ""
+    print(f"{args.fixture}: {len(steps)} updates x {args.repeat} runs{mode}")
     # Microseconds, and p10 as well as the median: the replay is under a
     # millisecond, so a tenth of a millisecond is a tenth of the measurement,
     # and the median alone moves with whatever else the machine is doing.
     print(f"  best   {us(0.0):8.1f} us")
     print(f"  p10    {us(0.10):8.1f} us")
     print(f"  median {us(0.50):8.1f} us")
+    # Bytes on the wire against the time to decode them, so fixtures of one
+    # scene set in different encodings compare: Raw against Tight, say.
+    wire = sum(map(len, steps))
+    print(f"  wire   {wire // len(steps):8} bytes per update"
+          f"  {wire / us(0.50):8.1f} MB/s at the median")
 
     if args.record:
         path = Path(args.record)
@@ -214,6 +959,7 @@ def main() -> int:
             "median_us": round(us(0.50), 1),
             "calls": counts,
             "calls_total": sum(counts.values()),
+            "bytes_copied": _bytes_copied(init, steps, 65536, legacy=False),
             "python": platform.python_version(),
             "implementation": platform.python_implementation(),
             "pillow": PIL.__version__,
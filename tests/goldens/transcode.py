@@ -0,0 +1,480 @@
+"""Encode the committed scenes into a golden fixture for an encoding the fleet
+does not serve.
+
+The fixture is synthetic: each step repaints the whole scene with this
+module's encoder, rather than carrying the delta a server chose to send. It
+replays and checks against the scene oracles like a captured one, and says
+where it came from in its conditions.json.
+
+    python -m tests.goldens.transcode tight
+    python -m tests.goldens.transcode tightpng
+    python -m tests.goldens.transcode zrle
+    python -m tests.goldens.transcode hextile
+    python -m tests.goldens.transcode rre
+    python -m tests.goldens.transcode corre
+    python -m tests.goldens.transcode zlib
+    python -m tests.goldens.transcode zlibhex
+    python -m tests.goldens.transcode trle
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import io
+import json
+import shutil
+import zlib
+from pathlib import Path
+from struct import pack
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+from PIL import Image
+
+from tests.goldens import scenes
+from vncdotool.const import Encoding
+
+FIXTURE_ROOT = Path(__file__).resolve().parents[1] / "unit" / "fixtures" / "goldens"
+# The handshake and ServerInit, from a capture at the scenes' geometry.
+INIT_FROM = FIXTURE_ROOT / "tigervnc-raw-bgrx8888"
+# Three-byte TPIXELs: 24-bit colour in a 32-bit pixel.
+PIXEL_FORMAT = "bgrx8888"
+TILE = 64
+
+Rect = Tuple[int, int, int, int]
+
+
+def _tiles(width: int, height: int) -> Iterator[Rect]:
+    for y in range(0, height, TILE):
+        for x in range(0, width, TILE):
+            yield x, y, min(TILE, width - x), min(TILE, height - y)
+
+
+def _compact(length: int) -> bytes:
+    out = bytearray()
+    for _ in range(2):
+        if length < 0x80:
+            break
+        out.append(length & 0x7F | 0x80)
+        length >>= 7
+    out.append(length)
+    return bytes(out)
+
+
+class TightEncoder:
+    """Tight as TightVNC lays it out: fills, two-colour and indexed
+    palettes, and full colour as it is or, where the image is smooth enough
+    to deflate to under half, gradient-filtered. No JPEG, whose loss the
+    oracles would not survive."""
+
+    ENCODING = Encoding.TIGHT
+
+    def __init__(self) -> None:
+        self.streams = [zlib.compressobj(9) for _ in range(4)]
+
+    def _data(self, stream: int, data: bytes) -> bytes:
+        if len(data) < 12:
+            return data
+        compressor = self.streams[stream]
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return _compact(len(compressed)) + compressed
+
+    def _trial(self, stream: int, data: bytes) -> int:
+        compressor = self.streams[stream].copy()
+        return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        """The screen a tile at a time, each a rectangle of its own."""
+        for x, y, w, h in _tiles(*screen.size):
+            pixels = screen.crop((x, y, x + w, y + h)).convert("RGB").tobytes()
+            yield (x, y, w, h), self.encode(pixels, w, h)
+
+    def encode(self, pixels: bytes, width: int, height: int) -> bytes:
+        colors = list(dict.fromkeys(pixels[i:i + 3] for i in range(0, len(pixels), 3)))
+        if len(colors) == 1:
+            return b"\x80" + colors[0]
+        if len(colors) == 2:
+            index = {color: i for i, color in enumerate(colors)}
+            rows = bytearray()
+            for y in range(height):
+                bits = 0
+                for x in range(width):
+                    bits = bits << 1 | index[pixels[(y * width + x) * 3:(y * width + x) * 3 + 3]]
+                bits <<= -width % 8
+                rows += bits.to_bytes((width + 7) // 8, "big")
+            return b"\x50\x01\x01" + b"".join(colors) + self._data(1, bytes(rows))
+        if len(colors) <= 16:
+            index = {color: i for i, color in enumerate(colors)}
+            indices = bytes(index[pixels[i:i + 3]] for i in range(0, len(pixels), 3))
+            return b"\x60\x01" + bytes((len(colors) - 1,)) + b"".join(colors) + self._data(2, indices)
+
+        filtered = _gradient(pixels, width)
+        if 2 * self._trial(3, filtered) < self._trial(0, pixels):
+            return b"\x70\x02" + self._data(3, filtered)
+        return b"\x00" + self._data(0, pixels)
+
+
+class TightPNGEncoder:
+    """TightPNG as noVNC-oriented servers send it: the whole screen as one
+    PNG, or a fill when it is one colour. PNG rather than JPEG, which is
+    lossy."""
+
+    ENCODING = Encoding.TIGHT_PNG
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        width, height = screen.size
+        rgb = screen.convert("RGB")
+        colors = rgb.getcolors(1)
+        if colors:
+            yield (0, 0, width, height), b"\x80" + bytes(colors[0][1])
+            return
+        fp = io.BytesIO()
+        rgb.save(fp, format="png")
+        yield (0, 0, width, height), b"\xa0" + _compact(len(fp.getvalue())) + fp.getvalue()
+
+
+def _gradient(pixels: bytes, width: int) -> bytes:
+    stride = width * 3
+    out = bytearray()
+    for i, value in enumerate(pixels):
+        left = pixels[i - 3] if i % stride >= 3 else 0
+        up = pixels[i - stride] if i >= stride else 0
+        up_left = pixels[i - stride - 3] if i >= stride and i % stride >= 3 else 0
+        predicted = min(max(left + up - up_left, 0), 255)
+        out.append((value - predicted) & 0xFF)
+    return bytes(out)
+
+
+class ZRLEEncoder:
+    """ZRLE as one rectangle per update, each 64x64 tile in whichever of raw,
+    solid, packed palette, plain RLE and palette RLE is shortest."""
+
+    ENCODING = Encoding.ZRLE
+
+    def __init__(self) -> None:
+        self.stream = zlib.compressobj(9)
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        width, height = screen.size
+        tiles = bytearray()
+        for y in range(0, height, TILE):
+            for x in range(0, width, TILE):
+                w, h = min(TILE, width - x), min(TILE, height - y)
+                tiles += self.tile(screen.crop((x, y, x + w, y + h)).convert("RGB").tobytes(), w, h)
+        compressed = self.stream.compress(bytes(tiles)) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+        yield (0, 0, width, height), pack("!L", len(compressed)) + compressed
+
+    @staticmethod
+    def tile(pixels: bytes, width: int, height: int) -> bytes:
+        # CPIXELs of bgrx8888: the low three bytes of a little-endian pixel.
+        cpixels = [bytes((pixels[i + 2], pixels[i + 1], pixels[i])) for i in range(0, len(pixels), 3)]
+        colors = list(dict.fromkeys(cpixels))
+        if len(colors) == 1:
+            return b"\x01" + colors[0]
+        index = {color: i for i, color in enumerate(colors)}
+        runs: List[Tuple[bytes, int]] = []
+        for cpixel in cpixels:
+            if runs and runs[-1][0] == cpixel:
+                runs[-1] = (cpixel, runs[-1][1] + 1)
+            else:
+                runs.append((cpixel, 1))
+
+        def run_length(length: int) -> bytes:
+            length -= 1
+            return b"\xff" * (length // 255) + bytes((length % 255,))
+
+        candidates = [b"\x00" + b"".join(cpixels)]
+        candidates.append(b"\x80" + b"".join(color + run_length(n) for color, n in runs))
+        if len(colors) <= 16:
+            bits = 1 if len(colors) == 2 else 2 if len(colors) <= 4 else 4
+            packed = bytearray()
+            for y in range(height):
+                row = 0
+                for cpixel in cpixels[y * width:(y + 1) * width]:
+                    row = row << bits | index[cpixel]
+                row <<= -(width * bits) % 8
+                packed += row.to_bytes((width * bits + 7) // 8, "big")
+            candidates.append(bytes((len(colors),)) + b"".join(colors) + packed)
+        if len(colors) <= 127:
+            candidates.append(
+                bytes((0x80 | len(colors),)) + b"".join(colors) + b"".join(
+                    bytes((index[color],)) if n == 1 else bytes((0x80 | index[color],)) + run_length(n)
+                    for color, n in runs
+                )
+            )
+        return min(candidates, key=len)
+
+
+class TRLEEncoder:
+    """TRLE as one rectangle per update: ZRLE's tiles at 16x16 with no
+    zlib, reusing the last tile's palette where it is the same."""
+
+    ENCODING = Encoding.TRLE
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        width, height = screen.size
+        tiles = bytearray()
+        previous = b""
+        for y in range(0, height, 16):
+            for x in range(0, width, 16):
+                w, h = min(16, width - x), min(16, height - y)
+                tile = ZRLEEncoder.tile(screen.crop((x, y, x + w, y + h)).convert("RGB").tobytes(), w, h)
+                subencoding = tile[0]
+                if 2 <= subencoding <= 16 or subencoding >= 130:
+                    end = 1 + 3 * (subencoding & 127)
+                    if tile[1:end] == previous:
+                        tile = bytes((127 if subencoding <= 16 else 129,)) + tile[end:]
+                    else:
+                        previous = tile[1:end]
+                tiles += tile
+        yield (0, 0, width, height), bytes(tiles)
+
+
+class HextileEncoder:
+    """Hextile as one rectangle per update: each 16x16 tile a background,
+    subrects of runs along its rows -- one foreground or coloured -- or raw
+    where that is shorter."""
+
+    ENCODING = Encoding.HEXTILE
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        width, height = screen.size
+        tiles = bytearray()
+        background = None
+        for y in range(0, height, 16):
+            for x in range(0, width, 16):
+                w, h = min(16, width - x), min(16, height - y)
+                pixels = screen.crop((x, y, x + w, y + h)).convert("RGB").tobytes()
+                tile, background = self.tile(pixels, w, h, background)
+                tiles += tile
+        yield (0, 0, width, height), bytes(tiles)
+
+    @staticmethod
+    def tile(pixels: bytes, width: int, height: int, background: Union[bytes, None]) -> Tuple[bytes, Union[bytes, None]]:
+        # bgrx8888 pixels
+        row_pixels = [
+            [bytes((pixels[i + 2], pixels[i + 1], pixels[i], 0)) for i in range(y * width * 3, (y + 1) * width * 3, 3)]
+            for y in range(height)
+        ]
+        raw = bytes((1,)) + b"".join(b"".join(row) for row in row_pixels)
+        counts: Dict[bytes, int] = {}
+        for row in row_pixels:
+            for pixel in row:
+                counts[pixel] = counts.get(pixel, 0) + 1
+        bg = max(counts, key=counts.__getitem__)
+        subrects = []
+        for y, row in enumerate(row_pixels):
+            x = 0
+            while x < width:
+                end = x + 1
+                while end < width and row[end] == row[x]:
+                    end += 1
+                if row[x] != bg:
+                    subrects.append((row[x], x, y, end - x))
+                x = end
+        if len(subrects) > 255:
+            return raw, None
+        flags = 0
+        header = b""
+        if bg != background:
+            flags |= 2
+            header += bg
+        if subrects:
+            flags |= 8
+            foregrounds = {color for color, _, _, _ in subrects}
+            if len(foregrounds) == 1:
+                flags |= 4
+                header += foregrounds.pop() + bytes((len(subrects),))
+                body = b"".join(bytes((x << 4 | y, (w - 1) << 4)) for _, x, y, w in subrects)
+            else:
+                flags |= 16
+                header += bytes((len(subrects),))
+                body = b"".join(color + bytes((x << 4 | y, (w - 1) << 4)) for color, x, y, w in subrects)
+            header += body
+        encoded = bytes((flags,)) + header
+        if len(encoded) >= len(raw):
+            return raw, None
+        return encoded, bg
+
+
+def _bgrx(screen: Image.Image) -> bytes:
+    """The screen's pixels in bgrx8888."""
+    blue, green, red = screen.convert("RGB").split()[::-1]
+    return Image.merge("RGBA", (blue, green, red, Image.new("L", screen.size))).tobytes()
+
+
+class ZlibEncoder:
+    """ZLIB: the whole screen's Raw pixels through one stream."""
+
+    ENCODING = Encoding.ZLIB
+
+    def __init__(self) -> None:
+        self.stream = zlib.compressobj(6)
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        compressed = self.stream.compress(_bgrx(screen)) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+        yield (0, 0, *screen.size), pack("!L", len(compressed)) + compressed
+
+
+class ZlibHexEncoder(HextileEncoder):
+    """ZlibHex: Hextile's tiles, each deflated where that is shorter -- raw
+    tiles on one stream, the rest on another."""
+
+    ENCODING = Encoding.ZLIBHEX
+    ZLIB_RAW, ZLIB_HEX = 32, 64
+
+    def __init__(self) -> None:
+        self.raw = zlib.compressobj(6)
+        self.hex = zlib.compressobj(6)
+
+    def tile(self, pixels: bytes, width: int, height: int,  # type: ignore[override]
+             background: Union[bytes, None]) -> Tuple[bytes, Union[bytes, None]]:
+        encoded, background = HextileEncoder.tile(pixels, width, height, background)
+        flags, body = encoded[0], encoded[1:]
+        if len(body) < 16:
+            return encoded, background
+        if flags & 1:
+            stream, flags = self.raw, self.ZLIB_RAW
+        else:
+            stream, flags = self.hex, flags | self.ZLIB_HEX
+        # Trial first: what goes through a stream has to be sent.
+        trial = stream.copy()
+        if len(trial.compress(body) + trial.flush(zlib.Z_SYNC_FLUSH)) + 2 >= len(body):
+            return encoded, background
+        compressed = stream.compress(body) + stream.flush(zlib.Z_SYNC_FLUSH)
+        return bytes((flags,)) + pack("!H", len(compressed)) + compressed, background
+
+
+def _subrects(pixels: bytes, width: int, height: int) -> Tuple[bytes, List[Tuple[bytes, int, int, int, int]]]:
+    """The commonest bgrx8888 pixel, and every other one as runs along the
+    rows, each run merged with the same run in the rows below it."""
+    cpixels = [bytes((pixels[i + 2], pixels[i + 1], pixels[i], 0)) for i in range(0, len(pixels), 3)]
+    counts: Dict[bytes, int] = {}
+    for pixel in cpixels:
+        counts[pixel] = counts.get(pixel, 0) + 1
+    background = max(counts, key=counts.__getitem__)
+    # (colour, x, width) of the runs still open, to the subrect they grow
+    open_runs: Dict[Tuple[bytes, int, int], List[int]] = {}
+    done: List[Tuple[bytes, int, int, int, int]] = []
+    for y in range(height):
+        row = cpixels[y * width:(y + 1) * width]
+        runs = {}
+        x = 0
+        while x < width:
+            end = x + 1
+            while end < width and row[end] == row[x]:
+                end += 1
+            if row[x] != background:
+                key = (row[x], x, end - x)
+                subrect = open_runs.pop(key, None)
+                if subrect is None:
+                    subrect = [y, 0]
+                subrect[1] += 1
+                runs[key] = subrect
+            x = end
+        done.extend((color, x, top, w, h) for (color, x, w), (top, h) in open_runs.items())
+        open_runs = runs
+    done.extend((color, x, top, w, h) for (color, x, w), (top, h) in open_runs.items())
+    return background, done
+
+
+class RREEncoder:
+    """RRE as one rectangle per update: the commonest colour, and every
+    other one in subrectangles -- thousands of them, for the scenes' text
+    and gradients."""
+
+    ENCODING = Encoding.RRE
+    GEOMETRY = "!HHHH"
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        width, height = screen.size
+        yield (0, 0, width, height), self.encode(screen.convert("RGB").tobytes(), width, height)
+
+    def encode(self, pixels: bytes, width: int, height: int) -> bytes:
+        background, subrects = _subrects(pixels, width, height)
+        return pack("!I", len(subrects)) + background + b"".join(
+            color + pack(self.GEOMETRY, x, y, w, h) for color, x, y, w, h in subrects
+        )
+
+
+class CoRREEncoder(RREEncoder):
+    """RRE in 64x64 rectangles, whose subrectangles fit a byte each way."""
+
+    ENCODING = Encoding.CORRE
+    GEOMETRY = "!BBBB"
+
+    def rects(self, screen: Image.Image) -> Iterator[Tuple[Rect, bytes]]:
+        for x, y, w, h in _tiles(*screen.size):
+            pixels = screen.crop((x, y, x + w, y + h)).convert("RGB").tobytes()
+            yield (x, y, w, h), self.encode(pixels, w, h)
+
+
+Encoder = Union[TightEncoder, TightPNGEncoder, ZRLEEncoder, TRLEEncoder, HextileEncoder, RREEncoder, ZlibEncoder]
+
+ENCODERS: Dict[str, Callable[[], Encoder]] = {
+    "corre": CoRREEncoder,
+    "hextile": HextileEncoder,
+    "rre": RREEncoder,
+    "tight": TightEncoder,
+    "tightpng": TightPNGEncoder,
+    "trle": TRLEEncoder,
+    "zlib": ZlibEncoder,
+    "zlibhex": ZlibHexEncoder,
+    "zrle": ZRLEEncoder,
+}
+
+
+def update(encoder: Encoder, screen: Image.Image) -> bytes:
+    """One FramebufferUpdate repainting ``screen``."""
+    rects = list(encoder.rects(screen))
+    out = bytearray(pack("!BxH", 0, len(rects)))
+    for (x, y, w, h), body in rects:
+        out += pack("!HHHHi", x, y, w, h, encoder.ENCODING) + body
+    return bytes(out)
+
+
+def screens() -> Iterator[Tuple[str, Image.Image]]:
+    """Each scene the captures step through, in their order."""
+    keys: List[str] = [path.name.split("-", 2)[2].removesuffix(".bin.gz")
+                       for path in sorted(INIT_FROM.glob("step-*.bin.gz"))]
+    for key in keys:
+        with Image.open(scenes.OUT_DIR / f"{key}.png") as screen:
+            screen.load()
+            yield key, screen
+
+
+def transcode(name: str) -> Path:
+    encoder = ENCODERS[name]()
+    out = FIXTURE_ROOT / f"synthetic-{name}-{PIXEL_FORMAT}"
+    if out.exists():
+        shutil.rmtree(out)
+    out.mkdir(parents=True)
+    shutil.copy(INIT_FROM / "init.bin.gz", out / "init.bin.gz")
+
+    for index, (key, screen) in enumerate(screens(), 1):
+        data = update(encoder, screen)
+        (out / f"step-{index:02}-{key}.bin.gz").write_bytes(gzip.compress(data, mtime=0))
+
+    conditions = {
+        "geometry": list(scenes.SIZE),
+        "meta": {
+            "source": f"transcoded by tests/goldens/transcode.py {name}, not captured",
+            "init_from": INIT_FROM.name,
+        },
+        "pixel_format": PIXEL_FORMAT,
+        "server": "synthetic",
+        "tolerance": 0,
+    }
+    (out / "conditions.json").write_text(json.dumps(conditions, indent=2, sort_keys=True) + "\n")
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("encoding", choices=sorted(ENCODERS))
+    args = parser.parse_args()
+    out = transcode(args.encoding)
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
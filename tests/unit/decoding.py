@@ -0,0 +1,61 @@
+"""What the decoder tests share: a client past the handshake, its painting
+mocked, and the FramebufferUpdate messages fed to it."""
+from __future__ import annotations
+
+import functools
+from struct import pack
+from unittest import TestCase, mock
+
+from vncdotool import client, rfb, session
+
+
+def make_client(decode_in_place: bool = False) -> client.VNCDoToolClient:
+    cli = client.VNCDoToolClient()
+    cli.transport = mock.Mock()
+    cli.factory = mock.Mock()
+    cli.factory.shared = 0
+    cli.factory.password = None
+    if decode_in_place:
+        # No reactor, so no thread pool: images decode in place.
+        cli.decodeInBackground = functools.partial(session.RFBSession.decodeInBackground, cli)
+    return cli
+
+
+def connect(
+    cli: client.VNCDoToolClient, width: int, height: int, pixel_format: rfb.PixelFormat | None = None
+) -> client.VNCDoToolClient:
+    """Take `cli` through an RFB 3.3 handshake to a `width` x `height` screen."""
+    cli.dataReceived(b"RFB 003.003\n" + pack("!I", 1))
+    cli.dataReceived(pack("!HH16sI", width, height, (pixel_format or rfb.PixelFormat()).to_bytes(), 0))
+    return cli
+
+
+def rect(x: int, y: int, width: int, height: int, encoding: int, body: bytes = b"") -> bytes:
+    return pack("!HHHHi", x, y, width, height, encoding) + body
+
+
+def update(*rects: bytes) -> bytes:
+    return pack("!BxH", 0, len(rects)) + b"".join(rects)
+
+
+class DecoderTestCase(TestCase):
+    """A client connected to a `width` x `height` screen in `pixel_format`."""
+
+    width = height = 64
+    pixel_format: rfb.PixelFormat | None = None
+    decode_in_place = False
+
+    def setUp(self) -> None:
+        self.cli = connect(make_client(self.decode_in_place), self.width, self.height, self.pixel_format)
+        self.cli.updateRectangle = mock.Mock()
+        self.cli.fillRectangle = mock.Mock()
+        self.cli.commitUpdate = mock.Mock()
+        self.cli.vncProtocolError = mock.Mock()
+
+    def painted(self, once: bool = True) -> bytes:
+        """The pixels of the last rectangle painted, the only one if `once`."""
+        self.cli.vncProtocolError.assert_not_called()
+        if once:
+            self.cli.updateRectangle.assert_called_once()
+        (_, _, _, _, pixels, _), _ = self.cli.updateRectangle.call_args
+        return bytes(pixels)
@@ -0,0 +1,207 @@
+import asyncio
+import io
+from struct import pack, unpack
+from unittest import IsolatedAsyncioTestCase
+
+from PIL import Image
+
+from vncdotool import aio
+from vncdotool.const import AuthTypes, Encoding, FenceFlags, MsgC2S, MsgS2C
+from vncdotool.session import AuthenticationError, PixelFormat
+
+
+class FakeServer:
+    """Just enough of an RFB 3.8 server: Raw updates of a solid screen."""
+
+    def __init__(self, auth: int = AuthTypes.NONE, width: int = 4, height: int = 2) -> None:
+        self.auth = auth
+        self.width = width
+        self.height = height
+        self.pixel = b"\x00\x00\x00\x00"
+        self.keys: list[tuple[int, int]] = []
+        self.requests = 0
+        # (incremental, x, y, width, height) of each update request.
+        self.asked: list[tuple[int, ...]] = []
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"{host}::{port}"
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await self.serve(reader, writer)
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b"RFB 003.008\n")
+        await reader.readexactly(12)
+        writer.write(pack("!BB", 1, self.auth))
+        await reader.readexactly(1)
+        if self.auth != AuthTypes.NONE:
+            writer.write(bytes(16))  # challenge
+            await reader.readexactly(16)
+        writer.write(pack("!I", 0))
+        await reader.readexactly(1)  # ClientInit
+        writer.write(pack("!HH16sI", self.width, self.height, PixelFormat().to_bytes(), 0))
+
+        while True:
+            (msg,) = await reader.readexactly(1)
+            if msg == MsgC2S.SET_PIXEL_FORMAT:
+                await reader.readexactly(19)
+            elif msg == MsgC2S.SET_ENCODING:
+                (count,) = unpack("!xH", await reader.readexactly(3))
+                encodings = unpack(f"!{count}i", await reader.readexactly(4 * count))
+                if Encoding.PSEUDO_FENCE in encodings:
+                    # Announce fences with a request of our own.
+                    writer.write(pack("!BxxxIB", MsgS2C.SERVER_FENCE, FenceFlags.REQUEST, 0))
+            elif msg == MsgC2S.FRAMEBUFFER_UPDATE_REQUEST:
+                self.asked.append(unpack("!BHHHH", await reader.readexactly(9)))
+                self.requests += 1
+                writer.write(
+                    pack("!BxH", MsgS2C.FRAMEBUFFER_UPDATE, 1)
+                    + pack("!HHHHi", 0, 0, self.width, self.height, Encoding.RAW)
+                    + self.pixel * (self.width * self.height)
+                )
+            elif msg == MsgC2S.KEY_EVENT:
+                down, key = unpack("!BxxI", await reader.readexactly(7))
+                self.keys.append((key, down))
+            elif msg == MsgC2S.POINTER_EVENT:
+                await reader.readexactly(5)
+            elif msg == MsgC2S.CLIENT_FENCE:
+                flags, length = unpack("!xxxIB", await reader.readexactly(8))
+                payload = await reader.readexactly(length)
+                if flags & FenceFlags.REQUEST:
+                    writer.write(
+                        pack("!BxxxIB", MsgS2C.SERVER_FENCE, flags & ~FenceFlags.REQUEST, length)
+                        + payload
+                    )
+            else:
+                raise AssertionError(f"unexpected message {msg}")
+            await writer.drain()
+
+
+class TestAsyncClient(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakeServer()
+        self.address = await self.server.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.stop()
+
+    async def test_capture_screen(self):
+        self.server.pixel = b"\x10\x20\x30\x00"
+        async with await aio.connect(self.address, timeout=5) as client:
+            fp = io.BytesIO()
+            await client.capture_screen(fp, format="png")
+
+        fp.seek(0)
+        image = Image.open(fp)
+        self.assertEqual(image.size, (4, 2))
+        self.assertEqual(image.getpixel((3, 1)), (0x10, 0x20, 0x30))
+
+    async def test_capture_region_asks_for_the_region(self):
+        self.server.pixel = b"\x10\x20\x30\x00"
+        async with await aio.connect(self.address, timeout=5) as client:
+            fp = io.BytesIO()
+            await client.capture_region(fp, 1, 0, 2, 2, format="png")
+
+        self.assertEqual(self.server.asked, [(0, 1, 0, 2, 2)])
+        fp.seek(0)
+        self.assertEqual(Image.open(fp).getpixel((1, 1)), (0x10, 0x20, 0x30))
+
+    async def test_keys_reach_the_server(self):
+        async with await aio.connect(self.address, fence=True, timeout=5) as client:
+            await client.refresh_screen()  # the server has announced fences
+            client.key_press("a")
+            await client.sync()
+
+        self.assertEqual(self.server.keys, [(ord("a"), 1), (ord("a"), 0)])
+
+    async def test_sync_waits_for_the_fence_answer(self):
+        async with await aio.connect(self.address, fence=True, timeout=5) as client:
+            await client.refresh_screen()  # the server has announced fences
+            await client.sync()
+            self.assertIsNotNone(client.rtt)
+
+    async def test_fences_are_offered_only_when_asked_for(self):
+        async with await aio.connect(self.address, timeout=5) as client:
+            await client.refresh_screen()
+            self.assertNotIn(Encoding.PSEUDO_FENCE, client.negotiated_encodings)
+            await client.sync()
+            self.assertIsNone(client.rtt)
+
+    async def test_expect_screen_waits_for_a_match(self):
+        target = io.BytesIO()
+        Image.new("RGB", (4, 2), "white").save(target, format="png")
+        target.seek(0)
+
+        async with await aio.connect(self.address, timeout=5) as client:
+            await client.refresh_screen()
+            self.server.pixel = b"\xff\xff\xff\x00"
+            await asyncio.wait_for(client.expect_screen(target), 5)
+
+        self.assertGreaterEqual(self.server.requests, 2)
+
+
+class TestConcurrentRefresh(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.client = aio.AsyncVNCClient()
+        self.client.feed(b"RFB 003.003\n" + pack("!I", AuthTypes.NONE))
+        self.client.feed(pack("!HH16sI", 64, 64, PixelFormat().to_bytes(), 0))
+        self.client.data_to_send()
+
+    def requested(self) -> list[tuple[int, ...]]:
+        sent = self.client.data_to_send()
+        return [unpack("!xBHHHH", sent[i:i + 10]) for i in range(0, len(sent), 10)]
+
+    def paint(self, x: int, y: int) -> None:
+        self.client.feed(
+            pack("!BxH", MsgS2C.FRAMEBUFFER_UPDATE, 1)
+            + pack("!HHHHi", x, y, 8, 8, Encoding.RAW) + bytes(8 * 8 * 4)
+        )
+
+    async def test_a_second_region_is_asked_for_and_waited_on(self):
+        first = asyncio.ensure_future(self.client.refresh_screen(False, [(0, 0, 8, 8)]))
+        second = asyncio.ensure_future(self.client.refresh_screen(False, [(32, 32, 8, 8)]))
+        await asyncio.sleep(0)
+        self.assertEqual(self.requested(), [(0, 0, 0, 8, 8), (0, 32, 32, 8, 8)])
+
+        self.paint(0, 0)
+        await asyncio.sleep(0)
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+
+        self.paint(32, 32)
+        await asyncio.wait_for(second, 5)
+        self.assertEqual(self.requested(), [])
+
+    async def test_the_whole_screen_is_asked_for_on_top_of_a_region(self):
+        first = asyncio.ensure_future(self.client.refresh_screen(False, [(0, 0, 8, 8)]))
+        second = asyncio.ensure_future(self.client.refresh_screen())
+        await asyncio.sleep(0)
+        self.assertEqual(self.requested(), [(0, 0, 0, 8, 8), (0, 0, 0, 64, 64)])
+
+        self.paint(0, 0)
+        await asyncio.wait_for(asyncio.gather(first, second), 5)
+
+
+class TestAsyncAuthentication(IsolatedAsyncioTestCase):
+
+    async def test_a_password_is_required(self):
+        server = FakeServer(auth=AuthTypes.VNC_AUTHENTICATION)
+        address = await server.start()
+        try:
+            with self.assertRaises(AuthenticationError):
+                await aio.connect(address, timeout=5)
+        finally:
+            await server.stop()
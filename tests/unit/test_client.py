@@ -1,9 +1,13 @@
 from unittest import TestCase, mock
 import io
+import math
+import os
+import pathlib
 import struct
+import tempfile
 import warnings
 
-from vncdotool import client, pixelformat, rfb
+from vncdotool import client, framebuffer, pixelformat, rfb
 from vncdotool.pixelformat import PIXEL_FORMATS
 from vncdotool.keys import Key
 
@@ -25,6 +29,7 @@ class TestVNCDoToolClient(TestCase):
         self.client = client.VNCDoToolClient()
         self.client.transport = mock.Mock()
         self.client.factory = mock.Mock()
+        self.client.factory.continuous_updates = False
 
         # mock out a bunch of base class functions
         self.client.framebufferUpdateRequest = mock.Mock()  # type: ignore[assignment]
@@ -34,19 +39,48 @@ class TestVNCDoToolClient(TestCase):
 
     def test_vncConnectionMade(self):
         cli = self.client
-        cli._packet = bytearray(self.MSG_HANDSHAKE)
+        cli._packet.extend(self.MSG_HANDSHAKE)
         cli._handleInitial()
         cli._handleServerInit(self.MSG_INIT)
         factory = cli.factory
         factory.clientConnectionMade.assert_called_once_with(cli)
         self.client.setEncodings.assert_called_once_with([
             client.rfb.Encoding.RAW,
+            client.rfb.Encoding.COPY_RECTANGLE,
             client.rfb.Encoding.PSEUDO_CURSOR,
             client.rfb.Encoding.PSEUDO_DESKTOP_SIZE,
             client.rfb.Encoding.PSEUDO_LAST_RECT,
             client.rfb.Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT,
+            client.rfb.Encoding.PSEUDO_FENCE,
         ])
 
+    def test_vncConnectionMade_offers_chosen_encodings_and_levels(self):
+        cli = self.client
+        cli.encodings = [client.rfb.Encoding.TIGHT]
+        cli.compress_level = 6
+        cli.quality_level = 8
+        cli._packet.extend(self.MSG_HANDSHAKE)
+        cli._handleInitial()
+        cli._handleServerInit(self.MSG_INIT)
+
+        (encodings,), _ = self.client.setEncodings.call_args
+        self.assertEqual(encodings[:3], [
+            client.rfb.Encoding.TIGHT,
+            client.rfb.Encoding.PSEUDO_COMPRESSION_LEVEL_250,
+            client.rfb.Encoding.JPEG_24,
+        ])
+
+    def test_no_quality_level_without_24_bit_colour(self):
+        cli = self.client
+        cli.requested_pixel_format = PIXEL_FORMATS["rgb565"]
+        cli.quality_level = 8
+        cli._packet.extend(self.MSG_HANDSHAKE)
+        cli._handleInitial()
+        cli._handleServerInit(self.MSG_INIT)
+
+        (encodings,), _ = self.client.setEncodings.call_args
+        self.assertNotIn(client.rfb.Encoding.JPEG_24, encodings)
+
     def test_keyPress_single_alpha(self):
         cli = self.client
         cli.keyPress('a')
@@ -68,7 +102,7 @@ class TestVNCDoToolClient(TestCase):
     @mock.patch('vncdotool.client.Deferred')
     def test_captureScreen(self, Deferred):
         cli = self.client
-        cli._packet = bytearray(self.MSG_HANDSHAKE)
+        cli._packet.extend(self.MSG_HANDSHAKE)
         cli._handleInitial()
         cli._handleServerInit(self.MSG_INIT)
         cli.vncConnectionMade()
@@ -81,7 +115,7 @@ class TestVNCDoToolClient(TestCase):
     @mock.patch("vncdotool.client.Deferred")
     def test_captureScreen_with_format(self, Deferred):
         cli = self.client
-        cli._packet = bytearray(self.MSG_HANDSHAKE)
+        cli._packet.extend(self.MSG_HANDSHAKE)
         cli._handleInitial()
         cli._handleServerInit(self.MSG_INIT)
         cli.vncConnectionMade()
@@ -102,7 +136,7 @@ class TestVNCDoToolClient(TestCase):
     @mock.patch('vncdotool.client.Deferred')
     def test_expectScreen(self, Deferred, image_open):
         cli = self.client
-        cli._packet = bytearray(self.MSG_HANDSHAKE)
+        cli._packet.extend(self.MSG_HANDSHAKE)
         cli._handleInitial()
         cli._handleServerInit(self.MSG_INIT)
         cli.vncConnectionMade()
@@ -126,7 +160,7 @@ class TestVNCDoToolClient(TestCase):
         cli.screen = mock.Mock()
         cli.screen.histogram.return_value = [1, 2, 3]
         cli.screen.crop.return_value = cli.screen
-        result = cli._expectCompare(cli, None, 5)
+        result = cli._expectCompare(cli, (0, 0, 3, 1), 5)
         assert result == cli
 
     def test_expectCompareExactSuccess(self) -> None:
@@ -136,7 +170,7 @@ class TestVNCDoToolClient(TestCase):
         cli.screen = mock.Mock()
         cli.screen.histogram.return_value = [2, 2, 2]
         cli.screen.crop.return_value = cli.screen
-        result = cli._expectCompare(cli, None, 0)
+        result = cli._expectCompare(cli, (0, 0, 3, 1), 0)
         assert result == cli
 
     @mock.patch('vncdotool.client.Deferred')
@@ -145,18 +179,19 @@ class TestVNCDoToolClient(TestCase):
         cli.deferred = mock.Mock()
         cli.expected = [2, 2, 2]
         cli.framebufferUpdateRequest = mock.Mock()
+        cli.width, cli.height = 100, 100
         cli.screen = mock.Mock()
         cli.screen.histogram.return_value = [1, 1, 1]
         cli.screen.crop.return_value = cli.screen
 
-        result = cli._expectCompare(cli, None, 0)
+        result = cli._expectCompare(cli, (10, 20, 30, 40), 0)
 
         assert result != cli
         assert result == cli.deferred
         assert not cli.deferred.callback.called
 
-        cli.framebufferUpdateRequest.assert_called_once_with(incremental=1)
-        cli.deferred.addCallback.assert_called_once_with(cli._expectCompare, None, 0)
+        cli.framebufferUpdateRequest.assert_called_once_with(10, 20, 20, 20, True)
+        cli.deferred.addCallback.assert_called_once_with(cli._expectCompare, (10, 20, 30, 40), 0)
 
     @mock.patch('vncdotool.client.Deferred')
     def test_expectCompareMismatch(self, Deferred):
@@ -164,37 +199,33 @@ class TestVNCDoToolClient(TestCase):
         cli.deferred = mock.Mock()
         cli.expected = [2, 2]
         cli.framebufferUpdateRequest = mock.Mock()
+        cli.width, cli.height = 100, 100
         cli.screen = mock.Mock()
         cli.screen.histogram.return_value = [1, 1, 1]
         cli.screen.crop.return_value = cli.screen
 
-        result = cli._expectCompare(cli, None, 0)
+        result = cli._expectCompare(cli, (10, 20, 30, 40), 0)
 
         assert result != cli
         assert result == cli.deferred
         assert not cli.deferred.callback.called
 
-        cli.framebufferUpdateRequest.assert_called_once_with(incremental=1)
-        cli.deferred.addCallback.assert_called_once_with(cli._expectCompare, None, 0)
+        cli.framebufferUpdateRequest.assert_called_once_with(10, 20, 20, 20, True)
+        cli.deferred.addCallback.assert_called_once_with(cli._expectCompare, (10, 20, 30, 40), 0)
 
-    @mock.patch('PIL.Image.frombytes')
-    def test_updateRectangeFullScreen(self, frombytes):
+    def test_updateRectangeFullScreen(self):
         cli = self.client
-        cli.image = mock.Mock()
         cli.width, cli.height = 100, 200
-        data = mock.Mock()
-        frombytes.return_value = client.Image.new("RGB", (100, 200), (10, 20, 30))
-
-        cli.updateRectangle(0, 0, 100, 200, data, cli.pixel_format)
 
-        client.Image.frombytes.assert_called_once_with('RGB', (100, 200), data, 'raw', 'RGBX')
+        cli.updateRectangle(0, 0, 100, 200, b"\x0a\x14\x1e\x00" * (100 * 200), cli.pixel_format)
 
         assert cli.screen.size == (100, 200)
         assert cli.screen.getpixel((0, 0)) == (10, 20, 30)
+        assert cli.screen.getpixel((99, 199)) == (10, 20, 30)
 
     def test_updateRectangle_first_rect_not_at_origin(self) -> None:
         cli = self.client
-        cli._packet = bytearray(self.MSG_HANDSHAKE)
+        cli._packet.extend(self.MSG_HANDSHAKE)
         cli._handleInitial()
         cli._handleServerInit(struct.pack("!HH", 300, 200) + self.MSG_INIT[4:])
 
@@ -207,20 +238,16 @@ class TestVNCDoToolClient(TestCase):
         assert cli.screen.getpixel((50, 30)) == color
         assert cli.screen.getpixel((0, 0)) == (0, 0, 0)
 
-    @mock.patch('PIL.Image.frombytes')
-    def test_updateRectangeRegion(self, frombytes):
+    def test_updateRectangeRegion(self):
         cli = self.client
-        cli.image = mock.Mock()
-        cli.screen = mock.Mock()
-        cli.screen.size = (100, 100)
-        data = mock.Mock()
-
-        cli.updateRectangle(20, 10, 50, 40, data, cli.pixel_format)
+        cli.screen = client.Image.new("RGB", (100, 100), (1, 2, 3))
 
-        client.Image.frombytes.assert_called_once_with('RGB', (50, 40), data, 'raw', 'RGBX')
+        cli.updateRectangle(20, 10, 50, 40, b"\x0a\x14\x1e\x00" * (50 * 40), cli.pixel_format)
 
-        paste = cli.screen.paste
-        paste.assert_called_once_with(client.Image.frombytes.return_value, (20, 10))
+        assert cli.screen.getpixel((20, 10)) == (10, 20, 30)
+        assert cli.screen.getpixel((69, 49)) == (10, 20, 30)
+        assert cli.screen.getpixel((70, 49)) == (1, 2, 3)
+        assert cli.screen.getpixel((19, 10)) == (1, 2, 3)
 
     def test_commitUpdate(self) -> None:
         rects = mock.Mock()
@@ -249,7 +276,7 @@ class TestVNCDoToolClient(TestCase):
     )
 
     def _connect(self) -> None:
-        self.client._packet = bytearray(self.MSG_HANDSHAKE)
+        self.client._packet.extend(self.MSG_HANDSHAKE)
         self.client._handleInitial()
         self.client._handleServerInit(self.MSG_INIT)
 
@@ -264,7 +291,7 @@ class TestVNCDoToolClient(TestCase):
         cli.dataReceived(self.MSG_FBU_DESKTOP_SIZE_ONLY)
 
         self.assertEqual(fired, [])
-        cli.framebufferUpdateRequest.assert_called_once_with()
+        cli.framebufferUpdateRequest.assert_called_once_with(incremental=False)
 
     def test_refresh_completes_once_pixel_data_arrives(self) -> None:
         cli = self.client
@@ -444,16 +471,13 @@ class TestImageMode(TestCase):
         self.client.factory.clientConnectionFailed.assert_called_once()
         self.client.transport.loseConnection.assert_called_once()
 
-    @mock.patch('PIL.Image.frombytes')
-    def test_updateRectangle_does_not_warn(self, frombytes):
+    def test_updateRectangle_does_not_warn(self):
         cli = self.client
-        cli.image = mock.Mock()
         cli.width, cli.height = 100, 200
-        frombytes.return_value = client.Image.new("RGB", (100, 200))
 
         with warnings.catch_warnings():
             warnings.simplefilter("error", FutureWarning)
-            cli.updateRectangle(0, 0, 100, 200, mock.Mock(), cli.pixel_format)
+            cli.updateRectangle(0, 0, 100, 200, bytes(100 * 200 * 4), cli.pixel_format)
 
     def test_updateCursor_does_not_warn(self):
         cli = self.client
@@ -464,6 +488,577 @@ class TestImageMode(TestCase):
             cli.updateCursor(0, 0, 4, 4, b"\x00" * (4 * 4 * 4), b"\x00" * 4)
 
 
+class TestContinuousUpdates(TestCase):
+
+    END_OF_CONTINUOUS_UPDATES = bytes([rfb.MsgS2C.END_OF_CONTINUOUS_UPDATES])
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.factory.continuous_updates = True
+        self.client.width, self.client.height = 640, 480
+
+    def announce(self) -> None:
+        self.client._handleConnection(self.END_OF_CONTINUOUS_UPDATES)
+
+    def test_enabled_for_the_whole_desktop_once_the_server_announces_it(self):
+        self.announce()
+
+        self.client.transport.write.assert_called_once_with(
+            struct.pack("!BBHHHH", rfb.MsgC2S.ENABLE_CONTINUOUS_UPDATES, 1, 0, 0, 640, 480)
+        )
+        assert self.client.continuous_updates
+        assert rfb.Encoding.PSEUDO_CONTINUOUS_UPDATES in self.client.negotiated_encodings
+
+    def test_not_enabled_unless_the_factory_asks(self):
+        self.client.factory.continuous_updates = False
+        self.announce()
+
+        self.client.transport.write.assert_not_called()
+        assert not self.client.continuous_updates
+
+    def test_a_later_end_turns_the_mode_off(self):
+        self.announce()
+        self.client.endOfContinuousUpdates = mock.Mock()  # type: ignore[method-assign]
+        self.announce()
+
+        assert not self.client.continuous_updates
+        self.client.endOfContinuousUpdates.assert_called_once_with()
+
+    def test_refresh_uses_the_pushed_screen_without_a_request(self):
+        self.announce()
+        self.client.screen = client.Image.new("RGB", (640, 480))
+        self.client.transport.write.reset_mock()
+
+        d = self.client.refreshScreen()
+
+        assert d.called
+        self.client.transport.write.assert_not_called()
+
+    def test_the_first_refresh_still_asks_for_the_screen(self):
+        self.announce()
+        self.client.transport.write.reset_mock()
+
+        self.client.refreshScreen()
+
+        self.client.transport.write.assert_called_once()
+
+    def test_expect_waits_for_pushed_updates(self):
+        self.announce()
+        self.client.screen = client.Image.new("RGB", (640, 480))
+        self.client.expected = client.Image.new("RGB", (4, 4), "white").histogram()
+        self.client.transport.write.reset_mock()
+
+        d = self.client._expectCompare(None, (0, 0, 4, 4), 0)
+        self.client.commitUpdate([])
+        self.client.transport.write.assert_not_called()
+        assert not d.called
+
+        self.client.screen.paste((255, 255, 255), (0, 0, 4, 4))
+        self.client.commitUpdate([(0, 0, 4, 4)])
+        assert d.called
+        self.client.transport.write.assert_not_called()
+
+    def test_a_resize_moves_the_area(self):
+        self.announce()
+        self.client.transport.write.reset_mock()
+
+        self.client.updateDesktopSize(800, 600)
+
+        self.client.transport.write.assert_called_once_with(
+            struct.pack("!BBHHHH", rfb.MsgC2S.ENABLE_CONTINUOUS_UPDATES, 1, 0, 0, 800, 600)
+        )
+
+
+class TestSync(TestCase):
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+
+    def test_waits_for_the_answer_to_its_fence(self):
+        self.client.negotiated_encodings.add(rfb.Encoding.PSEUDO_FENCE)
+
+        d = self.client.sync()
+        (message,), _ = self.client.transport.write.call_args
+        assert not d.called
+
+        self.client._handleServerFencePayload(message[9:], rfb.FenceFlags.BLOCK_BEFORE)
+        assert d.called
+        assert self.client.rtt is not None
+
+    def test_an_unrelated_answer_does_not_fire_it(self):
+        self.client.negotiated_encodings.add(rfb.Encoding.PSEUDO_FENCE)
+
+        d = self.client.sync()
+        self.client._handleServerFencePayload(b"other", 0)
+        assert not d.called
+
+    def test_fires_at_once_without_fence_support(self):
+        d = self.client.sync()
+
+        assert d.called
+        self.client.transport.write.assert_not_called()
+
+
+class TestCopyRectangle(TestCase):
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.screen = client.Image.new("RGB", (4, 4))
+        # Every pixel different: (x, y, 0).
+        self.client.screen.putdata([(x, y, 0) for y in range(4) for x in range(4)])
+
+    def test_the_source_lands_on_the_destination(self) -> None:
+        self.client.copyRectangle(0, 0, 2, 2, 2, 2)
+
+        screen = self.client.screen
+        self.assertEqual(screen.getpixel((3, 3)), (1, 1, 0))
+        self.assertEqual(screen.getpixel((1, 1)), (1, 1, 0))  # the source is left alone
+
+    def test_an_overlapping_scroll_moves_every_row(self) -> None:
+        # Scroll up a row, the way a terminal does.
+        self.client.copyRectangle(0, 1, 0, 0, 4, 3)
+
+        rows = [self.client.screen.getpixel((2, y)) for y in range(4)]
+        self.assertEqual(rows, [(2, 1, 0), (2, 2, 0), (2, 3, 0), (2, 3, 0)])
+
+    def test_no_screen_yet_is_ignored(self) -> None:
+        self.client.screen = None
+
+        self.client.copyRectangle(0, 1, 0, 0, 4, 3)
+
+
+class TestFillRectangle(TestCase):
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.width, self.client.height = 8, 8
+
+    def test_the_color_is_unpacked_through_the_pixel_format(self) -> None:
+        self.client.updateRectangle = mock.Mock()  # type: ignore[method-assign]
+
+        self.client.fillRectangle(2, 3, 4, 2, b"\x10\x20\x30\x00")
+
+        screen = self.client.screen
+        self.assertEqual(screen.getpixel((2, 3)), (0x10, 0x20, 0x30))
+        self.assertEqual(screen.getpixel((5, 4)), (0x10, 0x20, 0x30))
+        self.assertEqual(screen.getpixel((6, 4)), (0, 0, 0))
+        self.client.updateRectangle.assert_not_called()
+
+    def test_another_pixel_format(self) -> None:
+        self.client.pixel_format = PIXEL_FORMATS["bgrx8888"]
+
+        self.client.fillRectangle(0, 0, 1, 1, b"\x10\x20\x30\x00")
+
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (0x30, 0x20, 0x10))
+
+    def test_the_screen_grows_to_hold_the_fill(self) -> None:
+        self.client.fillRectangle(6, 6, 4, 4, b"\xff\xff\xff\x00")
+
+        self.assertEqual(self.client.screen.size, (10, 10))
+
+
+class TestLazyScreen(TestCase):
+    """The framebuffer is bytes in the negotiated format, made into an
+    image only when read."""
+
+    RED = b"\xff\x00\x00\x00"
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.width, self.client.height = 64, 32
+        self.frombytes = mock.patch.object(client.Image, "frombytes", wraps=client.Image.frombytes)
+
+    @staticmethod
+    def converted(frombytes: mock.Mock) -> list[tuple[int, int]]:
+        """The sizes of the areas converted to RGB."""
+        return [size for (mode, size, *_), _ in frombytes.call_args_list if mode == "RGB"]
+
+    def test_painting_makes_no_image(self) -> None:
+        with self.frombytes as frombytes:
+            for x in range(0, 64, 8):
+                self.client.updateRectangle(x, 0, 8, 8, self.RED * 64, self.client.pixel_format)
+                self.client.fillRectangle(x, 8, 8, 8, self.RED)
+            self.client.copyRectangle(0, 0, 0, 16, 64, 16)
+
+        self.assertEqual(self.converted(frombytes), [])
+        self.assertEqual(self.client.screen.getpixel((63, 31)), (255, 0, 0))
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (255, 0, 0))
+
+    def test_a_read_converts_only_what_was_painted_since(self) -> None:
+        self.client.fillRectangle(0, 0, 64, 32, b"\x00\x00\xff\x00")
+        screen = self.client.screen
+
+        with self.frombytes as frombytes:
+            self.client.updateRectangle(4, 2, 3, 2, self.RED * 6, self.client.pixel_format)
+            self.assertIs(self.client.screen, screen)
+            self.client.screen
+
+        self.assertEqual(self.converted(frombytes), [(3, 2)])
+        self.assertEqual(screen.getpixel((6, 3)), (255, 0, 0))
+        self.assertEqual(screen.getpixel((7, 3)), (0, 0, 255))
+
+    def test_many_areas_become_one_box(self) -> None:
+        self.client.fillRectangle(0, 0, 64, 32, bytes(4))
+        self.client.screen
+        for x in range(64):
+            self.client.fillRectangle(x, x % 32, 1, 1, self.RED)
+
+        with self.frombytes as frombytes:
+            screen = self.client.screen
+
+        self.assertLessEqual(len(self.converted(frombytes)), self.client.DIRTY_RECTS)
+        self.assertEqual(screen.getpixel((33, 1)), (255, 0, 0))
+
+    def test_rgb_rectangles_are_written_in_the_framebuffer_format(self) -> None:
+        self.client.pixel_format = PIXEL_FORMATS["bgrx8888"]
+
+        self.client.updateRectangle(0, 0, 2, 1, b"\x10\x20\x30\x40\x50\x60", pixelformat.RGB888)
+
+        self.assertEqual(self.client._fb.tobytes()[:8], b"\x30\x20\x10\x00\x60\x50\x40\x00")
+        self.assertEqual(self.client.screen.getpixel((1, 0)), (0x40, 0x50, 0x60))
+
+    def test_a_screen_set_in_a_16bpp_session_is_painted_over(self) -> None:
+        self.client.pixel_format = PIXEL_FORMATS["rgb565"]
+        self.client.screen = client.Image.new("RGB", (4, 4), (255, 0, 0))
+
+        self.client.fillRectangle(0, 0, 1, 1, b"\x1f\x00")  # blue
+
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (0, 0, 255))
+        self.assertEqual(self.client.screen.getpixel((3, 3)), (255, 0, 0))
+
+    def test_a_24bpp_raw_update_is_painted(self) -> None:
+        bgr888 = rfb.PixelFormat(24, 24, False, True, 255, 255, 255, 16, 8, 0)
+        cli = self.client
+        cli.factory.shared = 0
+        cli.factory.password = None
+        cli.dataReceived(b"RFB 003.003\n" + struct.pack("!I", 1))
+        cli.dataReceived(struct.pack("!HH16sI", 4, 2, bgr888.to_bytes(), 0))
+        cli.vncProtocolError = mock.Mock()  # type: ignore[method-assign]
+
+        cli.dataReceived(struct.pack("!BxHHHHHi", 0, 1, 1, 0, 2, 1, rfb.Encoding.RAW) + b"\x30\x20\x10\x60\x50\x40")
+        cli.fillRectangle(0, 1, 4, 1, b"\xff\x00\x00")
+
+        cli.vncProtocolError.assert_not_called()
+        self.assertEqual(cli.screen.getpixel((1, 0)), (0x10, 0x20, 0x30))
+        self.assertEqual(cli.screen.getpixel((2, 0)), (0x40, 0x50, 0x60))
+        self.assertEqual(cli.screen.getpixel((3, 1)), (0, 0, 0xff))
+
+    def test_paints_are_converted_as_they_come_while_every_update_is_read(self) -> None:
+        self.client.fillRectangle(0, 0, 64, 32, bytes(4))
+        self.client.beginUpdate()
+        screen = self.client.screen
+        self.client.beginUpdate()
+
+        with self.frombytes as frombytes:
+            self.client.updateRectangle(4, 2, 3, 2, self.RED * 6, self.client.pixel_format)
+            self.client.fillRectangle(8, 2, 1, 1, self.RED)
+            self.client.copyRectangle(4, 2, 20, 10, 5, 2)
+            self.assertEqual(self.converted(frombytes), [(3, 2), (1, 1)])
+            self.assertIs(self.client.screen, screen)
+
+        self.assertEqual(self.converted(frombytes), [(3, 2), (1, 1)])
+        self.assertEqual(screen.getpixel((24, 10)), (255, 0, 0))
+        self.assertEqual(screen.getpixel((23, 11)), (0, 0, 0))
+
+        # An update without a read goes back to noting what is painted.
+        self.client.beginUpdate()
+        self.client.beginUpdate()
+        self.client.updateRectangle(0, 0, 1, 1, self.RED, self.client.pixel_format)
+        self.assertEqual(screen.getpixel((0, 0)), (0, 0, 0))
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (255, 0, 0))
+
+
+class TestCursorOverlay(TestCase):
+    """The cursor is drawn over the screen as it is read, never into the
+    framebuffer."""
+
+    WHITE = b"\xff\xff\xff\x00"
+    BLUE = b"\x00\x00\xff\x00"
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.factory.nocursor = False
+        self.client.width, self.client.height = 64, 32
+        self.client.fillRectangle(0, 0, 64, 32, self.BLUE)
+        # Two by two, its hotspot at the top left.
+        self.client.updateCursor(0, 0, 2, 2, self.WHITE * 4, b"\xc0\xc0")
+        self.frombytes = mock.patch.object(client.Image, "frombytes", wraps=client.Image.frombytes)
+
+    def test_the_cursor_is_drawn_where_the_pointer_is_when_read(self) -> None:
+        self.assertEqual(self.client.screen.getpixel((1, 1)), (255, 255, 255))
+
+        self.client.x, self.client.y = 10, 5
+
+        self.assertEqual(self.client.screen.getpixel((11, 6)), (255, 255, 255))
+        self.assertEqual(self.client.screen.getpixel((1, 1)), (0, 0, 255))
+
+    def test_a_move_converts_the_boxes_it_left_and_went_to(self) -> None:
+        self.client.screen
+        _, token = self.client.damage_since()
+        self.client.x, self.client.y = 10, 5
+
+        with self.frombytes as frombytes:
+            self.client.screen
+
+        self.assertEqual(TestLazyScreen.converted(frombytes), [(2, 2), (2, 2)])
+        self.assertEqual(self.client.damage_since(token)[0], [(0, 0, 2, 2), (10, 5, 2, 2)])
+
+    def test_painting_draws_it_once_per_read(self) -> None:
+        self.client.screen
+        with mock.patch.object(client.Image.Image, "paste", autospec=True, side_effect=client.Image.Image.paste) as paste:
+            for x in range(0, 64, 4):
+                self.client.fillRectangle(x, 0, 4, 4, self.WHITE)
+            self.client.screen
+
+        masked = [c for c in paste.call_args_list if len(c.args) > 3 or "mask" in c.kwargs]
+        self.assertEqual(len(masked), 1)
+
+    def test_a_capture_has_no_cursor_where_it_was(self) -> None:
+        self.client.screen
+        self.client.x, self.client.y = 40, 20
+        # Read every update: copies go straight into the image.
+        self.client.beginUpdate()
+        self.client.screen
+        self.client.beginUpdate()
+
+        self.client.copyRectangle(40, 20, 0, 0, 4, 4)
+        self.client.x, self.client.y = 60, 0
+
+        screen = self.client.screen
+        self.assertEqual(screen.getpixel((1, 1)), (0, 0, 255))
+        self.assertEqual(screen.getpixel((41, 21)), (0, 0, 255))
+        self.assertEqual(screen.getpixel((61, 1)), (255, 255, 255))
+
+    def test_a_new_shape_replaces_the_old(self) -> None:
+        self.client.screen
+
+        self.client.updateCursor(0, 0, 1, 1, self.WHITE, b"\x80")
+
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (255, 255, 255))
+        self.assertEqual(self.client.screen.getpixel((1, 1)), (0, 0, 255))
+
+    def test_a_screen_set_from_outside_keeps_no_cursor(self) -> None:
+        self.client.screen = client.Image.new("RGB", (64, 32), (0, 255, 0))
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (255, 255, 255))
+
+        self.client.x, self.client.y = 30, 10
+
+        self.assertEqual(self.client.screen.getpixel((0, 0)), (0, 255, 0))
+        self.assertEqual(self.client.screen.getpixel((30, 10)), (255, 255, 255))
+
+
+class TestRegionRequests(TestCase):
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.factory.continuous_updates = False
+        self.client.width, self.client.height = 640, 480
+
+    def requested(self) -> list[tuple[int, ...]]:
+        sent = b"".join(
+            b"".join(args[0]) if name == "writeSequence" else args[0]
+            for name, args, _ in self.client.transport.mock_calls
+        )
+        self.client.transport.reset_mock()
+        return [struct.unpack("!xBHHHH", sent[i:i + 10]) for i in range(0, len(sent), 10)]
+
+    def test_capture_region_asks_for_the_region_alone(self):
+        self.client.captureRegion(io.BytesIO(), 100, 50, 200, 40)
+
+        self.assertEqual(self.requested(), [(0, 100, 50, 200, 40)])
+
+    def test_expect_region_asks_for_its_box_within_the_desktop(self):
+        self.client.screen = client.Image.new("RGB", (640, 480))
+        self.client.expected = client.Image.new("RGB", (40, 40), "white").histogram()
+
+        self.client._expectCompare(None, (620, 460, 660, 500), 0)
+
+        self.assertEqual(self.requested(), [(1, 620, 460, 20, 20)])
+
+    def test_several_regions_are_one_request_each(self):
+        self.client.refreshScreen(True, [(0, 0, 10, 10), (700, 0, 10, 10), (600, 400, 10, 10)])
+
+        self.assertEqual(self.requested(), [(1, 0, 0, 10, 10), (1, 600, 400, 10, 10)])
+
+    def test_an_update_without_pixels_asks_for_the_regions_again(self):
+        d = self.client.refreshScreen(False, [(8, 8, 16, 16)])
+        self.requested()
+
+        self.client.commitUpdate([])
+
+        assert not d.called
+        self.assertEqual(self.requested(), [(0, 8, 8, 16, 16)])
+
+    def connect(self) -> None:
+        self.client.factory.shared = 0
+        self.client.factory.nocursor = False
+        self.client.dataReceived(
+            TestVNCDoToolClient.MSG_HANDSHAKE + struct.pack("!I", 1)
+            + struct.pack("!HH", 640, 480) + TestVNCDoToolClient.MSG_INIT[4:]
+        )
+        self.client.transport.reset_mock()
+
+    def test_a_server_ignoring_the_regions_is_asked_for_the_whole_screen_once(self):
+        d = self.client.refreshScreen(False, [(100, 50, 200, 40)])
+        self.requested()
+
+        self.client.beginUpdate()
+        self.client.updateRectangle(0, 0, 4, 4, bytes(64), self.client.pixel_format)
+        self.client.commitUpdate([(0, 0, 4, 4)])
+
+        assert not d.called
+        self.assertEqual(self.requested(), [(0, 0, 0, 640, 480)])
+        self.client.commitUpdate([(0, 0, 640, 480)])
+        assert d.called
+        self.client.refreshScreen(True, [(8, 8, 16, 16)])
+        self.assertEqual(self.requested(), [(1, 8, 8, 16, 16)])
+
+    def test_a_cursor_shape_alone_is_not_ignoring_the_regions(self):
+        self.connect()
+        d = self.client.refreshScreen(False, [(40, 40, 10, 10)])
+        self.requested()
+
+        bypp = self.client.pixel_format.bypp
+        self.client.dataReceived(
+            struct.pack("!BxH", rfb.MsgS2C.FRAMEBUFFER_UPDATE, 1)
+            + struct.pack("!HHHHi", 1, 1, 4, 4, rfb.Encoding.PSEUDO_CURSOR)
+            + b"\xff" * (4 * 4 * bypp) + b"\xf0" * 4
+        )
+
+        assert d.called
+        self.assertEqual(self.requested(), [])
+        assert self.client._requested is not None
+
+    def test_a_pushed_update_is_not_ignoring_the_regions(self):
+        d = self.client.refreshScreen(False, [(40, 40, 10, 10)])
+        self.requested()
+        self.client.continuous_updates = True
+
+        self.client.beginUpdate()
+        self.client.fillRectangle(0, 0, 4, 4, bytes(4))
+        self.client.commitUpdate([(0, 0, 4, 4)])
+
+        assert d.called
+        self.assertEqual(self.requested(), [])
+
+    def test_an_incremental_update_elsewhere_is_not_ignoring_the_regions(self):
+        d = self.client.refreshScreen(True, [(8, 8, 16, 16)])
+        self.requested()
+
+        self.client.beginUpdate()
+        self.client.fillRectangle(100, 100, 4, 4, bytes(4))
+        self.client.commitUpdate([(100, 100, 4, 4)])
+
+        assert d.called
+        self.assertEqual(self.requested(), [])
+
+
+class TestExpectCompare(TestCase):
+
+    BOX = (8, 8, 12, 12)
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.width, self.client.height = 64, 32
+        self.client.fillRectangle(0, 0, 64, 32, bytes(4))
+        self.expected = client.Image.new("RGB", (4, 4), "white").histogram()
+
+    def compared(self) -> list[bool]:
+        with mock.patch.object(framebuffer, "histogram_rms", wraps=framebuffer.histogram_rms) as rms:
+            matched = self.client._matches(self.BOX, 0, self.expected)
+        return [matched] * rms.call_count
+
+    def test_a_mismatch_is_not_compared_again_until_the_box_is_painted(self):
+        self.assertEqual(self.compared(), [False])
+        self.assertEqual(self.compared(), [])
+
+        self.client.fillRectangle(40, 0, 8, 8, b"\xff\xff\xff\x00")
+        self.assertEqual(self.compared(), [])
+
+        self.client.fillRectangle(8, 8, 4, 4, b"\xff\xff\xff\x00")
+        self.assertEqual(self.compared(), [True])
+
+    def test_another_target_is_compared(self):
+        self.compared()
+        self.expected = list(self.expected)
+
+        self.assertEqual(self.compared(), [False])
+
+    def test_the_cursor_moving_over_the_box_is_a_change(self):
+        cli = self.client
+        cli.factory.nocursor = False
+        cli.updateCursor(0, 0, 2, 2, b"\xff\xff\xff\x00" * 4, b"\xc0\xc0")
+        self.compared()
+
+        cli.x, cli.y = 9, 9
+
+        self.assertEqual(self.compared(), [False])
+
+    def test_a_screen_set_from_outside_is_compared_every_time(self):
+        self.client.screen = client.Image.new("RGB", (64, 32))
+        self.compared()
+
+        self.client.screen.paste((255, 255, 255), (8, 8, 12, 12))
+
+        self.assertEqual(self.compared(), [True])
+
+
+class TestLoadTarget(TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "target.png")
+        client.Image.new("RGB", (4, 2), "white").save(self.path)
+
+    def test_rms_is_between_histograms(self):
+        image = client.Image.new("L", (2, 2))
+        expected = [0] * 256
+        expected[0] = 2
+
+        self.assertEqual(framebuffer.histogram_rms(image, expected), math.sqrt(4 / 256))
+        self.assertIsNone(framebuffer.histogram_rms(image, [0] * 768))
+
+    def test_a_path_is_read_once_until_modified(self):
+        with mock.patch.object(client.Image, "open", wraps=client.Image.open) as image_open:
+            size, white = framebuffer.load_target(self.path)
+            self.assertIs(framebuffer.load_target(pathlib.Path(self.path))[1], white)
+            self.assertEqual(image_open.call_count, 1)
+
+            client.Image.new("RGB", (4, 2), "black").save(self.path)
+            stat = os.stat(self.path)
+            os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            _, black = framebuffer.load_target(self.path)
+
+        self.assertEqual(size, (4, 2))
+        self.assertEqual(image_open.call_count, 2)
+        self.assertNotEqual(black, white)
+
+    def test_a_file_object_is_read_each_time(self):
+        with open(self.path, "rb") as fp:
+            data = fp.read()
+
+        first = framebuffer.load_target(io.BytesIO(data))
+        self.assertEqual(framebuffer.load_target(io.BytesIO(data)), first)
+        self.assertIsNot(framebuffer.load_target(io.BytesIO(data))[1], first[1])
+
+
 class TestVMWareClient(TestCase):
 
     def setUp(self) -> None:
@@ -6,11 +6,13 @@ import tempfile
 import unittest
 from unittest import mock, skipUnless
 
+from twisted.internet import reactor, task
 from twisted.internet.error import ConnectionDone, ConnectionRefusedError, DNSLookupError
 from twisted.python.failure import Failure
 
 from vncdotool import command, pixelformat
 from vncdotool.client import AuthenticationError, ProtocolError
+from vncdotool.const import Encoding
 from vncdotool.loggingproxy import VNCLoggingServerProxy
 from vncdotool.replay import Capture
 
@@ -128,6 +130,11 @@ class TestBuildCommandList(unittest.TestCase):
         self.call_build_commands_list('pause 10', warp=5)
         self.assertCalled(self.client.pause, 2.0)
 
+    def test_sync(self) -> None:
+        self.call_build_commands_list('sync')
+        self.assertCalled(self.client.sync)
+        assert self.factory.fence is True
+
     def test_mousedown(self) -> None:
         self.call_build_commands_list('mousedown 1')
         self.assertCalled(self.client.mouseDown, 1)
@@ -408,6 +415,42 @@ class TestVNCDoCLIFactory(unittest.TestCase):
         assert reactor.exit_status == command.ExitStatus.AUTHENTICATION_FAILED
 
 
+class TestWritesPerTurn(unittest.TestCase):
+
+    def test_a_command_list_run_in_one_turn_is_one_write(self) -> None:
+        factory = command.VNCDoCLIFactory()
+        command.build_command_list(factory, "type hello key enter move 10 20 click 1".split())
+        cli = command.VNCDoCLIClient()
+        cli.transport = mock.Mock()
+        cli.factory = factory
+        clock = task.Clock()
+
+        with mock.patch.object(reactor, "callLater", clock.callLater):
+            factory.deferred.callback(cli)
+            cli.transport.write.assert_not_called()
+            cli.transport.writeSequence.assert_not_called()
+            clock.advance(0)
+
+        cli.transport.write.assert_not_called()
+        (messages,), _ = cli.transport.writeSequence.call_args
+        # hello and enter pressed and released, a move, a button down and up
+        self.assertEqual(len(messages), 6 * 2 + 1 + 2)
+        self.assertEqual(cli.flushes, 1)
+
+    def test_closing_sends_what_the_turn_holds(self) -> None:
+        cli = command.VNCDoCLIClient()
+        cli.transport = mock.Mock()
+        clock = task.Clock()
+
+        with mock.patch.object(reactor, "callLater", clock.callLater):
+            cli.pointerEvent(1, 2, 0)
+            command.disconnect(cli)
+
+        cli.transport.write.assert_called_once()
+        cli.transport.loseConnection.assert_called_once_with()
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+
 @mock.patch('vncdotool.command.factory_connect')
 @mock.patch('vncdotool.command.reactor', new_callable=FakeReactor)
 class TestBuildTool(unittest.TestCase):
@@ -486,6 +529,43 @@ class TestVncdoPixelFormatOption(unittest.TestCase):
         assert factory.pixel_format == pixelformat.PIXEL_FORMATS['rgb565']
 
 
+@mock.patch('vncdotool.command.factory_connect')
+@mock.patch('vncdotool.command.reactor', new_callable=mock.MagicMock)
+class TestVncdoEncodingOptions(unittest.TestCase):
+
+    def test_encodings_and_levels_set_on_the_factory(self, reactor, connect) -> None:
+        with self.assertRaises(SystemExit):
+            command.vncdo([
+                '-s', '127.0.0.1::5900', '--encodings', 'tight,copy-rectangle',
+                '--compress-level', '6', '--quality', '8', 'key', 'a',
+            ])
+
+        factory = connect.call_args.args[0]
+        assert factory.encodings == [Encoding.TIGHT, Encoding.COPY_RECTANGLE]
+        assert factory.compress_level == 6
+        assert factory.quality_level == 8
+
+    def test_fences_are_offered_only_when_needed(self, reactor, connect) -> None:
+        for args, fence in [(['key', 'a'], False), (['sync'], True), (['--continuous-updates', 'key', 'a'], True)]:
+            with self.subTest(args=args), self.assertRaises(SystemExit):
+                command.vncdo(['-s', '127.0.0.1::5900', *args])
+
+            assert connect.call_args.args[0].fence is fence
+
+    def test_unknown_encoding_is_a_usage_error(self, reactor, connect) -> None:
+        with self.assertRaises(SystemExit) as raised:
+            command.vncdo(['-s', '127.0.0.1::5900', '--encodings', 'h264', 'key', 'a'])
+
+        assert raised.exception.code == command.ExitStatus.USAGE
+        connect.assert_not_called()
+
+    def test_level_out_of_range_is_a_usage_error(self, reactor, connect) -> None:
+        with self.assertRaises(SystemExit) as raised:
+            command.vncdo(['-s', '127.0.0.1::5900', '--quality', '10', 'key', 'a'])
+
+        assert raised.exception.code == command.ExitStatus.USAGE
+
+
 class TestReplayClient(unittest.TestCase):
     """_replay_client turns a loaded Capture into a `vncdo` invocation."""
 
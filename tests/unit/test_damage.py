@@ -0,0 +1,95 @@
+from unittest import TestCase, mock
+
+from vncdotool import client
+from vncdotool.damage import DamageLog, coalesce
+
+
+class TestCoalesce(TestCase):
+
+    def test_overlapping_areas_become_the_box_around_them(self) -> None:
+        self.assertEqual(coalesce([(0, 0, 10, 10), (5, 5, 10, 10)]), [(0, 0, 15, 15)])
+
+    def test_touching_areas_stay_apart(self) -> None:
+        self.assertEqual(coalesce([(0, 0, 10, 10), (10, 0, 10, 10)]), [(0, 0, 10, 10), (10, 0, 10, 10)])
+
+    def test_a_grown_box_takes_in_what_it_now_overlaps(self) -> None:
+        rects = [(0, 0, 4, 4), (20, 0, 4, 4), (2, 2, 20, 1)]
+
+        self.assertEqual(coalesce(rects), [(0, 0, 24, 4)])
+
+    def test_empty_areas_are_dropped(self) -> None:
+        self.assertEqual(coalesce([(3, 3, 0, 5), (1, 1, 2, 2)]), [(1, 1, 2, 2)])
+
+
+class TestDamageLog(TestCase):
+
+    def test_each_reader_gets_what_was_painted_since_it_looked(self) -> None:
+        damage = DamageLog()
+        damage.add(0, 0, 4, 4)
+        _, first = damage.since()
+        damage.add(10, 10, 4, 4)
+        _, second = damage.since()
+        damage.add(20, 20, 4, 4)
+
+        self.assertEqual(damage.since(first), ([(10, 10, 4, 4), (20, 20, 4, 4)], 3))
+        self.assertEqual(damage.since(second), ([(20, 20, 4, 4)], 3))
+        self.assertEqual(damage.since(3), ([], 3))
+
+    def test_bands_of_a_rectangle_are_one_area(self) -> None:
+        damage = DamageLog()
+        for y in range(0, 256, 64):
+            damage.add(8, y, 100, 64)
+
+        self.assertEqual(damage.since(), ([(8, 0, 100, 256)], 4))
+
+    def test_what_the_log_drops_is_kept_as_one_box(self) -> None:
+        damage = DamageLog(limit=4)
+        for i in range(8):
+            damage.add(10 * i, 0, 2, 2)
+
+        # The four kept and a box around the four dropped are past the
+        # limit, so one box in all.
+        self.assertEqual(damage.since(), ([(0, 0, 72, 2)], 8))
+        # A reader that looked before the last dropped one was painted gets
+        # the box around them all.
+        self.assertEqual(damage.since(3)[0], [(0, 0, 72, 2)])
+        # A reader that looked since the dropped ones were painted is
+        # answered from the log alone.
+        self.assertEqual(damage.since(5), ([(50, 0, 2, 2), (60, 0, 2, 2), (70, 0, 2, 2)], 8))
+
+    def test_past_the_limit_an_answer_is_one_box(self) -> None:
+        damage = DamageLog(limit=4)
+        for i in range(3):
+            damage.add(10 * i, 10 * i, 2, 2)
+        damage.add(40, 5, 1, 1)
+        damage.add(0, 40, 1, 1)
+
+        self.assertEqual(damage.since(), ([(0, 0, 41, 41)], 5))
+
+
+class TestClientDamage(TestCase):
+
+    def setUp(self) -> None:
+        self.client = client.VNCDoToolClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client.width, self.client.height = 64, 32
+
+    def test_paints_are_damage(self) -> None:
+        cli = self.client
+        _, token = cli.damage_since()
+
+        cli.updateRectangle(0, 0, 2, 2, bytes(16), cli.pixel_format)
+        cli.fillRectangle(1, 1, 4, 4, bytes(4))
+        cli.copyRectangle(0, 0, 32, 16, 8, 8)
+
+        self.assertEqual(cli.damage_since(token), ([(0, 0, 5, 5), (32, 16, 8, 8)], token + 3))
+
+    def test_a_new_desktop_size_is_damage_all_over(self) -> None:
+        cli = self.client
+        cli.fillRectangle(0, 0, 4, 4, bytes(4))
+        _, token = cli.damage_since()
+
+        cli.updateDesktopSize(80, 40)
+
+        self.assertEqual(cli.damage_since(token)[0], [(0, 0, 80, 40)])
@@ -4,16 +4,19 @@ Capture these with `make goldens`; see specs/decoder-goldens.md.
 """
 from __future__ import annotations
 
+import functools
 import gzip
 import json
+import pickle
 import unittest
 from pathlib import Path
-from typing import List, Optional, Tuple
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Tuple
 from unittest import mock
 
 from PIL import Image
 
-from vncdotool import client, pixelformat
+from vncdotool import client, pixelformat, session
 
 FIXTURE_ROOT = Path(__file__).resolve().parent / "fixtures" / "goldens"
 SCENES_DIR = Path(__file__).resolve().parents[1] / "goldens" / "scenes"
@@ -43,8 +46,13 @@ class Fixture:
     def steps(self) -> List[Path]:
         return sorted(self.path.glob("step-*.bin.gz"))
 
-    def client(self) -> client.VNCDoToolClient:
-        cli = client.VNCDoToolClient()
+    def client(self, executor: Optional[Executor] = None) -> client.VNCDoToolClient:
+        """With ``executor``, a client that reads rectangles whole for it,
+        though still decoding them in place."""
+        cls = client.VNCDoToolClient
+        if executor is not None:
+            cls = type("OffloadingClient", (cls,), {"decode_executor": executor})
+        cli = cls()
         cli.transport = mock.Mock()
         cli.factory = mock.Mock()
         cli.factory.shared = 0
@@ -54,6 +62,8 @@ class Fixture:
         cli.factory.pseudodesktop = False
         cli.factory.last_rect = False
         cli.factory.qemu_extended_key = False
+        # No reactor, so no thread pool: TightPNG's images decode in place.
+        cli.decodeInBackground = functools.partial(session.RFBSession.decodeInBackground, cli)
         requested = self.conditions.get("pixel_format")
         if requested is not None:
             cli.requested_pixel_format = pixelformat.PIXEL_FORMATS[requested]
@@ -151,6 +161,21 @@ class GoldenReplay:
 
     fixture: Fixture
 
+    def test_decodes_the_same_read_whole(self) -> None:
+        """Offloaded, through pickled jobs finishing last first, as they
+        would on a process pool that finished them in any order."""
+        fixture = self.fixture
+        jobs: List[Tuple[Callable[[], Any], Callable[[Any], None]]] = []
+        cli = fixture.client(mock.Mock(spec=Executor))
+        cli.decodeInBackground = lambda job, done: jobs.append((job, done))
+        for (key, expected), step in zip(fixture.replay(), fixture.steps()):
+            cli.dataReceived(gzip.decompress(step.read_bytes()))
+            while jobs:
+                job, done = jobs.pop()
+                done(pickle.loads(pickle.dumps(job))())
+            self.assertIsNotNone(cli.screen, f"{step.name}: no framebuffer after the update")
+            self.assertEqual(cli.screen.tobytes(), expected.tobytes(), f"{fixture.name} {step.name}")
+
     def test_decodes_to_its_oracle(self) -> None:
         fixture = self.fixture
         tolerance = fixture.tolerance
@@ -176,6 +201,7 @@ def load_tests(loader: unittest.TestLoader, tests: unittest.TestSuite, pattern:
         name = f"TestGolden_{fixture.name.replace('-', '_')}"
         case = type(name, (GoldenReplay, unittest.TestCase), {"fixture": fixture})
         suite.addTest(case("test_decodes_to_its_oracle"))
+        suite.addTest(case("test_decodes_the_same_read_whole"))
     for members in fixture_groups().values():
         reference, *others = members
         for other in others:
@@ -0,0 +1,53 @@
+"""Hextile, RFC 6143 section 7.7.4, pasted once per rectangle."""
+from __future__ import annotations
+
+from tests.unit.decoding import DecoderTestCase, rect, update
+from vncdotool.const import Encoding
+
+RAW, BACKGROUND, FOREGROUND, ANY_SUBRECTS, COLOURED = 1, 2, 4, 8, 16
+
+
+def hextile_update(width: int, height: int, tiles: bytes) -> bytes:
+    return update(rect(0, 0, width, height, Encoding.HEXTILE, tiles))
+
+
+class TestHextile(DecoderTestCase):
+
+    def painted(self) -> bytes:
+        self.cli.fillRectangle.assert_not_called()
+        return super().painted()
+
+    def test_raw_and_filled_tiles_share_one_paste(self) -> None:
+        raw = bytes(range(16)) * 4 * 16
+        red = b"\x00\x00\xff\x00"
+
+        self.cli.dataReceived(hextile_update(32, 16, bytes((RAW,)) + raw + bytes((BACKGROUND,)) + red))
+
+        pixels = self.painted()
+        self.assertEqual(pixels[:64], raw[:64])
+        self.assertEqual(pixels[64:128], red * 16)
+
+    def test_coloured_subrects(self) -> None:
+        bg, green, blue = b"\x00" * 4, b"\x00\xff\x00\x00", b"\xff\x00\x00\x00"
+        tile = (
+            bytes((BACKGROUND | ANY_SUBRECTS | COLOURED,)) + bg + b"\x02"
+            + green + bytes((0x00, 0x10))  # (0, 0) 2x1
+            + blue + bytes((0x11, 0x00))   # (1, 1) 1x1
+        )
+
+        self.cli.dataReceived(hextile_update(3, 2, tile))
+
+        self.assertEqual(self.painted(), green + green + bg + bg + blue + bg)
+
+    def test_a_tile_with_no_background_yet_is_an_error(self) -> None:
+        self.cli.dataReceived(hextile_update(4, 4, b"\x00"))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+    def test_a_subrect_outside_its_tile_is_an_error(self) -> None:
+        tile = bytes((BACKGROUND | FOREGROUND | ANY_SUBRECTS,)) + bytes(8) + b"\x01" + bytes((0x33, 0x11))
+
+        self.cli.dataReceived(hextile_update(4, 4, tile))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
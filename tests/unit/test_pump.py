@@ -302,3 +302,159 @@ class TestRectBufferReuse(TestCase):
         expected = bytes([0xAA]) * (2 * 2 * cli.bypp)
         self.assertEqual(small.tobytes(), expected)
         self.assertEqual(len(small.tobytes()), 2 * 2 * cli.bypp)
+
+
+class TestBandedRaw(TestCase):
+    """Raw with `BAND_ROWS` set is painted a band at a time, each band as soon
+    as its bytes are in, rather than once the whole rectangle has arrived.
+    """
+
+    def setUp(self) -> None:
+        self.cli = make_pump_client()
+        self.cli.BAND_ROWS = 2
+        self.cli.updateRectangle = mock.Mock()
+        self.decoder = decoders.RawDecoder()
+
+    def test_each_band_is_painted_as_it_arrives(self) -> None:
+        cli = self.cli
+        row = 3 * cli.bypp
+        pixels = bytes(range(5 * row))
+
+        pump(cli, self.decoder, 4, 10, 3, 5)
+        cli.dataReceived(pixels[:2 * row])
+        cli.updateRectangle.assert_called_once_with(
+            4, 10, 3, 2, pixels[:2 * row], cli.pixel_format
+        )
+
+        cli.dataReceived(pixels[2 * row:])
+        self.assertEqual(
+            cli.updateRectangle.call_args_list,
+            [
+                mock.call(4, 10, 3, 2, pixels[:2 * row], cli.pixel_format),
+                mock.call(4, 12, 3, 2, pixels[2 * row:4 * row], cli.pixel_format),
+                mock.call(4, 14, 3, 1, pixels[4 * row:], cli.pixel_format),
+            ],
+        )
+
+    def test_the_whole_rectangle_is_checked_before_the_first_band(self) -> None:
+        cli = self.cli
+        cli.width, cli.height = 8, 8
+        cli.vncProtocolError = mock.Mock()
+
+        pump(cli, self.decoder, 0, 0, 8, 9)
+
+        cli.vncProtocolError.assert_called_once()
+        cli.updateRectangle.assert_not_called()
+
+    def test_the_update_carries_on_after_the_last_band(self) -> None:
+        cli = make_client()
+        cli.BAND_ROWS = 2
+        cli._decoders = {
+            encoding: (decoder, cli._pumpFor(decoder))
+            for encoding, (decoder, _) in cli._decoders.items()
+        }
+        cli.dataReceived(b"RFB 003.003\n" + pack("!I", 1))
+        cli.dataReceived(pack("!HH16sI", 3, 5, rfb.PixelFormat().to_bytes(), 0))
+        cli.commitUpdate = mock.Mock()
+
+        cli.dataReceived(raw_update(0, 0, 3, 5, b"\x10" * (3 * 5 * 4)))
+
+        cli.commitUpdate.assert_called_once_with([(0, 0, 3, 5)])
+        assert cli.screen is not None
+        self.assertEqual(cli.screen.getpixel((2, 4)), (0x10, 0x10, 0x10))
+
+
+class TestDispatch(TestCase):
+    """Every encoding, pseudo-encodings included, comes out of the registry."""
+
+    def setUp(self) -> None:
+        self.cli = make_client()
+        self.cli.dataReceived(b"RFB 003.003\n" + pack("!I", 1))
+        self.cli.dataReceived(pack("!HH16sI", 32, 32, rfb.PixelFormat().to_bytes(), 0))
+        self.cli.commitUpdate = mock.Mock()
+
+    def update(self, *rects: bytes) -> None:
+        self.cli.dataReceived(pack("!BxH", 0, len(rects)) + b"".join(rects))
+
+    def test_every_offered_encoding_has_a_decoder(self) -> None:
+        for encoding in (
+            Encoding.RAW, Encoding.COPY_RECTANGLE, Encoding.RRE, Encoding.CORRE,
+            Encoding.HEXTILE, Encoding.ZLIB, Encoding.ZLIBHEX, Encoding.ZRLE,
+            Encoding.TIGHT, Encoding.TIGHT_PNG, Encoding.PSEUDO_CURSOR,
+            Encoding.PSEUDO_DESKTOP_SIZE, Encoding.PSEUDO_LAST_RECT,
+            Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT,
+        ):
+            self.assertIn(encoding, self.cli._decoders)
+
+    def test_hextile_paints_its_tiles_at_once(self) -> None:
+        self.cli.updateRectangle = mock.Mock()
+        background = b"\x01\x02\x03\x00"
+        foreground = b"\x04\x05\x06\x00"
+        tile = pack("!B", 0x02 | 0x04 | 0x08) + background + foreground + pack("!BBB", 1, 0x12, 0x00)
+
+        self.update(pack("!HHHHi", 0, 0, 20, 4, Encoding.HEXTILE) + tile + b"\x00")
+
+        # the background carries over into the second tile
+        rows = [background * 20] * 4
+        rows[2] = background + foreground + background * 18
+        self.cli.updateRectangle.assert_called_once_with(
+            0, 0, 20, 4, b"".join(rows), self.cli.pixel_format
+        )
+        self.cli.commitUpdate.assert_called_once_with([(0, 0, 20, 4)])
+
+    def test_rre_paints_background_and_subrects_at_once(self) -> None:
+        self.cli.updateRectangle = mock.Mock()
+        background, foreground = b"\x01\x01\x01\x00", b"\x02\x02\x02\x00"
+        body = pack("!I", 1) + background + foreground + pack("!HHHH", 1, 2, 3, 4)
+
+        self.update(pack("!HHHHi", 4, 4, 8, 8, Encoding.RRE) + body)
+
+        rows = [background * 8] * 8
+        for y in range(2, 6):
+            rows[y] = background + foreground * 3 + background * 4
+        self.cli.updateRectangle.assert_called_once_with(
+            4, 4, 8, 8, b"".join(rows), self.cli.pixel_format
+        )
+
+    def test_a_rectangle_of_one_colour_is_a_fill(self) -> None:
+        self.cli.fillRectangle = mock.Mock()
+        self.cli.updateRectangle = mock.Mock()
+
+        self.update(pack("!HHHHi", 4, 4, 8, 8, Encoding.RRE) + pack("!I", 0) + b"\x01\x01\x01\x00")
+
+        self.cli.fillRectangle.assert_called_once_with(4, 4, 8, 8, b"\x01\x01\x01\x00")
+        self.cli.updateRectangle.assert_not_called()
+
+    def test_the_cursor_is_split_into_image_and_mask(self) -> None:
+        self.cli.updateCursor = mock.Mock()
+        image = bytes(range(2 * 2 * 4))
+
+        self.update(pack("!HHHHi", 1, 1, 2, 2, Encoding.PSEUDO_CURSOR) + image + b"\xc0\x40")
+
+        (x, y, w, h, got_image, mask), _ = self.cli.updateCursor.call_args
+        self.assertEqual((x, y, w, h, bytes(got_image), bytes(mask)), (1, 1, 2, 2, image, b"\xc0\x40"))
+
+    def test_control_rectangles_are_left_out_of_the_update(self) -> None:
+        self.update(
+            pack("!HHHHi", 0, 0, 0, 0, Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT),
+            pack("!HHHHi", 0, 0, 1, 1, Encoding.RAW) + bytes(4),
+        )
+
+        self.cli.commitUpdate.assert_called_once_with([(0, 0, 1, 1)])
+        self.assertIn(Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT, self.cli.negotiated_encodings)
+
+    def test_last_rect_ends_the_update(self) -> None:
+        self.cli.dataReceived(
+            pack("!BxH", 0, 0xFFFF)
+            + pack("!HHHHi", 0, 0, 1, 1, Encoding.RAW) + bytes(4)
+            + pack("!HHHHi", 0, 0, 0, 0, Encoding.PSEUDO_LAST_RECT)
+        )
+
+        self.cli.commitUpdate.assert_called_once_with([(0, 0, 1, 1)])
+
+    def test_an_unknown_encoding_is_a_protocol_error(self) -> None:
+        self.cli.vncProtocolError = mock.Mock()
+
+        self.update(pack("!HHHHi", 0, 0, 1, 1, Encoding.ULTRA))
+
+        self.cli.vncProtocolError.assert_called_once()
@@ -46,11 +46,13 @@ class TestRectBuffer(unittest.TestCase):
         self.assertEqual(backing, b"\x01\x00\x02\x00")
 
     def test_oversized_backing_leftover_bytes_excluded(self):
-        backing = bytearray(16)
-        RectBuffer(4, 4, 1, backing=backing).fill(0, 0, 4, 4, b"\xaa")
+        backing = bytearray(b"\xaa" * 16)
 
         small = RectBuffer(2, 2, 1, backing=backing)
-        small.fill(0, 0, 2, 2, b"\x01")
+        # Row by row, because a fill covering the whole rectangle is held
+        # as its colour and never reaches the array.
+        small.fill(0, 0, 2, 1, b"\x01")
+        small.fill(0, 1, 2, 1, b"\x01")
 
         self.assertEqual(small.tobytes(), b"\x01" * 4)
         # the previous rectangle's tail is still sitting in the backing array,
@@ -69,6 +71,42 @@ class TestRectBuffer(unittest.TestCase):
             b"\x00" * 5 + b"\x01\x01" + b"\x00" * 2 + b"\x01\x01" + b"\x00" * 5,
         )
 
+    def test_a_whole_fill_is_held_as_its_colour(self):
+        backing = bytearray(4)
+        buf = RectBuffer(2, 2, 1, backing=backing)
+        buf.fill(0, 0, 2, 2, b"\x05")
+
+        self.assertEqual(buf.solid, b"\x05")
+        self.assertEqual(buf.tobytes(), b"\x05" * 4)
+        self.assertEqual(backing, bytes(4))
+
+    def test_a_write_over_a_whole_fill_paints_over_its_colour(self):
+        buf = RectBuffer(2, 2, 1)
+        buf.fill(0, 0, 2, 2, b"\x05")
+        buf.fill(1, 1, 1, 1, b"\x06")
+
+        self.assertIsNone(buf.solid)
+        self.assertEqual(buf.tobytes(), b"\x05\x05\x05\x06")
+
+    def test_a_whole_blit_replaces_a_whole_fill(self):
+        buf = RectBuffer(2, 1, 1)
+        buf.fill(0, 0, 2, 1, b"\x05")
+        buf.blit(0, 0, 2, 1, b"\x01\x02")
+
+        self.assertIsNone(buf.solid)
+        self.assertEqual(buf.tobytes(), b"\x01\x02")
+
+    def test_fill_many_paints_in_order(self):
+        buf = RectBuffer(3, 2, 1)
+        buf.fill_many([(b"\x01", 0, 0, 2, 2), (b"\x02", 1, 1, 2, 1)])
+
+        self.assertEqual(buf.tobytes(), b"\x01\x01\x00\x01\x02\x02")
+
+    def test_fill_many_past_edge_raises_decode_error(self):
+        buf = RectBuffer(3, 2, 1)
+        with self.assertRaises(DecodeError):
+            buf.fill_many([(b"\x01", 0, 0, 1, 1), (b"\x02", 2, 0, 2, 1)])
+
     def test_backing_too_small_raises_value_error(self):
         with self.assertRaises(ValueError):
             RectBuffer(2, 2, 1, backing=bytearray(3))
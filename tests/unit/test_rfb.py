@@ -1,3 +1,4 @@
+import struct
 import warnings
 from unittest import TestCase, mock
 
@@ -146,3 +147,188 @@ class TestRFBClientSubclassWarning(TestCase):
         with warnings.catch_warnings():
             warnings.simplefilter("error")
             type("Sub", (rfb.RFBClient,), {"updateRectangle": updateRectangle})
+
+
+class TestReceiveBuffer(TestCase):
+
+    def test_a_block_inside_one_chunk_is_a_view_of_it(self):
+        buf = rfb.ReceiveBuffer()
+        chunk = bytes(range(256)) * 64
+        buf.extend(chunk)
+
+        block = buf.take(rfb.ReceiveBuffer.VIEW_MIN)
+
+        self.assertIsInstance(block, memoryview)
+        self.assertTrue(block.readonly)
+        self.assertEqual(block, chunk[:rfb.ReceiveBuffer.VIEW_MIN])
+        self.assertEqual(buf.copied, 0)
+
+    def test_a_block_straddling_chunks_is_joined_once(self):
+        buf = rfb.ReceiveBuffer()
+        buf.extend(b"abc")
+        buf.extend(b"defg")
+        buf.extend(b"hi")
+
+        self.assertEqual(buf.take(8), b"abcdefgh")
+        self.assertEqual(len(buf), 1)
+        self.assertEqual(buf.take(1), b"i")
+        self.assertEqual(len(buf), 0)
+
+    def test_small_blocks_are_bytes(self):
+        buf = rfb.ReceiveBuffer()
+        buf.extend(b"\x00\x01rest")
+
+        block = buf.take(2)
+
+        self.assertIs(type(block), bytes)
+        self.assertEqual(block, b"\x00\x01")
+
+    def test_the_cursor_advances_without_moving_the_rest(self):
+        buf = rfb.ReceiveBuffer()
+        buf.extend(b"0123456789")
+
+        self.assertEqual(buf.take(3), b"012")
+        self.assertEqual(buf.peek(4), b"3456")
+        self.assertEqual(buf.take(7), b"3456789")
+        self.assertEqual(buf.take(0), b"")
+
+    def test_peek_across_chunks_is_bounded_by_what_arrived(self):
+        buf = rfb.ReceiveBuffer()
+        buf.extend(b"RFB 0")
+        buf.extend(b"03.0")
+
+        self.assertEqual(buf.peek(12), b"RFB 003.0")
+        self.assertEqual(len(buf), 9)
+
+    def test_a_mutable_chunk_is_copied_on_arrival(self):
+        buf = rfb.ReceiveBuffer()
+        data = bytearray(b"x" * rfb.ReceiveBuffer.VIEW_MIN)
+        buf.extend(data)
+        data[0] = ord("y")
+
+        self.assertEqual(bytes(buf.take(1)), b"x")
+
+    def test_a_held_view_survives_more_data_arriving(self):
+        client = rfb.RFBClient()
+        client.transport = mock.Mock()
+        seen = []
+        client._handler = client._handleExpected
+        client.expect(lambda block: seen.append(block), rfb.ReceiveBuffer.VIEW_MIN)
+
+        client.dataReceived(b"\x07" * rfb.ReceiveBuffer.VIEW_MIN)
+        client.dataReceived(b"more")
+
+        self.assertEqual(bytes(seen[0]), b"\x07" * rfb.ReceiveBuffer.VIEW_MIN)
+
+
+class TestBatchedWrites(TestCase):
+
+    def setUp(self) -> None:
+        self.client = rfb.RFBClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+
+    def test_unbatched_messages_are_written_one_each(self):
+        self.client.keyEvent(0x61, down=True)
+        self.client.keyEvent(0x61, down=False)
+        self.assertEqual(self.client.transport.write.call_count, 2)
+        self.client.transport.writeSequence.assert_not_called()
+        self.assertEqual(self.client.flushes, 2)
+
+    def test_a_batch_is_one_write_sequence(self):
+        with self.client.batch():
+            self.client.keyEvent(0x61, down=True)
+            self.client.keyEvent(0x61, down=False)
+            self.client.transport.writeSequence.assert_not_called()
+        self.client.transport.write.assert_not_called()
+        (messages,), _ = self.client.transport.writeSequence.call_args
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(self.client.flushes, 1)
+        self.assertEqual(self.client.bytes_sent, 16)
+
+    def test_nested_batches_send_once_at_the_outermost(self):
+        with self.client.batch():
+            with self.client.batch():
+                self.client.pointerEvent(1, 2, 1)
+            self.client.pointerEvent(1, 2, 0)
+        self.client.transport.writeSequence.assert_called_once()
+
+    def test_a_single_message_batch_is_a_plain_write(self):
+        with self.client.batch():
+            self.client.pointerEvent(1, 2, 0)
+        self.client.transport.write.assert_called_once()
+
+    def test_set_encodings_is_one_message(self):
+        self.client.setEncodings([0, 1, -239])
+        self.client.transport.write.assert_called_once_with(
+            b"\x02\x00\x00\x03" b"\x00\x00\x00\x00" b"\x00\x00\x00\x01" b"\xff\xff\xff\x11"
+        )
+
+    def test_closing_sends_what_a_batch_holds_first(self):
+        order = []
+        self.client.transport.writeSequence.side_effect = lambda m: order.append("write")
+        self.client.transport.loseConnection.side_effect = lambda: order.append("close")
+        with self.client.batch():
+            self.client.keyEvent(0x61, down=True)
+            self.client.keyEvent(0x61, down=False)
+            self.client._close()
+        self.assertEqual(order, ["write", "close"])
+
+    def test_replies_to_one_delivery_are_one_write(self):
+        self.client.transport.write.reset_mock()
+        self.client._handler = lambda: (
+            self.client.keyEvent(0x61, down=True),
+            self.client.framebufferUpdateRequest(0, 0, 1, 1),
+        )
+        self.client.dataReceived(b"x")
+        self.client.transport.write.assert_not_called()
+        self.client.transport.writeSequence.assert_called_once()
+
+
+class TestFence(TestCase):
+
+    def setUp(self) -> None:
+        self.client = rfb.RFBClient()
+        self.client.transport = mock.Mock()
+        self.client.factory = mock.Mock()
+        self.client._handler = self.client._handleExpected
+        self.client.expect(self.client._handleConnection, 1)
+
+    def server_fence(self, flags: int, payload: bytes) -> bytes:
+        return struct.pack("!BxxxIB", rfb.MsgS2C.SERVER_FENCE, flags, len(payload)) + payload
+
+    def test_a_request_is_answered_with_its_payload(self):
+        flags = rfb.FenceFlags.REQUEST | rfb.FenceFlags.BLOCK_BEFORE | 0x100
+        self.client.dataReceived(self.server_fence(flags, b"abc"))
+
+        self.client.transport.write.assert_called_once_with(
+            struct.pack("!BxxxIB", rfb.MsgC2S.CLIENT_FENCE, rfb.FenceFlags.BLOCK_BEFORE, 3) + b"abc"
+        )
+        assert rfb.Encoding.PSEUDO_FENCE in self.client.negotiated_encodings
+
+    def test_the_answer_to_a_request_times_the_round_trip(self):
+        self.client.serverFence = mock.Mock()  # type: ignore[method-assign]
+        payload = self.client.requestFence()
+        (message,), _ = self.client.transport.write.call_args
+        (flags,) = struct.unpack_from("!I", message, 4)
+        self.assertEqual(flags, rfb.FenceFlags.REQUEST | rfb.FenceFlags.BLOCK_BEFORE)
+
+        self.client.dataReceived(self.server_fence(rfb.FenceFlags.BLOCK_BEFORE, payload))
+
+        self.client.serverFence.assert_called_once_with(rfb.FenceFlags.BLOCK_BEFORE, payload)
+        assert self.client.rtt is not None and self.client.rtt >= 0
+
+    def test_messages_after_a_fence_are_parsed(self):
+        self.client.bell = mock.Mock()  # type: ignore[method-assign]
+        self.client.dataReceived(self.server_fence(0, b"") + bytes([rfb.MsgS2C.BELL]))
+        self.client.bell.assert_called_once_with()
+
+    def test_an_oversized_payload_ends_the_session(self):
+        self.client.vncProtocolError = mock.Mock()  # type: ignore[method-assign]
+        self.client.dataReceived(struct.pack("!BxxxIB", rfb.MsgS2C.SERVER_FENCE, 0, 65))
+        self.client.vncProtocolError.assert_called_once()
+        self.client.transport.loseConnection.assert_called_once()
+
+    def test_an_oversized_payload_is_not_sent(self):
+        with self.assertRaises(ValueError):
+            self.client.clientFence(0, bytes(65))
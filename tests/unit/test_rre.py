@@ -0,0 +1,52 @@
+"""RRE and CoRRE, RFC 6143 section 7.7.3, pasted once per rectangle."""
+from __future__ import annotations
+
+from struct import pack
+
+from tests.unit.decoding import DecoderTestCase, rect, update
+from vncdotool.const import Encoding
+
+BG, RED, GREEN = b"\x00\x00\xff\x00", b"\xff\x00\x00\x00", b"\x00\xff\x00\x00"
+
+
+class TestRRE(DecoderTestCase):
+    width = height = 4
+
+    def painted(self) -> bytes:
+        self.cli.fillRectangle.assert_not_called()
+        return super().painted()
+
+    def test_later_subrects_paint_over_earlier_ones(self) -> None:
+        subrects = RED + pack("!HHHH", 0, 0, 3, 2) + GREEN + pack("!HHHH", 2, 1, 2, 1)
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 2, Encoding.RRE, pack("!I", 2) + BG + subrects)))
+
+        self.assertEqual(self.painted(), RED * 3 + BG + RED * 2 + GREEN * 2)
+
+    def test_corre_subrects(self) -> None:
+        subrects = pack("!4sBBBB", RED, 1, 1, 2, 2) + pack("!4sBBBB", GREEN, 0, 3, 4, 1)
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.CORRE, pack("!I", 2) + BG + subrects)))
+
+        rows = [BG * 4, BG + RED * 2 + BG, BG + RED * 2 + BG, GREEN * 4]
+        self.assertEqual(self.painted(), b"".join(rows))
+
+    def test_corre_onto_the_screen(self) -> None:
+        del self.cli.updateRectangle, self.cli.fillRectangle
+        subrects = pack("!4sBBBB", RED, 1, 1, 2, 2) + pack("!4sBBBB", GREEN, 0, 3, 4, 1)
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.CORRE, pack("!I", 2) + BG + subrects)))
+
+        assert self.cli.screen is not None
+        screen = self.cli.screen.convert("RGB")
+        self.assertEqual(screen.getpixel((0, 0)), (0, 0, 255))
+        self.assertEqual(screen.getpixel((2, 2)), (255, 0, 0))
+        self.assertEqual(screen.getpixel((3, 3)), (0, 255, 0))
+
+    def test_a_subrect_outside_its_rectangle_is_an_error(self) -> None:
+        subrects = RED + pack("!HHHH", 3, 0, 2, 1)
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.RRE, pack("!I", 1) + BG + subrects)))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
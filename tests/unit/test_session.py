@@ -0,0 +1,119 @@
+import subprocess
+import sys
+from struct import pack
+from unittest import TestCase, mock
+
+from vncdotool import session
+from vncdotool.const import AuthTypes, Encoding, MsgC2S
+from vncdotool.session import PixelFormat, RFBSession
+
+SERVER_INIT = pack("!HH16sI", 2, 1, PixelFormat().to_bytes(), 4) + b"test"
+
+
+def handshake(sess: RFBSession) -> bytes:
+    """Run an RFB 3.8, no-authentication handshake; what the session sent."""
+    sess.feed(b"RFB 003.008\n")
+    sess.feed(pack("!BB", 1, AuthTypes.NONE))
+    sess.feed(pack("!I", 0))  # SecurityResult: ok
+    sess.feed(SERVER_INIT)
+    return sess.data_to_send()
+
+
+class TestHandshake(TestCase):
+
+    def test_runs_with_no_transport(self):
+        sess = RFBSession()
+        sess.vncConnectionMade = mock.Mock()  # type: ignore[method-assign]
+
+        sent = handshake(sess)
+
+        self.assertEqual(sent, b"RFB 003.008\n" + pack("!B", AuthTypes.NONE) + b"\x00")
+        sess.vncConnectionMade.assert_called_once_with()
+        self.assertEqual((sess.width, sess.height, sess.name), (2, 1, b"test"))
+
+    def test_the_shared_flag_is_sent(self):
+        sess = RFBSession()
+        sess.shared = True
+
+        self.assertEqual(handshake(sess)[-1:], b"\x01")
+
+    def test_does_not_import_twisted(self):
+        check = "import sys, vncdotool.session; sys.exit('twisted' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, "-c", check]).returncode, 0)
+
+    def test_without_a_password_asks_to_close(self):
+        sess = RFBSession()
+        sess.feed(b"RFB 003.008\n")
+        sess.feed(pack("!BB", 1, AuthTypes.VNC_AUTHENTICATION))
+        sess.feed(bytes(16))  # challenge
+
+        self.assertTrue(sess.closed)
+
+    def test_supported_encodings_are_what_it_decodes(self):
+        for encoding in (Encoding.TIGHT, Encoding.TIGHT_PNG, Encoding.ZLIB, Encoding.ZLIBHEX, Encoding.TRLE):
+            self.assertIn(encoding, RFBSession.SUPPORTED_ENCODINGS)
+        self.assertIn(Encoding.PSEUDO_FENCE, RFBSession.SUPPORTED_ENCODINGS)
+
+
+class TestMessages(TestCase):
+
+    def setUp(self) -> None:
+        self.session = RFBSession()
+        handshake(self.session)
+
+    def test_an_update_calls_back_with_the_pixels(self):
+        self.session.updateRectangle = mock.Mock()  # type: ignore[method-assign]
+        self.session.commitUpdate = mock.Mock()  # type: ignore[method-assign]
+
+        self.session.feed(pack("!BxH", 0, 1) + pack("!HHHHi", 0, 0, 2, 1, Encoding.RAW))
+        self.session.feed(b"\x01\x02\x03\x00" * 2)
+
+        (x, y, w, h, data, pf), _ = self.session.updateRectangle.call_args
+        self.assertEqual((x, y, w, h, bytes(data)), (0, 0, 2, 1, b"\x01\x02\x03\x00" * 2))
+        self.session.commitUpdate.assert_called_once_with([(0, 0, 2, 1)])
+
+    def test_sent_messages_queue_until_collected(self):
+        self.session.keyEvent(0x61, down=True)
+        self.session.pointerEvent(1, 2, 0)
+
+        self.assertEqual(
+            self.session.data_to_send(),
+            session.pack_key_event(0x61, True) + session.pack_pointer_event(1, 2, 0),
+        )
+        self.assertEqual(self.session.data_to_send(), b"")
+
+    def test_an_error_stops_parsing(self):
+        self.session.vncProtocolError = mock.Mock()  # type: ignore[method-assign]
+
+        self.session.feed(b"\x7f\x00")
+
+        self.session.vncProtocolError.assert_called_once()
+        self.assertTrue(self.session.closed)
+
+
+class TestSerialisers(TestCase):
+
+    def test_key_event(self):
+        self.assertEqual(session.pack_key_event(0xFF0D, False), b"\x04\x00\x00\x00\x00\x00\xff\x0d")
+
+    def test_pointer_event(self):
+        self.assertEqual(session.pack_pointer_event(3, 4, 1), b"\x05\x01\x00\x03\x00\x04")
+
+    def test_framebuffer_update_request(self):
+        self.assertEqual(
+            session.pack_framebuffer_update_request(1, 2, 3, 4, True),
+            pack("!BBHHHH", MsgC2S.FRAMEBUFFER_UPDATE_REQUEST, 1, 1, 2, 3, 4),
+        )
+
+    def test_client_cut_text_is_latin_1(self):
+        self.assertEqual(session.pack_client_cut_text("é"), b"\x06\x00\x00\x00\x00\x00\x00\x01\xe9")
+
+    def test_set_encodings(self):
+        self.assertEqual(
+            session.pack_set_encodings([Encoding.RAW, Encoding.PSEUDO_CURSOR]),
+            b"\x02\x00\x00\x02" b"\x00\x00\x00\x00" b"\xff\xff\xff\x11",
+        )
+
+    def test_fence_payload_is_bounded(self):
+        with self.assertRaises(ValueError):
+            session.pack_client_fence(0, bytes(session.FENCE_PAYLOAD_MAX + 1))
@@ -0,0 +1,183 @@
+"""Tight, rfbproto section Tight Encoding."""
+from __future__ import annotations
+
+import io
+import random
+import zlib
+
+from PIL import Image
+
+from tests.unit.decoding import DecoderTestCase, rect, update
+from vncdotool import pixelformat
+from vncdotool.const import Encoding
+from vncdotool.decoders.tight import _compact_length
+
+
+def compact(length: int) -> bytes:
+    out = bytearray()
+    for _ in range(2):
+        if length < 0x80:
+            break
+        out.append(length & 0x7F | 0x80)
+        length >>= 7
+    out.append(length)
+    return bytes(out)
+
+
+def tight_update(x: int, y: int, width: int, height: int, body: bytes) -> bytes:
+    return update(rect(x, y, width, height, Encoding.TIGHT, body))
+
+
+def gradient(pixels: bytes, width: int) -> bytes:
+    """The gradient filter, as a server applies it."""
+    stride = width * 3
+    out = bytearray()
+    for i, value in enumerate(pixels):
+        left = pixels[i - 3] if i % stride >= 3 else 0
+        up = pixels[i - stride] if i >= stride else 0
+        up_left = pixels[i - stride - 3] if i >= stride and i % stride >= 3 else 0
+        predicted = min(max(left + up - up_left, 0), 255)
+        out.append((value - predicted) & 0xFF)
+    return bytes(out)
+
+
+class TestTight(DecoderTestCase):
+    width = height = 256
+    decode_in_place = True
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.streams = [zlib.compressobj() for _ in range(4)]
+
+    def deflate(self, data: bytes, stream: int = 0) -> bytes:
+        compressor = self.streams[stream]
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compact(len(compressed)) + compressed
+
+    def painted(self) -> bytes:
+        pixels = super().painted(once=False)
+        (*_, pixel_format), _ = self.cli.updateRectangle.call_args
+        self.assertIs(pixel_format, pixelformat.RGB888)
+        return pixels
+
+    def test_fill(self) -> None:
+        self.cli.dataReceived(tight_update(0, 0, 3, 2, b"\x80" + b"\x10\x20\x30"))
+
+        self.assertEqual(self.painted(), b"\x10\x20\x30" * 6)
+        self.cli.commitUpdate.assert_called_once_with([(0, 0, 3, 2)])
+
+    def test_copy_under_twelve_bytes_is_not_deflated(self) -> None:
+        pixels = b"\x01\x02\x03\x04\x05\x06"
+
+        self.cli.dataReceived(tight_update(0, 0, 2, 1, b"\x00" + pixels))
+
+        self.assertEqual(self.painted(), pixels)
+
+    def test_copy_deflated_with_a_two_byte_length(self) -> None:
+        pixels = random.Random(0).randbytes(10 * 10 * 3)
+        body = b"\x00" + self.deflate(pixels)
+        self.assertGreater(body[1], 0x7F)
+
+        self.cli.dataReceived(tight_update(0, 0, 10, 10, body))
+
+        self.assertEqual(self.painted(), pixels)
+
+    def test_compact_length(self) -> None:
+        for length in (0, 127, 128, 16383, 16384, 4194303):
+            encoded = compact(length)
+            generator = _compact_length()
+            next(generator)
+            with self.assertRaises(StopIteration) as stop:
+                for byte in encoded:
+                    self.assertEqual(generator.send(bytes((byte,))), 1)
+            self.assertEqual(stop.exception.value, length)
+
+    def test_two_colour_palette(self) -> None:
+        black, white = b"\x00\x00\x00", b"\xff\xff\xff"
+        # 3x2, one bit per pixel, each row starting on a byte
+        body = b"\x41\x01\x01" + black + white + bytes((0b10100000, 0b01000000))
+
+        self.cli.dataReceived(tight_update(0, 0, 3, 2, body))
+
+        b, w = black, white
+        self.assertEqual(self.painted(), w + b + w + b + w + b)
+
+    def test_indexed_palette(self) -> None:
+        colors = [b"\x00\x00\x00", b"\x10\x00\x00", b"\x00\x20\x00", b"\x00\x00\x30"]
+        indices = bytes(i % 4 for i in range(16))
+        body = b"\x41\x01\x03" + b"".join(colors) + self.deflate(indices)
+
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, body))
+
+        self.assertEqual(self.painted(), b"".join(colors[i] for i in indices))
+
+    def test_palette_index_past_its_colours_is_an_error(self) -> None:
+        body = b"\x41\x01\x02" + bytes(9) + self.deflate(b"\x03" * 16)
+
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, body))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+    def test_gradient(self) -> None:
+        noise = random.Random(0)
+        pixels = bytes(min(255, 8 * x + noise.randrange(4)) for x in range(8 * 4 * 3))
+        body = b"\x42\x02" + self.deflate(gradient(pixels, 8), stream=2)
+
+        self.cli.dataReceived(tight_update(0, 0, 8, 4, body))
+
+        self.assertEqual(self.painted(), pixels)
+
+    def test_jpeg(self) -> None:
+        fp = io.BytesIO()
+        Image.new("RGB", (16, 8), (200, 100, 50)).save(fp, format="jpeg", quality=95)
+        jpeg = fp.getvalue()
+
+        self.cli.dataReceived(tight_update(0, 0, 16, 8, b"\x90" + compact(len(jpeg)) + jpeg))
+
+        pixels = self.painted()
+        self.assertEqual(len(pixels), 16 * 8 * 3)
+        for channel, expected in enumerate((200, 100, 50)):
+            self.assertLessEqual(max(abs(v - expected) for v in pixels[channel::3]), 4)
+
+    def test_a_stream_carries_on_until_reset(self) -> None:
+        pixels = bytes(range(48))
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, b"\x10" + self.deflate(pixels, stream=1)))
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, b"\x10" + self.deflate(pixels, stream=1)))
+        self.assertEqual(self.painted(), pixels)
+
+        self.streams[1] = zlib.compressobj()
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, b"\x12" + self.deflate(pixels, stream=1)))
+
+        self.assertEqual(self.painted(), pixels)
+        self.assertEqual(self.cli.updateRectangle.call_count, 3)
+
+    def test_data_inflating_past_the_rectangle_is_an_error(self) -> None:
+        body = b"\x00" + self.deflate(bytes(4 * 4 * 3 + 1))
+
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, body))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+    def test_png_is_an_error(self) -> None:
+        self.cli.dataReceived(tight_update(0, 0, 4, 4, b"\xa0"))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
+
+
+class TestTightNativePixels(DecoderTestCase):
+    """Formats other than 24-bit colour send whole pixels, in their own
+    layout."""
+    width = height = 16
+    pixel_format = pixelformat.PIXEL_FORMATS["rgb565"]
+
+    def test_fill_is_a_pixel(self) -> None:
+        self.cli.dataReceived(tight_update(0, 0, 2, 2, b"\x80" + b"\x1f\xf8"))
+
+        self.cli.fillRectangle.assert_called_once_with(0, 0, 2, 2, b"\x1f\xf8")
+        self.cli.updateRectangle.assert_not_called()
+
+    def test_jpeg_is_an_error(self) -> None:
+        self.cli.dataReceived(tight_update(0, 0, 2, 2, b"\x90\x01\x00"))
+
+        self.cli.vncProtocolError.assert_called_once()
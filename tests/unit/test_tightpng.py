@@ -0,0 +1,269 @@
+"""TightPNG, rfbproto section TightPNG Encoding, and the images it carries
+decoded off the thread parsing the connection."""
+from __future__ import annotations
+
+import asyncio
+import io
+import random
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from struct import pack
+from typing import Any, Callable
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from PIL import Image
+
+from tests.unit.decoding import DecoderTestCase, connect, make_client, rect, update
+from vncdotool import aio, client, pixelformat, rfb
+from vncdotool.const import Encoding, MsgS2C
+
+
+def compact(length: int) -> bytes:
+    out = bytearray()
+    for _ in range(2):
+        if length < 0x80:
+            break
+        out.append(length & 0x7F | 0x80)
+        length >>= 7
+    out.append(length)
+    return bytes(out)
+
+
+def image(pixels: bytes, width: int, height: int, kind: str = "png") -> bytes:
+    fp = io.BytesIO()
+    Image.frombytes("RGB", (width, height), pixels).save(fp, format=kind)
+    return fp.getvalue()
+
+
+def tightpng_rect(x: int, y: int, width: int, height: int, body: bytes) -> bytes:
+    return rect(x, y, width, height, Encoding.TIGHT_PNG, body)
+
+
+def png_rect(x: int, y: int, width: int, height: int, pixels: bytes) -> bytes:
+    data = image(pixels, width, height)
+    return tightpng_rect(x, y, width, height, b"\xa0" + compact(len(data)) + data)
+
+
+class TestTightPNG(DecoderTestCase):
+    decode_in_place = True
+
+    def painted(self) -> bytes:
+        pixels = super().painted(once=False)
+        (*_, pixel_format), _ = self.cli.updateRectangle.call_args
+        self.assertIs(pixel_format, pixelformat.RGB888)
+        return pixels
+
+    def test_fill(self) -> None:
+        self.cli.dataReceived(update(tightpng_rect(0, 0, 3, 2, b"\x80" + b"\x10\x20\x30")))
+
+        self.assertEqual(self.painted(), b"\x10\x20\x30" * 6)
+        self.cli.commitUpdate.assert_called_once_with([(0, 0, 3, 2)])
+
+    def test_png(self) -> None:
+        pixels = random.Random(0).randbytes(20 * 10 * 3)
+
+        self.cli.dataReceived(update(png_rect(4, 8, 20, 10, pixels)))
+
+        self.assertEqual(self.painted(), pixels)
+        self.cli.updateRectangle.assert_called_once_with(4, 8, 20, 10, mock.ANY, pixelformat.RGB888)
+        self.cli.commitUpdate.assert_called_once_with([(4, 8, 20, 10)])
+
+    def test_jpeg(self) -> None:
+        jpeg = image(bytes((200, 100, 50)) * 16 * 8, 16, 8, "jpeg")
+
+        self.cli.dataReceived(update(tightpng_rect(0, 0, 16, 8, b"\x90" + compact(len(jpeg)) + jpeg)))
+
+        pixels = self.painted()
+        self.assertEqual(len(pixels), 16 * 8 * 3)
+        for channel, expected in enumerate((200, 100, 50)):
+            self.assertLessEqual(max(abs(v - expected) for v in pixels[channel::3]), 4)
+
+    def test_basic_compression_is_an_error(self) -> None:
+        self.cli.dataReceived(update(tightpng_rect(0, 0, 2, 1, b"\x00" + bytes(6))))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
+
+    def test_a_png_rectangle_holding_a_jpeg_is_an_error(self) -> None:
+        jpeg = image(bytes(4 * 4 * 3), 4, 4, "jpeg")
+
+        self.cli.dataReceived(update(tightpng_rect(0, 0, 4, 4, b"\xa0" + compact(len(jpeg)) + jpeg)))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
+
+    def test_an_image_not_the_size_of_its_rectangle_is_an_error(self) -> None:
+        data = image(bytes(4 * 4 * 3), 4, 4)
+
+        self.cli.dataReceived(update(tightpng_rect(0, 0, 8, 4, b"\xa0" + compact(len(data)) + data)))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.commitUpdate.assert_not_called()
+
+
+class TestDecodeInBackground(TestCase):
+    """Decodes finishing whenever the test says, in any order."""
+
+    def setUp(self) -> None:
+        self.jobs: list[tuple[Callable[[], Any], Callable[[Any], None]]] = []
+        self.cli = make_client()
+        self.cli.decodeInBackground = lambda job, done: self.jobs.append((job, done))
+        connect(self.cli, 64, 64)
+        self.calls = mock.Mock()
+        for name in ("updateRectangle", "fillRectangle", "copyRectangle", "commitUpdate", "bell",
+                     "vncProtocolError"):
+            setattr(self.cli, name, getattr(self.calls, name))
+
+    def finish(self, index: int) -> None:
+        job, done = self.jobs[index]
+        done(job())
+
+    def test_rectangles_are_painted_in_wire_order(self) -> None:
+        first, second = b"\x01\x02\x03" * 4, b"\x04\x05\x06" * 4
+        self.cli.dataReceived(update(
+            png_rect(0, 0, 2, 2, first),
+            png_rect(0, 0, 2, 2, second),
+            tightpng_rect(0, 0, 1, 1, b"\x80\x07\x08\x09"),
+        ))
+        self.assertEqual(len(self.jobs), 2)
+
+        self.finish(1)
+        self.assertEqual(self.calls.mock_calls, [])
+
+        self.finish(0)
+        self.assertEqual(self.calls.mock_calls, [
+            mock.call.updateRectangle(0, 0, 2, 2, first, pixelformat.RGB888),
+            mock.call.updateRectangle(0, 0, 2, 2, second, pixelformat.RGB888),
+            mock.call.updateRectangle(0, 0, 1, 1, b"\x07\x08\x09", pixelformat.RGB888),
+            mock.call.commitUpdate([(0, 0, 2, 2), (0, 0, 2, 2), (0, 0, 1, 1)]),
+        ])
+
+    def test_parsing_waits_for_the_paints_before_what_needs_them(self) -> None:
+        pixels = b"\x01\x02\x03" * 4
+        self.cli.dataReceived(
+            update(png_rect(0, 0, 2, 2, pixels), rect(8, 8, 2, 2, Encoding.COPY_RECTANGLE, pack("!HH", 0, 0)))
+            + pack("!B", MsgS2C.BELL)
+        )
+        self.assertEqual(self.calls.mock_calls, [])
+
+        self.finish(0)
+
+        self.assertEqual(self.calls.mock_calls, [
+            mock.call.updateRectangle(0, 0, 2, 2, pixels, pixelformat.RGB888),
+            mock.call.copyRectangle(0, 0, 8, 8, 2, 2),
+            mock.call.commitUpdate([(0, 0, 2, 2), (8, 8, 2, 2)]),
+            mock.call.bell(),
+        ])
+
+    def test_a_failed_decode_ends_the_connection(self) -> None:
+        self.cli.dataReceived(update(tightpng_rect(0, 0, 2, 2, b"\xa0\x04" + b"junk")))
+
+        self.finish(0)
+
+        self.calls.vncProtocolError.assert_called_once()
+        self.calls.updateRectangle.assert_not_called()
+        self.calls.commitUpdate.assert_not_called()
+
+    def test_the_twisted_client_hands_the_result_back_to_the_reactor(self) -> None:
+        from twisted.internet import reactor
+
+        cli = make_client()
+        done = mock.Mock()
+        called = threading.Event()
+        with (
+            mock.patch.object(reactor, "running", True),
+            mock.patch.object(reactor, "callFromThread", side_effect=lambda *_: called.set()) as call_from_thread,
+        ):
+            cli.decodeInBackground(lambda: b"pixels", done)
+            self.assertTrue(called.wait(5))
+
+        call_from_thread.assert_called_once_with(done, b"pixels")
+
+    def test_a_broken_executor_fails_the_decode(self) -> None:
+        from twisted.internet import reactor
+
+        broken: Future[bytes] = Future()
+        broken.set_exception(BrokenProcessPool("gone"))
+        cli = self.offloading_client(broken)
+        done = mock.Mock()
+        with (
+            mock.patch.object(reactor, "running", True),
+            mock.patch.object(reactor, "callFromThread", side_effect=lambda f, *args: f(*args)),
+        ):
+            cli.decodeInBackground(lambda: b"pixels", done)
+
+        (failure,), _ = done.call_args
+        self.assertIsInstance(failure, BrokenProcessPool)
+
+    def offloading_client(self, future: Future[bytes]) -> client.VNCDoToolClient:
+        executor = mock.Mock(spec=Executor)
+        executor.submit.return_value = future
+        return type("OffloadingClient", (client.VNCDoToolClient,), {"decode_executor": executor})()
+
+    def test_a_cancelled_decode_is_dropped(self) -> None:
+        from twisted.internet import reactor
+
+        cancelled: Future[bytes] = Future()
+        cancelled.cancel()
+        cli = self.offloading_client(cancelled)
+        with (
+            mock.patch.object(reactor, "running", True),
+            mock.patch.object(reactor, "callFromThread") as call_from_thread,
+        ):
+            cli.decodeInBackground(lambda: b"pixels", mock.Mock())
+
+        call_from_thread.assert_not_called()
+
+    def test_a_decode_finishing_after_the_reactor_stopped_is_dropped(self) -> None:
+        from twisted.internet import reactor
+
+        finished: Future[bytes] = Future()
+        finished.set_result(b"pixels")
+        cli = self.offloading_client(finished)
+        with (
+            mock.patch.object(reactor, "running", False),
+            mock.patch.object(reactor, "callFromThread") as call_from_thread,
+        ):
+            cli.decodeInBackground(lambda: b"pixels", mock.Mock())
+
+        call_from_thread.assert_not_called()
+
+
+class TestAsyncDecode(IsolatedAsyncioTestCase):
+
+    async def test_images_decode_on_the_decode_pool(self) -> None:
+        cli = aio.AsyncVNCClient()
+        cli.feed(b"RFB 003.003\n" + pack("!I", 1))
+        cli.feed(pack("!HH16sI", 8, 8, rfb.PixelFormat().to_bytes(), 0))
+        pixels = random.Random(0).randbytes(8 * 8 * 3)
+        committed = asyncio.get_running_loop().create_future()
+        cli.commitUpdate = committed.set_result
+
+        cli.feed(update(png_rect(0, 0, 8, 8, pixels)))
+        self.assertFalse(committed.done())
+
+        self.assertEqual(await asyncio.wait_for(committed, 5), [(0, 0, 8, 8)])
+        assert cli.screen is not None
+        self.assertEqual(cli.screen.convert("RGB").tobytes(), pixels)
+
+    async def test_a_process_pool_decodes_whole_rectangles(self) -> None:
+        with ProcessPoolExecutor(1) as executor:
+            cli = aio.AsyncVNCClient(decode_executor=executor)
+            cli.feed(b"RFB 003.003\n" + pack("!I", 1))
+            cli.feed(pack("!HH16sI", 8, 8, rfb.PixelFormat().to_bytes(), 0))
+            pixels = random.Random(0).randbytes(8 * 4 * 3)
+            committed = asyncio.get_running_loop().create_future()
+            cli.commitUpdate = committed.set_result
+            # A PNG over the top half, four RRE subrectangles over the bottom.
+            rre = pack("!I4s", 4, b"\x10\x20\x30\x00") + b"".join(
+                pack("!4sHHHH", bytes((i, i, i, 0)), 2 * i, 0, 2, 4) for i in range(4)
+            )
+
+            cli.feed(update(png_rect(0, 0, 8, 4, pixels), rect(0, 4, 8, 4, Encoding.RRE, rre)))
+
+            self.assertEqual(await asyncio.wait_for(committed, 30), [(0, 0, 8, 4), (0, 4, 8, 4)])
+        assert cli.screen is not None
+        screen = cli.screen.convert("RGB").tobytes()
+        self.assertEqual(screen[:8 * 4 * 3], pixels)
+        self.assertEqual(screen[8 * 4 * 3:], b"".join(bytes((i, i, i)) * 2 for i in range(4)) * 4)
@@ -0,0 +1,109 @@
+import io
+import json
+import logging
+from struct import pack
+from unittest import TestCase, mock
+
+from vncdotool import rfb, trace
+from vncdotool.const import Encoding
+
+
+def make_client(tracer: trace.Tracer) -> rfb.RFBClient:
+    cli = rfb.RFBClient()
+    cli.transport = mock.Mock()
+    cli.factory = mock.Mock()
+    cli.factory.shared = 0
+    cli.tracer = tracer
+    cli.dataReceived(b"RFB 003.003\n" + pack("!I", 1))
+    cli.dataReceived(pack("!HH16sI", 2, 1, rfb.PixelFormat().to_bytes(), 0))
+    return cli
+
+
+def raw_update() -> bytes:
+    return (
+        pack("!BxH", 0, 1)
+        + pack("!HHHHi", 0, 0, 2, 1, Encoding.RAW)
+        + b"\x01\x02\x03\x00" * 2
+    )
+
+
+class TestTracer(TestCase):
+
+    def test_no_sinks_is_disabled(self):
+        self.assertFalse(trace.Tracer().enabled)
+        self.assertFalse(trace.DISABLED.enabled)
+
+    def test_adding_and_removing_a_sink_toggles_enabled(self):
+        tracer = trace.Tracer()
+        sink = trace.RingSink()
+        tracer.add(sink)
+        self.assertTrue(tracer.enabled)
+        tracer.remove(sink)
+        self.assertFalse(tracer.enabled)
+
+    def test_a_disabled_client_builds_no_events(self):
+        tracer = trace.Tracer()
+        tracer.emit = mock.Mock()
+        cli = make_client(tracer)
+
+        cli.dataReceived(raw_update())
+
+        tracer.emit.assert_not_called()
+
+
+class TestClientEvents(TestCase):
+
+    def test_an_update_is_traced_in_wire_order(self):
+        ring = trace.RingSink()
+        cli = make_client(trace.Tracer(ring))
+        ring.events.clear()
+
+        cli.dataReceived(raw_update())
+
+        self.assertEqual([name for name, _ in ring.events], [
+            "received", "message", "update_begin", "rect", "update_commit",
+        ])
+        self.assertEqual(
+            dict(ring.events)["rect"],
+            {"x": 0, "y": 0, "width": 2, "height": 1, "encoding": Encoding.RAW},
+        )
+
+    def test_server_init_and_encodings_are_traced(self):
+        ring = trace.RingSink()
+        cli = make_client(trace.Tracer(ring))
+        cli.setEncodings([Encoding.RAW, Encoding.PSEUDO_CURSOR])
+
+        events = dict(ring.events)
+        self.assertEqual(events["server_init"]["width"], 2)
+        self.assertEqual(events["encodings"], {"encodings": [0, -239]})
+
+
+class TestSinks(TestCase):
+
+    def test_ring_keeps_the_last_events(self):
+        ring = trace.RingSink(2)
+        tracer = trace.Tracer(ring)
+        for n in range(3):
+            tracer.emit("received", bytes=n)
+        self.assertEqual(list(ring.events), [("received", {"bytes": 1}), ("received", {"bytes": 2})])
+
+    def test_json_lines(self):
+        out = io.StringIO()
+        trace.Tracer(trace.JSONLinesSink(out)).emit("rect", x=1, y=2, width=3, height=4, encoding=0)
+        record = json.loads(out.getvalue())
+        self.assertEqual(record["event"], "rect")
+        self.assertEqual(record["width"], 3)
+        self.assertIn("time", record)
+
+    def test_logging_formats_a_rect_as_before(self):
+        logger = logging.getLogger("test_trace")
+        sink = trace.LoggingSink(logger)
+        with self.assertLogs(logger, logging.INFO) as logs:
+            sink("rect", {"x": 1, "y": 2, "width": 3, "height": 4, "encoding": Encoding.HEXTILE})
+        self.assertEqual(logs.records[0].getMessage(), "x=1 y=2 w=3 h=4 <Encoding.HEXTILE: 5>")
+
+    def test_logging_skips_formatting_below_its_level(self):
+        logger = logging.getLogger("test_trace_quiet")
+        logger.setLevel(logging.WARNING)
+        sink = trace.LoggingSink(logger)
+        sink("rect", {})  # would raise KeyError if it were formatted
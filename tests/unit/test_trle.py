@@ -0,0 +1,71 @@
+"""TRLE, RFC 6143 section 7.7.5: ZRLE's tiles at 16x16, off the wire."""
+from __future__ import annotations
+
+from struct import pack
+
+from tests.unit.decoding import DecoderTestCase, rect, update
+from vncdotool.const import Encoding
+
+RED, GREEN, BLUE = b"\x00\x00\xff", b"\x00\xff\x00", b"\xff\x00\x00"
+
+
+def trle_rect(width: int, height: int, tiles: bytes) -> bytes:
+    return rect(0, 0, width, height, Encoding.TRLE, tiles)
+
+
+class TestTRLE(DecoderTestCase):
+
+    def test_tiles_are_16x16(self) -> None:
+        tiles = b"\x01" + RED + b"\x01" + GREEN
+
+        self.cli.dataReceived(update(trle_rect(20, 2, tiles)))
+
+        row = (RED + b"\x00") * 16 + (GREEN + b"\x00") * 4
+        self.assertEqual(self.painted(), row * 2)
+
+    def test_runs_read_a_byte_at_a_time(self) -> None:
+        # one run of 16 * 16: a 255 length byte, then 0
+        tiles = b"\x80" + BLUE + b"\xff\x00"
+        data = update(trle_rect(16, 16, tiles), pack("!HHHHi", 0, 16, 1, 1, Encoding.RAW) + b"\x01\x02\x03\x00")
+
+        for i in range(len(data)):
+            self.cli.dataReceived(data[i:i + 1])
+
+        self.cli.vncProtocolError.assert_not_called()
+        (_, _, _, _, pixels, _), _ = self.cli.updateRectangle.call_args_list[0]
+        self.assertEqual(bytes(pixels), (BLUE + b"\x00") * 256)
+        self.cli.updateRectangle.assert_called_with(0, 16, 1, 1, b"\x01\x02\x03\x00", self.cli.pixel_format)
+
+    def test_packed_palette_reused(self) -> None:
+        # 16x1 and 2x1 tiles, one bit per pixel, the second reusing the
+        # first's palette
+        tiles = b"\x02" + RED + GREEN + bytes((0b01000000, 0)) + b"\x7f" + bytes((0b10000000,))
+
+        self.cli.dataReceived(update(trle_rect(18, 1, tiles)))
+
+        red, green = RED + b"\x00", GREEN + b"\x00"
+        self.assertEqual(self.painted(), red + green + red * 14 + green + red)
+
+    def test_palette_rle_reused(self) -> None:
+        first = b"\x82" + RED + GREEN + b"\x80" + bytes((255 - 1,)) + b"\x01"
+        # the second tile, 2x16: a run of 31 green then one red
+        second = b"\x81" + b"\x81" + bytes((30,)) + b"\x00"
+
+        self.cli.dataReceived(update(trle_rect(18, 16, first + second)))
+
+        red, green = RED + b"\x00", GREEN + b"\x00"
+        left = red * 255 + green
+        right = green * 31 + red
+        rows = [left[64 * y:64 * (y + 1)] + right[8 * y:8 * (y + 1)] for y in range(16)]
+        self.assertEqual(self.painted(), b"".join(rows))
+
+    def test_reusing_a_palette_before_any_is_an_error(self) -> None:
+        self.cli.dataReceived(update(trle_rect(4, 4, b"\x7f")))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
+
+    def test_a_run_past_its_tile_is_an_error(self) -> None:
+        self.cli.dataReceived(update(trle_rect(2, 2, b"\x80" + RED + b"\x04")))
+
+        self.cli.vncProtocolError.assert_called_once()
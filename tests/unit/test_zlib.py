@@ -0,0 +1,98 @@
+"""ZLIB and ZlibHex: Raw and Hextile through streams that live for the
+connection."""
+from __future__ import annotations
+
+import zlib
+from struct import pack
+from unittest import mock
+
+from tests.unit.decoding import DecoderTestCase, connect, make_client, rect, update
+from vncdotool.const import Encoding
+
+BACKGROUND, FOREGROUND, ANY_SUBRECTS, ZLIB_RAW, ZLIB_HEX = 2, 4, 8, 32, 64
+
+
+class TestZlib(DecoderTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.compressor = zlib.compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return pack("!L", len(compressed)) + compressed
+
+    def test_raw_pixels_deflated(self) -> None:
+        pixels = bytes(range(256)) * 4
+
+        self.cli.dataReceived(update(rect(0, 0, 16, 16, Encoding.ZLIB, self.compress(pixels))))
+
+        self.assertEqual(self.painted(), pixels)
+
+    def test_the_stream_carries_on_between_rectangles(self) -> None:
+        pixels = bytes(range(64))
+        for _ in range(2):
+            self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIB, self.compress(pixels))))
+
+        self.assertEqual(self.painted(once=False), pixels)
+        self.assertEqual(self.cli.updateRectangle.call_count, 2)
+
+    def test_each_connection_has_its_own_stream(self) -> None:
+        first = self.compress(bytes(64))
+        other = connect(make_client(), 64, 64)
+        other.vncProtocolError = mock.Mock()
+        other.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIB, first)))
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIB, first)))
+
+        self.cli.vncProtocolError.assert_not_called()
+        other.vncProtocolError.assert_not_called()
+
+    def test_data_inflating_past_the_rectangle_is_an_error(self) -> None:
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIB, self.compress(bytes(65)))))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
+
+    def test_data_short_of_the_rectangle_is_an_error(self) -> None:
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIB, self.compress(bytes(63)))))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+
+class TestZlibHex(DecoderTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.raw = zlib.compressobj()
+        self.hex = zlib.compressobj()
+
+    def tile(self, flags: int, stream: "zlib._Compress", body: bytes) -> bytes:
+        compressed = stream.compress(body) + stream.flush(zlib.Z_SYNC_FLUSH)
+        return bytes((flags,)) + pack("!H", len(compressed)) + compressed
+
+    def test_deflated_raw_tile(self) -> None:
+        pixels = bytes(range(64))
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIBHEX, self.tile(ZLIB_RAW, self.raw, pixels))))
+
+        self.assertEqual(self.painted(), pixels)
+
+    def test_deflated_tile_leaves_its_colours_to_the_next(self) -> None:
+        bg, fg = b"\x01\x02\x03\x00", b"\x04\x05\x06\x00"
+        flags = BACKGROUND | FOREGROUND | ANY_SUBRECTS
+        first = self.tile(ZLIB_HEX | flags, self.hex, bg + fg + pack("!BBB", 1, 0x00, 0x00))
+        # a plain Hextile subrect in the foreground the first tile set
+        second = pack("!BBBB", ANY_SUBRECTS, 1, 0x11, 0x00)
+
+        self.cli.dataReceived(update(rect(0, 0, 32, 2, Encoding.ZLIBHEX, first + second)))
+
+        rows = [fg + bg * 15 + bg * 16, bg * 16 + bg + fg + bg * 14]
+        self.assertEqual(self.painted(), b"".join(rows))
+
+    def test_deflated_tile_with_bytes_past_its_end_is_an_error(self) -> None:
+        body = b"\x01\x02\x03\x00" + b"extra"
+
+        self.cli.dataReceived(update(rect(0, 0, 4, 4, Encoding.ZLIBHEX, self.tile(ZLIB_HEX | BACKGROUND, self.hex, body))))
+
+        self.cli.vncProtocolError.assert_called_once()
@@ -0,0 +1,235 @@
+"""ZRLE, RFC 6143 section 7.7.6, inflated as its bytes arrive."""
+from __future__ import annotations
+
+import random
+import tracemalloc
+import zlib
+from concurrent.futures import Executor
+from dataclasses import replace
+from struct import pack
+from typing import Any, Callable
+from unittest import TestCase, mock
+
+from tests.unit.decoding import DecoderTestCase, connect, make_client, rect, update
+from vncdotool import client, pixelformat, rfb
+from vncdotool.const import Encoding
+
+
+def zrle_pad(rgb: bytes) -> bytes:
+    """Three-byte CPIXELs as the four-byte pixels they stand for."""
+    return b"".join(rgb[i:i + 3] + b"\x00" for i in range(0, len(rgb), 3))
+
+
+def zrle_update(x: int, y: int, width: int, height: int, compressed: bytes) -> bytes:
+    return update(rect(x, y, width, height, Encoding.ZRLE, pack("!L", len(compressed)) + compressed))
+
+
+class TestZRLE(DecoderTestCase):
+    width = height = 256
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.compressor = zlib.compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def painted(self) -> bytes:
+        pixels = super().painted()
+        (*_, pixel_format), _ = self.cli.updateRectangle.call_args
+        self.assertIs(pixel_format, self.cli.pixel_format)
+        return pixels
+
+    def test_every_tile_goes_into_one_paste(self) -> None:
+        tiles = (b"\x01" + b"\x10\x20\x30") + (b"\x01" + b"\x40\x50\x60")
+
+        self.cli.dataReceived(zrle_update(0, 0, 100, 10, self.compress(tiles)))
+
+        left, right = b"\x10\x20\x30\x00" * 64, b"\x40\x50\x60\x00" * 36
+        self.assertEqual(self.painted(), (left + right) * 10)
+        self.cli.fillRectangle.assert_not_called()
+        self.cli.commitUpdate.assert_called_once_with([(0, 0, 100, 10)])
+
+    def test_packed_palette_rows_start_on_a_byte(self) -> None:
+        black, white = b"\x00\x00\x00", b"\xff\xff\xff"
+        # 3x2, one bit per pixel: each row is one byte, padding included.
+        tile = b"\x02" + black + white + bytes((0b10100000, 0b01000000))
+
+        self.cli.dataReceived(zrle_update(0, 0, 3, 2, self.compress(tile)))
+
+        b, w = black + b"\x00", white + b"\x00"
+        self.assertEqual(self.painted(), w + b + w + b + w + b)
+
+    def test_four_bit_palette(self) -> None:
+        palette = [bytes((i, 2 * i, 3 * i)) for i in range(5)]
+        # 3x1 at four bits per index: indices 4, 0, 3 and a padding nibble
+        tile = b"\x05" + b"".join(palette) + bytes((0x40, 0x30))
+
+        self.cli.dataReceived(zrle_update(0, 0, 3, 1, self.compress(tile)))
+
+        self.assertEqual(self.painted(), b"".join(palette[i] + b"\x00" for i in (4, 0, 3)))
+
+    def test_rle_runs(self) -> None:
+        # plain RLE: a run of 5 then a run of 1
+        tile = b"\x80" + b"\x01\x02\x03" + b"\x04" + b"\x04\x05\x06" + b"\x00"
+
+        self.cli.dataReceived(zrle_update(0, 0, 6, 1, self.compress(tile)))
+
+        self.assertEqual(self.painted(), b"\x01\x02\x03\x00" * 5 + b"\x04\x05\x06\x00")
+
+    def test_palette_rle(self) -> None:
+        # 20x16: a run of 318 of colour 1, then single pixels of colours 0 and 1
+        tile = b"\x82" + b"\x01\x01\x01" + b"\x02\x02\x02" + b"\x81\xff\x3e" + b"\x00\x01"
+
+        self.cli.dataReceived(zrle_update(0, 0, 20, 16, self.compress(tile)))
+
+        one, two = b"\x01\x01\x01\x00", b"\x02\x02\x02\x00"
+        self.assertEqual(self.painted(), two * 318 + one + two)
+
+    def test_a_run_past_its_tile_is_an_error(self) -> None:
+        tile = b"\x80" + b"\x01\x02\x03" + b"\xff\xff\x00"
+
+        self.cli.dataReceived(zrle_update(0, 0, 4, 4, self.compress(tile)))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+    def test_a_palette_index_past_its_colours_is_an_error(self) -> None:
+        tile = b"\x82" + bytes(6) + b"\x05" * 16
+
+        self.cli.dataReceived(zrle_update(0, 0, 4, 4, self.compress(tile)))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+    def test_reusing_a_palette_is_trle_only(self) -> None:
+        # a 64x1 two-colour tile, then a 1x1 one reusing its palette
+        tiles = b"\x02" + bytes(6) + bytes(8) + b"\x7f" + b"\x00"
+
+        self.cli.dataReceived(zrle_update(0, 0, 65, 1, self.compress(tiles)))
+
+        self.cli.vncProtocolError.assert_called_once()
+
+    def test_the_stream_carries_on_between_rectangles(self) -> None:
+        for _ in range(2):
+            self.cli.dataReceived(zrle_update(0, 0, 1, 1, self.compress(b"\x01\x07\x07\x07")))
+
+        self.assertEqual(self.cli.fillRectangle.call_count, 2)
+
+    def test_nothing_is_painted_before_the_rest_arrives(self) -> None:
+        # Raw tiles of noise, which does not compress: 192 KiB on the wire.
+        noise = random.Random(0)
+        tiles = b"".join(b"\x00" + noise.randbytes(64 * 64 * 3) for _ in range(16))
+        update = zrle_update(0, 0, 256, 256, self.compress(tiles))
+
+        self.cli.dataReceived(update[:len(update) // 2])
+
+        self.cli.updateRectangle.assert_not_called()
+        self.cli.dataReceived(update[len(update) // 2:])
+        self.assertEqual(len(self.painted()), 256 * 256 * 4)
+
+    def test_inflating_is_bounded(self) -> None:
+        # One solid tile followed by 64 MiB of zeros, which compress to
+        # almost nothing: inflated whole, they would all be held at once.
+        compressed = self.compress(b"\x01\x01\x02\x03" + bytes(64 << 20))
+
+        tracemalloc.start()
+        try:
+            self.cli.dataReceived(zrle_update(0, 0, 64, 64, compressed))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.cli.fillRectangle.assert_called_once_with(0, 0, 64, 64, b"\x01\x02\x03\x00")
+        self.assertLess(peak, 4 << 20)
+
+    def test_truncated_data_is_an_error(self) -> None:
+        self.cli.dataReceived(zrle_update(0, 0, 4, 4, self.compress(b"\x00" + bytes(10))))
+
+        self.cli.vncProtocolError.assert_called_once()
+        self.cli.updateRectangle.assert_not_called()
+
+
+class TestZRLEReadWhole(TestCase):
+    """With a decode executor: inflated here, tiles decoded there."""
+
+    def setUp(self) -> None:
+        self.jobs: list[tuple[Callable[[], Any], Callable[[Any], None]]] = []
+        cls = type("OffloadingClient", (client.VNCDoToolClient,), {"decode_executor": mock.Mock(spec=Executor)})
+        self.cli = cls()
+        self.cli.transport = mock.Mock()
+        self.cli.factory = mock.Mock(shared=0, password=None)
+        self.cli.decodeInBackground = lambda job, done: self.jobs.append((job, done))
+        connect(self.cli, 256, 256)
+        self.calls = mock.Mock()
+        for name in ("updateRectangle", "fillRectangle", "commitUpdate", "vncProtocolError"):
+            setattr(self.cli, name, getattr(self.calls, name))
+        self.compressor = zlib.compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def test_the_stream_is_inflated_in_order_whatever_order_tiles_decode_in(self) -> None:
+        noise = random.Random(0)
+        first, second = noise.randbytes(8 * 8 * 3), noise.randbytes(8 * 8 * 3)
+        # The second rectangle's data refers back into the first's.
+        compressed = self.compress(b"\x00" + first), self.compress(b"\x00" + first[:96] + second[96:])
+        self.cli.dataReceived(
+            pack("!BxH", 0, 2)
+            + b"".join(pack("!HHHHiL", 0, 0, 8, 8, Encoding.ZRLE, len(c)) + c for c in compressed)
+        )
+        self.assertEqual(len(self.jobs), 2)
+
+        for job, done in reversed(self.jobs):
+            done(job())
+
+        self.assertEqual(self.calls.mock_calls, [
+            mock.call.updateRectangle(0, 0, 8, 8, zrle_pad(first), self.cli.pixel_format),
+            mock.call.updateRectangle(0, 0, 8, 8, zrle_pad(first[:96] + second[96:]), self.cli.pixel_format),
+            mock.call.commitUpdate([(0, 0, 8, 8), (0, 0, 8, 8)]),
+        ])
+
+    def test_data_inflating_past_what_its_tiles_can_take_is_an_error(self) -> None:
+        self.cli.dataReceived(zrle_update(0, 0, 64, 64, self.compress(b"\x01\x01\x02\x03" + bytes(1 << 20))))
+
+        self.calls.vncProtocolError.assert_called_once()
+        self.assertEqual(self.jobs, [])
+
+    def test_a_tile_cut_short_fails_its_decode(self) -> None:
+        self.cli.dataReceived(zrle_update(0, 0, 4, 4, self.compress(b"\x00" + bytes(10))))
+        job, done = self.jobs[0]
+
+        done(job())
+
+        self.calls.vncProtocolError.assert_called_once()
+        self.calls.updateRectangle.assert_not_called()
+
+
+class TestZRLEPixelLayout(TestCase):
+    """CPIXELs land in the negotiated PIXEL where cpixel_offset puts them."""
+
+    def connect(self, pixel_format: rfb.PixelFormat) -> client.VNCDoToolClient:
+        cli = connect(make_client(), 16, 16, pixel_format)
+        cli.updateRectangle = mock.Mock()
+        return cli
+
+    def painted(self, cli: client.VNCDoToolClient, tile: bytes, width: int) -> bytes:
+        compressor = zlib.compressobj()
+        compressed = compressor.compress(tile) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        cli.dataReceived(zrle_update(0, 0, width, 1, compressed))
+        (_, _, _, _, pixels, _), _ = cli.updateRectangle.call_args
+        return bytes(pixels)
+
+    def test_big_endian_low_placement_is_the_last_three_bytes(self) -> None:
+        xrgb = replace(rfb.PixelFormat(), bigendian=True)
+        self.assertEqual(pixelformat.cpixel_offset(xrgb), 1)
+        cli = self.connect(xrgb)
+
+        pixels = self.painted(cli, b"\x00" + b"\x10\x20\x30" + b"\x40\x50\x60", 2)
+
+        self.assertEqual(pixels, b"\x00\x10\x20\x30" + b"\x00\x40\x50\x60")
+
+    def test_16bpp_cpixels_are_whole_pixels(self) -> None:
+        cli = self.connect(pixelformat.PIXEL_FORMATS["rgb565"])
+
+        pixels = self.painted(cli, b"\x02" + b"\x1f\x00" + b"\xe0\x07" + bytes((0b01000000,)), 2)
+
+        self.assertEqual(pixels, b"\x1f\x00\xe0\x07")
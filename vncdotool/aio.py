@@ -0,0 +1,384 @@
+"""
+asyncio VNC client: the protocol from :mod:`vncdotool.session` on an asyncio
+transport, with no Twisted reactor, so one event loop can drive as many
+sessions as it has sockets for. Images -- Tight's JPEGs, TightPNG's PNGs --
+are decoded on other threads, :func:`~vncdotool.session.decode_pool`; given
+a ``decode_executor``, ZRLE, Tight and RRE rectangles are decoded on it
+too, images included.
+
+>>> from vncdotool import aio
+>>> async with await aio.connect("host:1", password="secret") as client:
+...     client.key_press("a")
+...     await client.capture_screen("screen.png")
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import IO, Any, Callable, Sequence, Union
+
+from .const import Encoding
+from .damage import overlaps
+from .framebuffer import FramebufferSession, load_target
+from .keys import decode_key
+from .session import (
+    AuthenticationError,
+    PixelFormat,
+    ProtocolError,
+    Rect,
+    decode_pool,
+    parse_server,
+)
+
+__all__ = ["connect", "AsyncVNCClient"]
+
+TFile = Union[str, Path, IO[bytes]]
+
+log = logging.getLogger(__name__)
+
+
+class AsyncVNCClient(FramebufferSession, asyncio.Protocol):
+    """A VNC connection on asyncio, made by :func:`connect`.
+
+    Input (:meth:`key_press`, :meth:`mouse_move`, ...) is written as it is
+    called; waiting on the server (:meth:`capture_screen`,
+    :meth:`expect_screen`, :meth:`sync`) is awaited.
+    """
+
+    buttons = 0
+
+    def __init__(
+        self,
+        password: str | None = None,
+        username: str | None = None,
+        shared: bool = True,
+        pixel_format: PixelFormat | None = None,
+        force_caps: bool = False,
+        nocursor: bool = False,
+        encodings: Sequence[Encoding] | None = None,
+        compress_level: int | None = None,
+        quality_level: int | None = None,
+        decode_executor: Executor | None = None,
+        fence: bool = False,
+    ) -> None:
+        # Before the session makes its decoders, which it tells to offload.
+        self.decode_executor = decode_executor
+        super().__init__()
+        self.password = password
+        self.username = username
+        self.shared = shared
+        self.requested_pixel_format = pixel_format
+        self.force_caps = force_caps
+        self.nocursor = nocursor
+        self.encodings = list(encodings) if encodings else None
+        self.compress_level = compress_level
+        self.quality_level = quality_level
+        self.fence = fence
+        self.transport: asyncio.Transport | None = None
+        loop = asyncio.get_running_loop()
+        self._connected: asyncio.Future[AsyncVNCClient] = loop.create_future()
+        self._disconnected: asyncio.Future[None] = loop.create_future()
+        self._refresh: asyncio.Future[AsyncVNCClient] | None = None
+        self._syncs: dict[bytes, asyncio.Future[AsyncVNCClient]] = {}
+
+    async def __aenter__(self) -> AsyncVNCClient:
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        await self.disconnect()
+
+    #
+    # asyncio.Protocol
+    #
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def data_received(self, data: bytes) -> None:
+        self.feed(data)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._fail(exc or ConnectionError("connection closed"))
+        if not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    def _fail(self, exc: BaseException) -> None:
+        """Fail whatever is waiting on the server."""
+        waiting = [self._connected, self._refresh, *self._syncs.values()]
+        self._refresh = None
+        self._syncs.clear()
+        for future in waiting:
+            if future is not None and not future.done():
+                future.set_exception(exc)
+
+    #
+    # session IO
+    #
+    def flush(self) -> None:
+        if self._outgoing and self.transport is not None:
+            self.transport.write(self.data_to_send())
+
+    def _close(self) -> None:
+        super()._close()
+        self.flush()
+        if self.transport is not None:
+            self.transport.close()
+
+    def decodeInBackground(
+        self, job: Callable[[], Any], done: Callable[[Any], None]
+    ) -> None:
+        """On :attr:`decode_executor`, or :func:`~vncdotool.session.decode_pool`,
+        leaving the loop to every other session meanwhile."""
+        def finished(future: asyncio.Future[Any]) -> None:
+            # Cancelled when the loop shuts down under it; failed, rather
+            # than the job, when a process pool breaks.
+            if not future.cancelled():
+                done(future.exception() or future.result())
+
+        executor = self.decode_executor or decode_pool()
+        asyncio.get_running_loop().run_in_executor(executor, job).add_done_callback(finished)
+
+    #
+    # session callbacks
+    #
+    def vncConnectionMade(self) -> None:
+        self.setImageMode()
+        encodings = list(self.encodings or [Encoding.RAW, Encoding.COPY_RECTANGLE])
+        encodings += self._levelEncodings()
+        if self.nocursor:
+            encodings.append(Encoding.PSEUDO_CURSOR)
+        encodings += [
+            Encoding.PSEUDO_DESKTOP_SIZE,
+            Encoding.PSEUDO_LAST_RECT,
+            Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT,
+        ]
+        if self.fence:
+            encodings.append(Encoding.PSEUDO_FENCE)
+        self.setEncodings(encodings)
+        if not self._connected.done():
+            self._connected.set_result(self)
+
+    def vncRequestPassword(self) -> None:
+        if self.password is None:
+            self._fail(AuthenticationError("password required, but none provided"))
+            self._close()
+            return
+        self.sendPassword(self.password)
+
+    def vncAuthFailed(self, reason: bytes | str) -> None:
+        super().vncAuthFailed(reason)
+        if isinstance(reason, bytes):
+            reason = reason.decode("utf-8", "replace")
+        self._fail(AuthenticationError(reason))
+
+    def vncProtocolError(self, reason: str) -> None:
+        super().vncProtocolError(reason)
+        self._fail(ProtocolError(reason))
+
+    def commitUpdate(self, rectangles: list[Rect] | None = None) -> None:
+        if self._refresh is None:
+            return
+        if not rectangles:
+            # No rectangle in this update painted the screen; wait for
+            # one that does before completing the refresh.
+            self.requestUpdate(self._requested)
+            return
+        if self._regionsIgnored():
+            return
+        refresh, self._refresh = self._refresh, None
+        if not refresh.done():
+            refresh.set_result(self)
+
+    def serverFence(self, flags: int, payload: bytes) -> None:
+        future = self._syncs.pop(payload, None)
+        if future is not None and not future.done():
+            future.set_result(self)
+
+    #
+    # input
+    #
+    def key_press(self, key: str) -> AsyncVNCClient:
+        """Send a key press: a character, or names from :data:`keys.KEYMAP`
+        joined by ``-`` such as ``ctrl-alt-del``."""
+        keys = decode_key(key, self.force_caps)
+        with self.batch():
+            for k in keys:
+                self.keyEvent(k, down=True)
+            for k in reversed(keys):
+                self.keyEvent(k, down=False)
+        return self
+
+    def key_down(self, key: str) -> AsyncVNCClient:
+        with self.batch():
+            for k in decode_key(key, self.force_caps):
+                self.keyEvent(k, down=True)
+        return self
+
+    def key_up(self, key: str) -> AsyncVNCClient:
+        with self.batch():
+            for k in decode_key(key, self.force_caps):
+                self.keyEvent(k, down=False)
+        return self
+
+    def mouse_move(self, x: int, y: int) -> AsyncVNCClient:
+        self.x, self.y = x, y
+        self.pointerEvent(x, y, self.buttons)
+        return self
+
+    def mouse_down(self, button: int) -> AsyncVNCClient:
+        self.buttons |= 1 << (button - 1)
+        self.pointerEvent(self.x, self.y, self.buttons)
+        return self
+
+    def mouse_up(self, button: int) -> AsyncVNCClient:
+        self.buttons &= ~(1 << (button - 1))
+        self.pointerEvent(self.x, self.y, self.buttons)
+        return self
+
+    def mouse_press(self, button: int) -> AsyncVNCClient:
+        with self.batch():
+            self.mouse_down(button)
+            self.mouse_up(button)
+        return self
+
+    def paste(self, text: str) -> AsyncVNCClient:
+        self.clientCutText(text)
+        return self
+
+    #
+    # waiting on the server
+    #
+    async def refresh_screen(
+        self, incremental: bool = False, regions: list[Rect] | None = None
+    ) -> AsyncVNCClient:
+        """Wait for an update that paints the screen, asking for the
+        ``(x, y, width, height)`` ``regions`` of it or for all of it."""
+        loop = asyncio.get_running_loop()
+        if self._refresh is None:
+            self._refresh = loop.create_future()
+            self.requestUpdate(regions, incremental)
+            return await self._refresh
+        # Another wait's request is unanswered: ask for these regions too,
+        # and wait for an update painting one of them, not just any update.
+        token = self._painted.token
+        self._requestAlso(regions, incremental)
+        refresh = self._refresh
+        while True:
+            await refresh
+            if not regions or self._requested is None:
+                return self
+            painted, _ = self._painted.since(token)
+            if any(overlaps(rect, region) for rect in painted for region in regions):
+                return self
+            if self._refresh is None:
+                self._refresh = loop.create_future()
+            refresh = self._refresh
+
+    async def capture_screen(
+        self, fp: TFile, incremental: bool = False, format: str | None = None
+    ) -> AsyncVNCClient:
+        """Save the screen to ``fp``, a path or a binary file, in ``format``
+        or the one its name implies."""
+        await self.refresh_screen(incremental)
+        assert self.screen is not None
+        self.screen.save(fp, format=format)
+        return self
+
+    async def capture_region(
+        self, fp: TFile, x: int, y: int, w: int, h: int, incremental: bool = False,
+        format: str | None = None,
+    ) -> AsyncVNCClient:
+        """Save the ``w`` by ``h`` region at (x, y), asking the server for
+        that region alone."""
+        await self.refresh_screen(incremental, [(x, y, w, h)])
+        assert self.screen is not None
+        self.screen.crop((x, y, x + w, y + h)).save(fp, format=format)
+        return self
+
+    async def expect_screen(self, filename: TFile, maxrms: float = 0) -> AsyncVNCClient:
+        """Wait until the screen matches the image in ``filename``, within
+        ``maxrms`` root mean square between their histograms."""
+        return await self.expect_region(filename, 0, 0, maxrms)
+
+    async def expect_region(
+        self, filename: TFile, x: int, y: int, maxrms: float = 0
+    ) -> AsyncVNCClient:
+        """Wait until the screen at (x, y) matches the image in ``filename``."""
+        (w, h), expected = load_target(filename)
+        box = (x, y, x + w, y + h)
+        while not self._matches(box, maxrms, expected):
+            await self.refresh_screen(self._hasScreen(), [(x, y, w, h)])
+        return self
+
+    async def sync(self) -> AsyncVNCClient:
+        """Wait until the server has handled everything sent before, with a
+        fence round trip. Fences are offered only when connected with
+        ``fence``; without them, or a server supporting them, this cannot
+        tell and returns at once."""
+        if Encoding.PSEUDO_FENCE not in self.negotiated_encodings:
+            return self
+        future = asyncio.get_running_loop().create_future()
+        self._syncs[self.requestFence()] = future
+        return await future
+
+    async def disconnect(self) -> None:
+        if self.transport is not None:
+            self._close()
+        await self._disconnected
+
+
+async def connect(
+    server: str,
+    password: str | None = None,
+    *,
+    username: str | None = None,
+    shared: bool = True,
+    pixel_format: PixelFormat | None = None,
+    force_caps: bool = False,
+    nocursor: bool = False,
+    encodings: Sequence[Encoding] | None = None,
+    compress_level: int | None = None,
+    quality_level: int | None = None,
+    decode_executor: Executor | None = None,
+    fence: bool = False,
+    timeout: float | None = None,
+) -> AsyncVNCClient:
+    """Connect to ``server``, named as for ``vncdo --server``, and return the
+    client once the handshake is done.
+
+    ``encodings`` are offered in order of preference, Raw and CopyRect by
+    default; ``compress_level`` and ``quality_level`` (0-9) tune Tight.
+    ``decode_executor``, a thread or process pool, takes the decoding of
+    whole rectangles off the loop; see
+    :attr:`~vncdotool.session.RFBSession.decode_executor`. ``fence`` offers
+    the Fence extension, which :meth:`AsyncVNCClient.sync` needs to wait.
+    """
+    family, host, port = parse_server(server)
+    loop = asyncio.get_running_loop()
+
+    def client() -> AsyncVNCClient:
+        return AsyncVNCClient(
+            password=password,
+            username=username,
+            shared=shared,
+            pixel_format=pixel_format,
+            force_caps=force_caps,
+            nocursor=nocursor,
+            encodings=encodings,
+            compress_level=compress_level,
+            quality_level=quality_level,
+            decode_executor=decode_executor,
+            fence=fence,
+        )
+
+    if hasattr(socket, "AF_UNIX") and family == socket.AF_UNIX:
+        _, protocol = await loop.create_unix_connection(client, host)
+    else:
+        _, protocol = await loop.create_connection(client, host, port, family=family)
+    try:
+        return await asyncio.wait_for(asyncio.shield(protocol._connected), timeout)
+    except BaseException:
+        protocol._close()
+        raise
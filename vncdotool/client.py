@@ -8,77 +8,38 @@ Twisted based VNC client protocol and factory.
 from __future__ import annotations
 
 import logging
-import math
 import socket
-import warnings
 from pathlib import Path
 from struct import pack
-from typing import IO, Any, Callable, Iterator, TypeVar, Union
+from typing import IO, Callable, Iterator, TypeVar, Union
 
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue, succeed
 from twisted.internet.endpoints import HostnameEndpoint, UNIXClientEndpoint
 from twisted.internet.interfaces import IConnector, ITCPTransport
 from twisted.python.failure import Failure
 
-from . import pixelformat, rfb
-from .keys import KEYMAP
+from . import rfb
+from .framebuffer import FramebufferSession, Image, load_target  # noqa: F401
+from .keys import SPECIAL_KEYS_US, decode_key
+from .session import AuthenticationError, ProtocolError, VNCDoException  # noqa: F401
 
 TClient = TypeVar("TClient", bound="VNCDoToolClient")
 TFile = Union[str, Path, IO[bytes]]
 
 log = logging.getLogger(__name__)
 
-# Enable using vncdotool without PIL. Of course capture and expect
-# won't work but at least we can still offer key, type, press and
-# move.
-try:
-    from PIL import Image
 
-    # Init PIL to make sure it will not try to import plugin libraries
-    # in a thread.
-    Image.preinit()
-    Image.init()
-except ImportError:
-    # If there is no PIL, raise ImportError where someone tries to use
-    # it.
-    class _RuntimeImportError:
-        def __getattr__(self, _: str) -> Any:
-            raise ImportError("PIL")
-
-    Image = _RuntimeImportError()  # type: ignore[assignment]
-    PIL = _RuntimeImportError()
-
-
-class VNCDoException(Exception):
-    pass
-
-
-class AuthenticationError(VNCDoException):
-    """VNC Server requires Authentication"""
-
-
-class ProtocolError(VNCDoException):
-    """VNC Server sent something we cannot handle"""
-
-
-class VNCDoToolClient(rfb.RFBClient):
+class VNCDoToolClient(FramebufferSession, rfb.RFBClient):
     encoding = rfb.Encoding.RAW
-    requested_pixel_format: rfb.PixelFormat | None = None
-    x = 0
-    y = 0
     buttons = 0
-    screen: Image.Image | None = None
-    _image_mode = pixelformat.raw_mode(rfb.PixelFormat())
-    _raw_mode_format: rfb.PixelFormat | None = None
-    _raw_mode = ""
     deferred: Deferred | None = None
 
-    cursor: Image.Image | None = None
-    cmask: Image.Image | None = None
+    SPECIAL_KEYS_US = SPECIAL_KEYS_US
 
-    SPECIAL_KEYS_US = '~!@#$%^&*()_+{}|:"<>?'
-    MAX_DESKTOP_SIZE = 0x10000
+    def __init__(self) -> None:
+        super().__init__()
+        self._syncs: dict[bytes, Deferred] = {}
 
     def connectionMade(self) -> None:
         super().connectionMade()
@@ -90,17 +51,12 @@ class VNCDoToolClient(rfb.RFBClient):
         super().connectionLost(reason)
         self.factory.clientConnectionLost(self, reason)
 
-    def _decodeKey(self, key: str) -> list[int]:
-        if self.factory.force_caps:
-            if key.isupper() or key in self.SPECIAL_KEYS_US:
-                key = "shift-%c" % key
-
-        if len(key) == 1:
-            keys = [key]
-        else:
-            keys = key.split("-")
+    @property  # type: ignore[override]
+    def nocursor(self) -> bool:
+        return self.factory.nocursor
 
-        return [KEYMAP.get(k) or ord(k) for k in keys]
+    def _decodeKey(self, key: str) -> list[int]:
+        return decode_key(key, self.factory.force_caps)
 
     def pause(self, duration: float) -> Deferred:
         d = Deferred()
@@ -114,26 +70,29 @@ class VNCDoToolClient(rfb.RFBClient):
         """
         keys = self._decodeKey(key)
         log.debug("keyPress %s", keys)
-        for k in keys:
-            self.keyEvent(k, down=True)
-        for k in reversed(keys):
-            self.keyEvent(k, down=False)
+        with self.batch():
+            for k in keys:
+                self.keyEvent(k, down=True)
+            for k in reversed(keys):
+                self.keyEvent(k, down=False)
 
         return self
 
     def keyDown(self: TClient, key: str) -> TClient:
         keys = self._decodeKey(key)
         log.debug("keyDown %s", keys)
-        for k in keys:
-            self.keyEvent(k, down=True)
+        with self.batch():
+            for k in keys:
+                self.keyEvent(k, down=True)
 
         return self
 
     def keyUp(self: TClient, key: str) -> TClient:
         keys = self._decodeKey(key)
         log.debug("keyUp %s", keys)
-        for k in keys:
-            self.keyEvent(k, down=False)
+        with self.batch():
+            for k in keys:
+                self.keyEvent(k, down=False)
 
         return self
 
@@ -143,11 +102,25 @@ class VNCDoToolClient(rfb.RFBClient):
         :param button: [1-n]
         """
         log.debug("mousePress %s", button)
-        self.mouseDown(button)
-        self.mouseUp(button)
+        with self.batch():
+            self.mouseDown(button)
+            self.mouseUp(button)
 
         return self
 
+    def sync(self) -> Deferred:
+        """Wait until the server has handled everything sent before, with a
+        fence round trip that also measures :attr:`rtt`. The factory must
+        offer fences (``fence``); a server without fence support cannot
+        tell, so this fires at once.
+        """
+        if rfb.Encoding.PSEUDO_FENCE not in self.negotiated_encodings:
+            log.debug("sync: the server does not support fences")
+            return succeed(self)
+        d = Deferred()
+        self._syncs[self.requestFence()] = d
+        return d
+
     def mouseDown(self: TClient, button: int) -> TClient:
         """Send a mouse button down at the last set position
 
@@ -196,15 +169,27 @@ class VNCDoToolClient(rfb.RFBClient):
         log.debug("captureRegion %s", fp)
         return self._capture(fp, incremental, x, y, x + w, y + h)
 
-    def refreshScreen(self, incremental: bool = False) -> Deferred:
+    def refreshScreen(
+        self, incremental: bool = False, regions: list[rfb.Rect] | None = None
+    ) -> Deferred:
+        """Wait for an update of the ``(x, y, width, height)`` ``regions``, or
+        of the whole screen."""
+        if self.continuous_updates and self.screen is not None:
+            # The server pushes every change as it happens, so the screen
+            # already is what a request would bring back.
+            return succeed(self)
         d = self.deferred = Deferred()
-        self.framebufferUpdateRequest(incremental=incremental)
+        self.requestUpdate(regions, incremental)
         return d
 
     def _capture(
         self, fp: TFile, incremental: bool, *args: int, format: str | None = None
     ) -> Deferred:
-        d = self.refreshScreen(incremental)
+        regions = None
+        if args:
+            x1, y1, x2, y2 = args
+            regions = [(x1, y1, x2 - x1, y2 - y1)]
+        d = self.refreshScreen(incremental, regions)
         kwargs = {"format": format} if format else {}
         d.addCallback(self._captureSave, fp, *args, **kwargs)
         return d
@@ -245,32 +230,22 @@ class VNCDoToolClient(rfb.RFBClient):
     def _expectFramebuffer(
         self, filename: str, x: int, y: int, maxrms: float
     ) -> Deferred:
-        image = Image.open(filename)
-        w, h = image.size
-        self.expected = image.histogram()
+        (w, h), self.expected = load_target(filename)
 
         return self._expectCompare(None, (x, y, x + w, y + h), maxrms)
 
     def _expectCompare(self, data: object, box: rfb.Rect, maxrms: float) -> Deferred:
-        incremental = False
-        if self.screen:
-            incremental = True
-            image = self.screen.crop(box)
-
-            hist = image.histogram()
-            if len(hist) == len(self.expected):
-                sum_ = sum((h - e) ** 2 for h, e in zip(hist, self.expected))
-                rms = math.sqrt(sum_ / len(hist))
-
-                log.debug("rms:%f maxrms:%f", rms, maxrms)
-                if rms <= maxrms:
-                    return self
+        incremental = self._hasScreen()
+        if self._matches(box, maxrms, self.expected):
+            return self
 
         self.deferred = Deferred()
         self.deferred.addCallback(self._expectCompare, box, maxrms)
-        self.framebufferUpdateRequest(
-            incremental=incremental
-        )  # use box ~(x, y, w - x, h - y)?
+        if not (self.continuous_updates and self._hasScreen()):
+            # Otherwise the next update the server pushes is the next
+            # chance to match; there is nothing to ask for.
+            x1, y1, x2, y2 = box
+            self.requestUpdate([(x1, y1, x2 - x1, y2 - y1)], incremental)
 
         return self.deferred
 
@@ -296,57 +271,12 @@ class VNCDoToolClient(rfb.RFBClient):
 
         returnValue(self)
 
-    @property
-    def image_mode(self) -> str:
-        warnings.warn(
-            "image_mode will change in a future release; please comment on "
-            "https://github.com/sibson/vncdotool/issues/385 if you rely on it",
-            FutureWarning,
-            stacklevel=2,
-        )
-        return self._image_mode
-
-    def _rawModeFor(self, pixel_format: rfb.PixelFormat) -> str:
-        # Called once per rectangle. A PixelFormat is a frozen dataclass, so
-        # hashing one for a cache lookup costs more than the identity check
-        # a decoder handing back the same instance every time satisfies.
-        if pixel_format is not self._raw_mode_format:
-            self._raw_mode_format = pixel_format
-            self._raw_mode = pixelformat.raw_mode(pixel_format)
-        return self._raw_mode
-
-    def setImageMode(self) -> None:
-        """Check support for PixelFormats announced by server or select client supported alternative."""
-        pixel_format = self.requested_pixel_format
-        if pixel_format is None:
-            try:
-                self._image_mode = pixelformat.raw_mode(self.pixel_format)
-                return
-            except pixelformat.UnsupportedPixelFormat as exc:
-                log.debug("cannot unpack the server's format (%s), asking for another", exc)
-                if self._version_server == (3, 889):  # Apple Remote Desktop
-                    pixel_format = pixelformat.PIXEL_FORMATS["rgb565"]
-                else:
-                    pixel_format = pixelformat.PIXEL_FORMATS["rgbx8888"]
-
-        # Resolved before the request goes out: failing afterwards would
-        # leave the server sending pixels in a format we cannot read.
-        try:
-            image_mode = pixelformat.raw_mode(pixel_format)
-        except pixelformat.UnsupportedPixelFormat as exc:
-            self.vncProtocolError(f"cannot decode the requested pixel format: {exc}")
-            self.transport.loseConnection()
-            return
-
-        self.setPixelFormat(pixel_format)
-        self._image_mode = image_mode
-
     #
     # base customizations
     #
     def vncRequestPassword(self) -> None:
         if self.factory.password is None:
-            self.transport.loseConnection()
+            self._close()
             self.factory.clientConnectionFailed(
                 self, AuthenticationError("password required, but none provided")
             )
@@ -365,7 +295,13 @@ class VNCDoToolClient(rfb.RFBClient):
 
     def vncConnectionMade(self) -> None:
         self.setImageMode()
-        encodings = [self.encoding]
+        if self.encodings is not None:
+            encodings = list(self.encodings)
+        else:
+            encodings = [self.encoding]
+            if self.encoding != rfb.Encoding.COPY_RECTANGLE:
+                encodings.append(rfb.Encoding.COPY_RECTANGLE)
+        encodings += self._levelEncodings()
         if self.factory.pseudocursor or self.factory.nocursor:
             encodings.append(rfb.Encoding.PSEUDO_CURSOR)
         if self.factory.pseudodesktop:
@@ -374,9 +310,24 @@ class VNCDoToolClient(rfb.RFBClient):
             encodings.append(rfb.Encoding.PSEUDO_LAST_RECT)
         if self.factory.qemu_extended_key:
             encodings.append(rfb.Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT)
+        if self.factory.continuous_updates:
+            encodings.append(rfb.Encoding.PSEUDO_CONTINUOUS_UPDATES)
+        if self.factory.fence:
+            encodings.append(rfb.Encoding.PSEUDO_FENCE)
         self.setEncodings(encodings)
         self.factory.clientConnectionMade(self)
 
+    def continuousUpdatesSupported(self) -> None:
+        if self.factory.continuous_updates:
+            log.debug("continuous updates enabled")
+            self.enableContinuousUpdates()
+
+    def serverFence(self, flags: int, payload: bytes) -> None:
+        d = self._syncs.pop(payload, None)
+        if d is not None:
+            log.debug("sync took %.1f ms", (self.rtt or 0) * 1000)
+            d.callback(self)
+
     def bell(self) -> None:
         log.info("ding")
 
@@ -387,91 +338,20 @@ class VNCDoToolClient(rfb.RFBClient):
         self.clientCutText(message)
         return self
 
-    def updateRectangle(
-        self,
-        x: int,
-        y: int,
-        width: int,
-        height: int,
-        data: bytes,
-        pixel_format: rfb.PixelFormat,
-    ) -> None:
-        # ignore empty updates
-        if not data:
-            return
-
-        size = (width, height)
-        update = Image.frombytes(
-            "RGB", size, data, "raw", self._rawModeFor(pixel_format)
-        )
-        if not self.screen:
-            self.screen = Image.new("RGB", (self.width, self.height), "black")
-            self.screen.paste(update, (x, y))
-        # track upward screen resizes, often occurs during os boot of VMs
-        # When the screen is sent in chunks (as observed on VMWare ESXi), the canvas
-        # needs to be resized to fit all existing contents and the update.
-        elif self.screen.size[0] < (x + width) or self.screen.size[1] < (y + height):
-            new_size = (
-                max(x + width, self.screen.size[0]),
-                max(y + height, self.screen.size[1]),
-            )
-            new_screen = Image.new("RGB", new_size, "black")
-            new_screen.paste(self.screen, (0, 0))
-            new_screen.paste(update, (x, y))
-            self.screen = new_screen
-        else:
-            self.screen.paste(update, (x, y))
-
-        self.drawCursor()
-
     def commitUpdate(self, rectangles: list[rfb.Rect] | None = None) -> None:
         if self.deferred:
             if not rectangles:
                 # No rectangle in this update painted self.screen; wait for
                 # one that does before completing the refresh.
-                self.framebufferUpdateRequest()
+                if not self.continuous_updates:
+                    self.requestUpdate(self._requested)
+                return
+            if self._regionsIgnored():
                 return
             d = self.deferred
             self.deferred = None
             d.callback(self)
 
-    def updateCursor(
-        self, x: int, y: int, width: int, height: int, image: bytes, mask: bytes
-    ) -> None:
-        if self.factory.nocursor:
-            return
-
-        if not width or not height:
-            self.cursor = None
-
-        self.cursor = Image.frombytes(
-            "RGB", (width, height), image, "raw", self._image_mode
-        )
-        self.cmask = Image.frombytes("1", (width, height), mask)
-        self.cfocus = x, y
-        self.drawCursor()
-
-    def drawCursor(self) -> None:
-        if not self.cursor:
-            return
-
-        if not self.screen:
-            return
-
-        x = self.x - self.cfocus[0]
-        y = self.y - self.cfocus[1]
-        self.screen.paste(self.cursor, (x, y), self.cmask)
-
-    def updateDesktopSize(self, width: int, height: int) -> None:
-        if not (
-            0 <= width < self.MAX_DESKTOP_SIZE and 0 <= height < self.MAX_DESKTOP_SIZE
-        ):
-            raise ValueError((width, height))
-        new_screen = Image.new("RGB", (width, height), "black")
-        if self.screen:
-            new_screen.paste(self.screen, (0, 0))
-        self.screen = new_screen
-
 
 class VMWareClient(VNCDoToolClient):
     SINGLE_PIXEL_UPDATE = pack(
@@ -514,8 +394,17 @@ class VNCDoToolFactory(rfb.RFBFactory):
     pseudodesktop = True
     qemu_extended_key = True
     last_rect = True
+    continuous_updates = False
+    # Offer fences, for sync() and flow control under continuous updates;
+    # vncdo turns this on when a command list syncs.
+    fence = False
     force_caps = False
     pixel_format: rfb.PixelFormat | None = None
+    # Offered most preferred first; None offers the client's encoding and
+    # CopyRect.
+    encodings: list[rfb.Encoding] | None = None
+    compress_level: int | None = None
+    quality_level: int | None = None
 
     def __init__(self) -> None:
         self.deferred = Deferred()
@@ -524,6 +413,9 @@ class VNCDoToolFactory(rfb.RFBFactory):
     def buildProtocol(self, addr: object) -> VNCDoToolClient:
         protocol = super().buildProtocol(addr)
         protocol.requested_pixel_format = self.pixel_format
+        protocol.encodings = self.encodings
+        protocol.compress_level = self.compress_level
+        protocol.quality_level = self.quality_level
         return protocol
 
     def clientConnectionLost(self, connector: IConnector, reason: Failure) -> None:
@@ -9,14 +9,12 @@ Command line interface to interact with a VNC Server.
 from __future__ import annotations
 
 import getpass
-import ipaddress
 import enum
 import logging
 import logging.handlers
 import optparse
 import os
 import shlex
-import socket
 import sys
 import tempfile
 from types import TracebackType
@@ -27,7 +25,7 @@ from twisted.internet.interfaces import IConnector
 from twisted.python.failure import Failure
 from twisted.python.log import PythonLoggingObserver
 
-from . import pixelformat
+from . import decoders, pixelformat, rfb, trace
 from .capture import check_capture_target
 from .client import (
     AuthenticationError,
@@ -39,11 +37,20 @@ from .client import (
 )
 from .loggingproxy import VNCLoggingServerFactory
 from .replay import Capture
+from .session import parse_server
 
 log = logging.getLogger()
 
 SUPPORTED_FORMATS = ("png", "jpg", "jpeg", "gif", "bmp")
 
+# --encodings names: what there is a decoder for, pseudo-encodings aside.
+# TightPNG took a number from the pseudo-encodings' range, but paints pixels.
+ENCODINGS = {
+    encoding.name.lower().replace("_", "-"): encoding
+    for encoding, cls in decoders.DECODERS.items()
+    if encoding >= 0 or issubclass(cls, decoders.PixelDecoder)
+}
+
 
 class TimeoutError(RuntimeError):
     pass
@@ -90,7 +97,17 @@ def log_connected(pcol: TClient) -> TClient:
     return pcol
 
 
+def disconnect(pcol: TClient) -> None:
+    # What the last commands left for the reactor's turn goes first.
+    pcol.flush()
+    pcol.transport.loseConnection()
+
+
 class VNCDoCLIClient(VNCDoToolClient):
+    # The commands run back to back in one reactor turn, each sending a
+    # few small messages.
+    flush_per_turn = True
+
     def vncRequestPassword(self) -> None:
         if self.factory.password is None:
             self.factory.password = getpass.getpass("VNC password:")
@@ -157,6 +174,7 @@ class VNCDoToolOptionParser(optparse.OptionParser):
             "  capture FILE\t\tsave current screen as FILE\n"
             "  expect FILE FUZZ\twait until screen matches FILE\n"
             "  pause SECONDS\t\twait SECONDS before sending next command\n"
+            "  sync\t\t\twait until the server has handled what was sent\n"
             "\n"
             "Other Commands (CMD):\n"
             "  keyup KEY\t\tsend KEY released\n"
@@ -272,6 +290,9 @@ def build_command_list(
             y = int(args.pop(0))
             rms = float(args.pop(0))
             factory.deferred.addCallback(client.expectRegion, filename, x, y, rms)
+        elif cmd == "sync":
+            factory.fence = True
+            factory.deferred.addCallback(client.sync)
         elif cmd in ("pause", "sleep"):
             duration = float(args.pop(0)) / warp
             factory.deferred.addCallback(client.pause, duration)
@@ -313,7 +334,7 @@ def build_tool(options: optparse.Values, args: list[str]) -> VNCDoCLIFactory:
     reactor.exit_status = None
     factory_connect(factory, options.host, options.port, options.address_family)
 
-    factory.deferred.addCallback(lambda client: client.transport.loseConnection())
+    factory.deferred.addCallback(disconnect)
     factory.deferred.addCallback(lambda _: factory.done(ExitStatus.SUCCESS))
     factory.deferred.addErrback(factory.error)
 
@@ -380,44 +401,13 @@ def setup_logging(options: optparse.Values) -> None:
     elif options.verbose:
         logging.getLogger().setLevel(logging.INFO)
 
-    PythonLoggingObserver().start()
-
-
-def parse_server(server: str) -> tuple[socket.AddressFamily, str, int]:
-    if server.startswith("["):
-        host, sep, server = server[1:].partition("]")
-        if not sep:
-            raise ValueError(server)
-        ipaddress.IPv6Address(host)
-        split = server.split(":")
-        address_family = socket.AF_INET6
-    else:
-        split = server.split(":")
-        if not split[0]:
-            host = "127.0.0.1"
-        else:
-            host = split[0]
-
-        if hasattr(socket, "AF_UNIX") and os.path.exists(host):
-            address_family = socket.AF_UNIX
-        else:
-            try:
-                ipaddress.IPv4Address(host)
-            except ipaddress.AddressValueError:
-                address_family = socket.AF_UNSPEC
-            else:
-                address_family = socket.AF_INET
-
-    if len(split) == 3:  # ::port
-        port = int(split[2])
-    elif len(split) == 2:  # :display
-        port = int(split[1]) + 5900
-    elif len(split) == 1:  # default
-        port = 5900
-    else:
-        raise ValueError(server)
+    if options.verbose:
+        # The per-rectangle detail -v has always printed comes from the
+        # protocol's trace events now, which cost nothing unless a sink
+        # is attached.
+        rfb.RFBClient.tracer = trace.Tracer(trace.LoggingSink())
 
-    return address_family, host, port
+    PythonLoggingObserver().start()
 
 
 def vnclog() -> None:
@@ -600,6 +590,30 @@ def vncdo(argv: list[str] | None = None) -> None:
         help="ask the server for FORMAT (%s) instead of accepting the one it "
         "announces" % ", ".join(sorted(pixelformat.PIXEL_FORMATS)),
     )
+    op.add_option(
+        "--encodings",
+        metavar="NAMES",
+        help="offer the comma-separated encodings NAMES (%s), most preferred "
+        "first [raw,copy-rectangle]" % ", ".join(ENCODINGS),
+    )
+    op.add_option(
+        "--compress-level",
+        type="int",
+        metavar="LEVEL",
+        help="ask the server to deflate at LEVEL, 0-9",
+    )
+    op.add_option(
+        "--quality",
+        type="int",
+        metavar="LEVEL",
+        help="let the server send Tight rectangles as JPEG of quality LEVEL, 0-9",
+    )
+    op.add_option(
+        "--continuous-updates",
+        action="store_true",
+        help="have the server push screen changes as they happen, so capture "
+        "and expect need not ask for each refresh",
+    )
     op.add_option(
         "-i",
         "--incremental-refreshes",
@@ -611,6 +625,16 @@ def vncdo(argv: list[str] | None = None) -> None:
     options, args = op.parse_args(args=argv)
     if not len(args):
         op.error("no command provided")
+    encodings = None
+    if options.encodings:
+        try:
+            encodings = [ENCODINGS[name.strip()] for name in options.encodings.split(",")]
+        except KeyError as exc:
+            op.error(f"unknown encoding {exc}; choose from {', '.join(ENCODINGS)}")
+    for option in ("compress_level", "quality"):
+        level = getattr(options, option)
+        if level is not None and not 0 <= level <= 9:
+            op.error(f"--{option.replace('_', '-')} must be 0-9")
 
     setup_logging(options)
     options.address_family, options.host, options.port = parse_server(options.server)
@@ -633,9 +657,17 @@ def vncdo(argv: list[str] | None = None) -> None:
     if options.force_caps:
         factory.force_caps = True
 
+    if options.continuous_updates:
+        factory.continuous_updates = True
+        factory.fence = True
+
     if options.pixel_format:
         factory.pixel_format = pixelformat.PIXEL_FORMATS[options.pixel_format]
 
+    factory.encodings = encodings
+    factory.compress_level = options.compress_level
+    factory.quality_level = options.quality
+
     if options.timeout:
         message = "TIMEOUT Exceeded (%ss)" % options.timeout
         failure = Failure(TimeoutError(message))
@@ -23,6 +23,20 @@ class Encoding(IntEnumLookup):
     def lookup(cls, value: int) -> object:
         return super().lookup(cls.s32(value))
 
+    @classmethod
+    def compress_level(cls, level: int) -> Encoding:
+        """The pseudo-encoding asking for zlib compression ``level``, 0-9."""
+        if not 0 <= level <= 9:
+            raise ValueError(f"compression level {level} is not 0-9")
+        return cls(-256 + level)
+
+    @classmethod
+    def quality_level(cls, level: int) -> Encoding:
+        """The pseudo-encoding asking for JPEG quality ``level``, 0-9."""
+        if not 0 <= level <= 9:
+            raise ValueError(f"quality level {level} is not 0-9")
+        return cls(-32 + level)
+
     RAW = 0
     COPY_RECTANGLE = 1
     RRE = 2
@@ -144,6 +158,19 @@ class HextileEncoding(IntFlag):
     FOREGROUND_SPECIFIED = 4
     ANY_SUBRECTS = 8
     SUBRECTS_COLORED = 16
+    # ZlibHex only: the tile's raw pixels, or the rest of its Hextile
+    # encoding, deflated.
+    ZLIB_RAW = 32
+    ZLIB_HEX = 64
+
+
+class FenceFlags(IntFlag):
+    """Fence message flags, from the RFB community extensions."""
+
+    BLOCK_BEFORE = 1
+    BLOCK_AFTER = 2
+    SYNC_NEXT = 4
+    REQUEST = 0x80000000
 
 
 class AuthTypes(IntEnumLookup):
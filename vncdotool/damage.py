@@ -0,0 +1,97 @@
+"""
+Which areas of the screen have been painted, for any number of readers each
+asking what changed since it last looked::
+
+    rects, token = client.damage_since()
+    ...
+    rects, token = client.damage_since(token)
+    if not rects:
+        ...  # nothing painted since; skip the work
+
+A token counts paints, so every reader keeps its own and none disturbs
+another's. The log holds a bounded number of areas; those it drops are kept
+as one box around them all, so a reader that looks rarely gets a coarser
+answer, never one missing anything.
+"""
+from __future__ import annotations
+
+from collections import deque
+from typing import Deque, Iterable, List, Optional, Tuple
+
+from .session import Rect
+
+
+def overlaps(a: Rect, b: Rect) -> bool:
+    """Whether ``(x, y, width, height)`` rectangles ``a`` and ``b`` share a
+    pixel."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def bounding_box(rects: Iterable[Rect]) -> Rect:
+    """The smallest rectangle holding every one of ``rects``."""
+    rects = list(rects)
+    left = min(r[0] for r in rects)
+    top = min(r[1] for r in rects)
+    right = max(r[0] + r[2] for r in rects)
+    bottom = max(r[1] + r[3] for r in rects)
+    return left, top, right - left, bottom - top
+
+
+def coalesce(rects: Iterable[Rect]) -> List[Rect]:
+    """``rects`` with any two that overlap replaced by the box around both,
+    until none do, and empty ones dropped."""
+    out: List[Rect] = []
+    for rect in rects:
+        if rect[2] <= 0 or rect[3] <= 0:
+            continue
+        i = 0
+        while i < len(out):
+            if overlaps(out[i], rect):
+                # The grown box may now overlap one already passed.
+                rect = bounding_box((out.pop(i), rect))
+                i = 0
+            else:
+                i += 1
+        out.append(rect)
+    return out
+
+
+class DamageLog:
+    """The areas painted, each with the token it was painted at."""
+
+    def __init__(self, limit: int = 64) -> None:
+        self.limit = limit
+        self.token = 0
+        self._log: Deque[Tuple[int, Rect]] = deque()
+        # What the log has dropped, as one box, and the last token in it.
+        self._lost: Optional[Rect] = None
+        self._lost_token = 0
+
+    def add(self, x: int, y: int, width: int, height: int) -> None:
+        if width <= 0 or height <= 0:
+            return
+        self.token += 1
+        log = self._log
+        if log:
+            _, (last_x, last_y, last_width, last_height) = log[-1]
+            if (last_x, last_width) == (x, width) and last_y + last_height == y:
+                # The next band of the same rectangle.
+                log[-1] = (self.token, (x, last_y, width, last_height + height))
+                return
+        log.append((self.token, (x, y, width, height)))
+        if len(log) > self.limit:
+            self._lost_token, rect = log.popleft()
+            self._lost = rect if self._lost is None else bounding_box((self._lost, rect))
+
+    def since(self, token: int = 0) -> Tuple[List[Rect], int]:
+        """The areas painted after ``token``, coalesced, and the token to
+        ask with next time. Past :attr:`limit` areas they are one box."""
+        rects = [rect for painted, rect in self._log if painted > token]
+        if self._lost is not None and token < self._lost_token:
+            rects.append(self._lost)
+        rects = coalesce(rects)
+        if len(rects) > self.limit:
+            rects = [bounding_box(rects)]
+        return rects, self.token
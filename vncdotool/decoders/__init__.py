@@ -3,32 +3,63 @@ from __future__ import annotations
 from typing import Dict, Type
 
 from ..const import Encoding
-from .base import ClientDecoder, DecodeError, Decoder, PixelDecoder
+from .base import ClientDecoder, ControlDecoder, DecodeError, Decoder, Job, PixelDecoder
 from .buffer import RectBuffer
+from .control import DesktopSizeDecoder, LastRectDecoder, QemuExtendedKeyDecoder
 from .copyrect import CopyRectDecoder
+from .corre import CoRREDecoder
+from .cursor import CursorDecoder
+from .hextile import HextileDecoder
 from .raw import RawDecoder
+from .rre import RREDecoder
+from .tight import TightDecoder, TightPNGDecoder
+from .trle import TRLEDecoder
+from .zlib import ZlibDecoder, ZlibHexDecoder
+from .zrle import ZRLEDecoder
 
-# Classes, not instances: ZRLE and Tight own a zlib stream that lives for
-# one connection (RFC 6143 section 7.7.6), so decoders cannot be shared
-# between them even though today's two hold no state.
+# Classes, not instances: ZLIB, ZlibHex, ZRLE and Tight own zlib streams
+# that live for one connection (RFC 6143 section 7.7.6), so decoders cannot
+# be shared between connections.
 DECODERS: Dict[Encoding, Type[Decoder]] = {
     cls.ENCODING: cls
     for cls in (
         RawDecoder,
         CopyRectDecoder,
+        RREDecoder,
+        CoRREDecoder,
+        HextileDecoder,
+        ZlibDecoder,
+        ZlibHexDecoder,
+        TRLEDecoder,
+        ZRLEDecoder,
+        TightDecoder,
+        TightPNGDecoder,
+        CursorDecoder,
+        DesktopSizeDecoder,
+        LastRectDecoder,
+        QemuExtendedKeyDecoder,
     )
 }
 
 
-def for_connection() -> Dict[Encoding, Decoder]:
-    return {encoding: cls() for encoding, cls in DECODERS.items()}
+def for_connection(offload: bool = False) -> Dict[Encoding, Decoder]:
+    """One of each decoder for a new connection; ``offload`` sets
+    :attr:`PixelDecoder.offload` on them."""
+    connection = {encoding: cls() for encoding, cls in DECODERS.items()}
+    if offload:
+        for decoder in connection.values():
+            if isinstance(decoder, PixelDecoder):
+                decoder.offload = True
+    return connection
 
 
 __all__ = [
     "ClientDecoder",
+    "ControlDecoder",
     "DECODERS",
     "DecodeError",
     "Decoder",
+    "Job",
     "PixelDecoder",
     "RectBuffer",
     "for_connection",
@@ -1,16 +1,23 @@
 """specs/decoder-architecture.md is the design."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, ClassVar, Iterator
+from typing import TYPE_CHECKING, Callable, ClassVar, Iterator
 
 from ..const import Encoding
 
-# rfb.py imports this package, so importing from it at runtime is a cycle.
+# session.py imports this package, so importing from it at runtime is a cycle.
 if TYPE_CHECKING:  # pragma: no cover
-    from ..rfb import PixelFormat
+    from ..session import PixelFormat
     from .buffer import RectBuffer
 
 
+# The slow end of a rectangle's decode, which a decoder can hand back rather
+# than run: it returns the rectangle's pixels in the decoder's output format.
+# A partial of a module-level function over bytes -- never the memoryviews
+# blocks may arrive as -- so that a process pool can pickle it.
+Job = Callable[[], bytes]
+
+
 class DecodeError(Exception):
     """Malformed, oversized or unsupported encoded data."""
 
@@ -35,7 +42,24 @@ class Decoder:
 
 
 class PixelDecoder(Decoder):
-    """Consumes bytes, fills a rect buffer."""
+    """Consumes bytes, fills a rect buffer.
+
+    Or, having read its rectangle, returns a :data:`Job` instead, for work
+    that needs nothing from the connection -- decompressing an image, say --
+    and that the pump can then run off the thread parsing it.
+    """
+
+    # Whether a rectangle's encoding is its row bands' encodings laid end to
+    # end, so the pump may decode it a band at a time, each band being a
+    # rectangle of its own. True of Raw; false of anything with state or
+    # tiles spanning rows.
+    ROW_BANDS: ClassVar[bool] = False
+
+    # Set for a connection that has a decode executor of its own: a decoder
+    # that can then reads each rectangle whole, inflating in order on the
+    # parsing thread what needs its zlib stream, and returns the rest as a
+    # Job. Otherwise only what cannot be decoded in steps (images) is.
+    offload: bool = False
 
     def output_format(self, pixel_format: "PixelFormat") -> "PixelFormat":
         """The layout the bytes this decoder wrote are in, which is not
@@ -46,3 +70,9 @@ class PixelDecoder(Decoder):
 
 class ClientDecoder(Decoder):
     """Consumes bytes, calls a client method."""
+
+
+class ControlDecoder(ClientDecoder):
+    """Changes the session rather than the screen: reads no payload, and its
+    rectangle is no area of the screen, so it is left out of the update's.
+    """
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from typing import Iterable
+
 from .base import DecodeError
 
 
@@ -18,7 +20,10 @@ class RectBuffer:
         # A decoder that fills the whole rectangle in one blit -- Raw, every
         # update -- hands over a buffer we can pass straight to the client,
         # so hold the reference instead of copying it in and back out.
-        self._whole: bytes | None = None
+        self._whole: bytes | memoryview | None = None
+        # Likewise a fill covering the whole rectangle, held as its colour
+        # until something narrower is written over it.
+        self._solid: bytes | None = None
         # The backing is reused across rectangles, so it arrives holding the
         # previous one. A write covering the whole buffer replaces all of it;
         # anything narrower has to clear it first.
@@ -40,7 +45,14 @@ class RectBuffer:
             raise DecodeError(f"blit expected {expected} bytes, got {len(pixels)}")
 
         if x == 0 and y == 0 and w == self.width and h == self.height:
-            self._whole = bytes(pixels)
+            # The receive buffer hands out read-only views of the bytes it was
+            # given, which nothing can change under us, so only something
+            # writable is copied.
+            if isinstance(pixels, bytes) or (isinstance(pixels, memoryview) and pixels.readonly):
+                self._whole = pixels
+            else:
+                self._whole = bytes(pixels)
+            self._solid = None
             self._covered = True
             return
         self._materialize()
@@ -66,10 +78,13 @@ class RectBuffer:
         self._check_rect(x, y, w, h)
         if len(color) != self.bypp:
             raise DecodeError(f"fill color must be {self.bypp} bytes, got {len(color)}")
+        if x == 0 and y == 0 and w == self.width and h == self.height:
+            self._whole = None
+            self._solid = bytes(color)
+            self._covered = True
+            return
         self._materialize()
-        if not (x == 0 and y == 0 and w == self.width and h == self.height):
-            self._clear()
-        self._covered = True
+        self._clear()
 
         stride = self.width * self.bypp
         row_bytes = w * self.bypp
@@ -86,6 +101,30 @@ class RectBuffer:
             dst = (y + r) * stride + x_off
             buf[dst:dst + row_bytes] = row
 
+    def fill_many(self, fills: Iterable[tuple[bytes, int, int, int, int]]) -> None:
+        """``fill`` each ``(color, x, y, w, h)`` in turn, later ones over
+        earlier ones: what ``fill`` checks and prepares once per call is
+        done here once for them all, which is most of a small fill's cost.
+        """
+        self._materialize()
+        self._clear()
+        bypp, width, height = self.bypp, self.width, self.height
+        stride = width * bypp
+        buf = self._backing
+        for color, x, y, w, h in fills:
+            if x < 0 or y < 0 or w < 0 or h < 0 or x + w > width or y + h > height:
+                self._check_rect(x, y, w, h)
+            if len(color) != bypp:
+                raise DecodeError(f"fill color must be {bypp} bytes, got {len(color)}")
+            row = color * w
+            row_bytes = w * bypp
+            start = y * stride + x * bypp
+            if h == 1:
+                buf[start:start + row_bytes] = row
+                continue
+            for dst in range(start, start + h * stride, stride):
+                buf[dst:dst + row_bytes] = row
+
     def _clear(self) -> None:
         if self._covered:
             return
@@ -95,12 +134,34 @@ class RectBuffer:
     def _materialize(self) -> None:
         """Write a held whole-rectangle blit into the backing, so a later
         partial write has something to write into."""
-        if self._whole is None:
-            return
-        self._backing[:self._nbytes] = self._whole
-        self._whole = None
-
-    def tobytes(self) -> bytes:
+        if self._solid is not None:
+            # Doubling what is already written, which passes over the memory
+            # once where building ``color * pixels`` first passes twice.
+            with memoryview(self._backing) as view:
+                done = min(len(self._solid), self._nbytes)
+                view[:done] = self._solid[:done]
+                while done < self._nbytes:
+                    step = min(done, self._nbytes - done)
+                    view[done:done + step] = view[:step]
+                    done += step
+            self._solid = None
+        elif self._whole is not None:
+            self._backing[:self._nbytes] = self._whole
+            self._whole = None
+
+    @property
+    def solid(self) -> bytes | None:
+        """The colour of a fill covering the whole rectangle, when nothing
+        has been written over it since."""
+        return self._solid
+
+    def tobytes(self) -> bytes | memoryview:
+        """The rectangle's pixels, as a read-only view when a whole-rectangle
+        blit handed one over."""
+        if self._solid is not None:
+            return self._solid * (self.width * self.height)
         if self._whole is not None:
             return self._whole
-        return bytes(self._backing[:self._nbytes])
+        # Through a view, so the one copy is into the bytes returned.
+        with memoryview(self._backing) as view:
+            return bytes(view[:self._nbytes])
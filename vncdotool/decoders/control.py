@@ -0,0 +1,48 @@
+"""The pseudo-encodings that carry no payload. RFC 6143 section 7.8.2 and
+rfbproto's LastRect and QEMU Extended Key Event."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, ClassVar, Iterator
+
+from ..const import Encoding
+from .base import ControlDecoder
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat, Rect
+
+
+class DesktopSizeDecoder(ControlDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.PSEUDO_DESKTOP_SIZE
+
+    def decodeForClient(
+        self, client: object, rect: "Rect", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        _, _, width, height = rect
+        client.updateDesktopSize(width, height)
+        yield from ()
+
+
+class LastRectDecoder(ControlDecoder):
+    """Ends the update, whatever rectangle count its header gave."""
+
+    ENCODING: ClassVar[Encoding] = Encoding.PSEUDO_LAST_RECT
+
+    def decodeForClient(
+        self, client: object, rect: "Rect", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        client.rectangles = 0
+        yield from ()
+
+
+class QemuExtendedKeyDecoder(ControlDecoder):
+    """The server's answer to being offered the encoding: it takes
+    QEMU extended key events from now on."""
+
+    ENCODING: ClassVar[Encoding] = Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT
+
+    def decodeForClient(
+        self, client: object, rect: "Rect", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        client.negotiated_encodings.add(Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT)
+        yield from ()
@@ -7,9 +7,9 @@ from typing import TYPE_CHECKING, ClassVar, Iterator
 from ..const import Encoding
 from .base import ClientDecoder
 
-# rfb.py imports this package, so importing from it at runtime is a cycle.
+# session.py imports this package, so importing from it at runtime is a cycle.
 if TYPE_CHECKING:  # pragma: no cover
-    from ..rfb import PixelFormat, Rect
+    from ..session import PixelFormat, Rect
 
 
 class CopyRectDecoder(ClientDecoder):
@@ -0,0 +1,12 @@
+"""CoRRE: RRE with 8-bit subrectangle geometry. rfbproto section 7.7.6."""
+from __future__ import annotations
+
+from typing import ClassVar
+
+from ..const import Encoding
+from .rre import RREDecoder
+
+
+class CoRREDecoder(RREDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.CORRE
+    GEOMETRY: ClassVar[str] = "BBBB"
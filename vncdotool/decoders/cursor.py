@@ -0,0 +1,24 @@
+"""Cursor pseudo-encoding. RFC 6143 section 7.8.1."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, ClassVar, Iterator
+
+from ..const import Encoding
+from .base import ClientDecoder
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat, Rect
+
+
+class CursorDecoder(ClientDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.PSEUDO_CURSOR
+
+    def decodeForClient(
+        self, client: object, rect: "Rect", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        x, y, width, height = rect
+        # The pixels, then a bitmask of rows padded to whole bytes.
+        split = width * height * pixel_format.bypp
+        block = yield split + ((width + 7) // 8) * height
+        client.updateCursor(x, y, width, height, block[:split], block[split:])
@@ -0,0 +1,118 @@
+"""Hextile. RFC 6143 section 7.7.4."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, ClassVar, Generator, Iterator
+
+from ..const import Encoding, HextileEncoding
+from .base import DecodeError, PixelDecoder
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat
+    from .buffer import RectBuffer
+
+# Plain ints: masking with the IntFlag members runs enum code for every tile.
+_RAW = int(HextileEncoding.RAW)
+_BACKGROUND = int(HextileEncoding.BACKGROUND_SPECIFIED)
+_FOREGROUND = int(HextileEncoding.FOREGROUND_SPECIFIED)
+_ANY_SUBRECTS = int(HextileEncoding.ANY_SUBRECTS)
+_COLOURED = int(HextileEncoding.SUBRECTS_COLORED)
+
+
+def _max_tile_bytes(bypp: int) -> int:
+    """The most a tile's encoding after its subencoding byte adds up to:
+    both colours, the count, and 255 coloured subrects."""
+    return 2 * bypp + 1 + 255 * (bypp + 2)
+
+
+def _tiles(width: int, height: int) -> Iterator[tuple[int, int, int, int]]:
+    """Tiles run left to right, then top to bottom, 16x16 but for the right
+    and bottom edges."""
+    for ty in range(0, height, 16):
+        th = min(16, height - ty)
+        for tx in range(0, width, 16):
+            yield tx, ty, min(16, width - tx), th
+
+
+def _tile(
+    subencoding: int, tw: int, th: int, bypp: int, bg: bytes | None, fg: bytes | None
+) -> Generator[int, bytes, tuple[bytes, bytes | None, bytearray | None]]:
+    """The rest of a tile that is not raw, read after its subencoding: the
+    background and foreground it leaves for the next tile, and its pixels,
+    or None when it is its background alone."""
+    # Everything before the subrects, in one read.
+    numbytes = 0
+    if subencoding & _BACKGROUND:
+        numbytes += bypp
+    if subencoding & _FOREGROUND:
+        numbytes += bypp
+    if subencoding & _ANY_SUBRECTS:
+        numbytes += 1
+    subrects = 0
+    if numbytes:
+        block = yield numbytes
+        pos = 0
+        if subencoding & _BACKGROUND:
+            bg = bytes(block[:bypp])
+            pos += bypp
+        if subencoding & _FOREGROUND:
+            fg = bytes(block[pos:pos + bypp])
+            pos += bypp
+        if subencoding & _ANY_SUBRECTS:
+            subrects = block[pos]
+    if bg is None:
+        raise DecodeError("Hextile tile with no background specified")
+    if not subrects:
+        return bg, fg, None
+
+    # Paint the subrects into the tile, for the caller to write into the
+    # rectangle once.
+    pixels = bytearray(bg * (tw * th))
+    stride = tw * bypp
+    if subencoding & _COLOURED:
+        size = bypp + 2
+        block = yield size * subrects
+        colors = [bytes(block[pos:pos + bypp]) for pos in range(0, len(block), size)]
+        geometry = block[bypp::size], block[bypp + 1::size]
+    else:
+        if fg is None:
+            raise DecodeError("Hextile subrects with no foreground specified")
+        block = yield 2 * subrects
+        colors = [fg] * subrects
+        geometry = block[0::2], block[1::2]
+    for color, xy, wh in zip(colors, *geometry):
+        sx, sy = xy >> 4, xy & 0xF
+        sw, sh = (wh >> 4) + 1, (wh & 0xF) + 1
+        if sx + sw > tw or sy + sh > th:
+            raise DecodeError(
+                f"Hextile subrect ({sx}, {sy}, {sw}, {sh}) outside its {tw}x{th} tile"
+            )
+        row = color * sw
+        start = sy * stride + sx * bypp
+        for offset in range(start, start + sh * stride, stride):
+            pixels[offset:offset + sw * bypp] = row
+    return bg, fg, pixels
+
+
+class HextileDecoder(PixelDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.HEXTILE
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        bypp = target.bypp
+        # Both carry over from one tile to the next until a tile respecifies
+        # them.
+        bg: bytes | None = None
+        fg: bytes | None = None
+        for tx, ty, tw, th in _tiles(target.width, target.height):
+            (subencoding,) = yield 1
+            if subencoding & _RAW:
+                data = yield tw * th * bypp
+                target.blit(tx, ty, tw, th, data)
+                continue
+            bg, fg, pixels = yield from _tile(subencoding, tw, th, bypp, bg, fg)
+            if pixels is None:
+                target.fill(tx, ty, tw, th, bg)
+            else:
+                target.blit(tx, ty, tw, th, pixels)
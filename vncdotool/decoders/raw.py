@@ -6,14 +6,15 @@ from typing import TYPE_CHECKING, ClassVar, Iterator
 from ..const import Encoding
 from .base import PixelDecoder
 
-# rfb.py imports this package, so importing from it at runtime is a cycle.
+# session.py imports this package, so importing from it at runtime is a cycle.
 if TYPE_CHECKING:  # pragma: no cover
-    from ..rfb import PixelFormat
+    from ..session import PixelFormat
     from .buffer import RectBuffer
 
 
 class RawDecoder(PixelDecoder):
     ENCODING: ClassVar[Encoding] = Encoding.RAW
+    ROW_BANDS: ClassVar[bool] = True
 
     def decodePixels(
         self, target: "RectBuffer", pixel_format: "PixelFormat"
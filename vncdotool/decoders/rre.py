@@ -0,0 +1,49 @@
+"""RRE. RFC 6143 section 7.7.3."""
+from __future__ import annotations
+
+from functools import partial
+from struct import calcsize, iter_unpack, unpack
+from typing import TYPE_CHECKING, ClassVar, Generator
+
+from ..const import Encoding
+from .base import Job, PixelDecoder
+from .buffer import RectBuffer
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat
+
+
+def _paint(width: int, height: int, bypp: int, background: bytes, subrect: str, block: bytes) -> bytes:
+    """The subrectangles in ``block`` over ``background``, in a rect buffer
+    of their own."""
+    target = RectBuffer(width, height, bypp)
+    target.fill(0, 0, width, height, background)
+    target.fill_many(iter_unpack(subrect, block))
+    return target.tobytes()
+
+
+class RREDecoder(PixelDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.RRE
+    # x, y, width and height of each subrectangle, after its colour.
+    GEOMETRY: ClassVar[str] = "HHHH"
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Generator[int, bytes, "Job | None"]:
+        bypp = target.bypp
+        block = yield 4 + bypp
+        (subrects,) = unpack("!I", block[:4])
+        background = bytes(block[4:])
+        if not subrects:
+            target.fill(0, 0, target.width, target.height, background)
+            return None
+        # Every subrectangle in one read, painted over the background in the
+        # order sent: later ones may overlap earlier ones.
+        subrect = f"!{bypp}s{self.GEOMETRY}"
+        block = yield calcsize(subrect) * subrects
+        if self.offload:
+            return partial(_paint, target.width, target.height, bypp, background, subrect, bytes(block))
+        target.fill(0, 0, target.width, target.height, background)
+        target.fill_many(iter_unpack(subrect, block))
+        return None
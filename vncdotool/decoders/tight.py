@@ -0,0 +1,269 @@
+"""Tight and TightPNG encodings. rfbproto, sections Tight Encoding and
+TightPNG Encoding."""
+from __future__ import annotations
+
+import io
+import zlib
+from functools import partial
+from typing import TYPE_CHECKING, ClassVar, Generator
+
+from .. import pixelformat
+from ..const import Encoding
+from .base import DecodeError, Job, PixelDecoder
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat
+    from .buffer import RectBuffer
+
+# compression-control, the high four bits of the rectangle's first byte.
+_FILL = 0x8
+_JPEG = 0x9
+_PNG = 0xA
+_EXPLICIT_FILTER = 0x4
+
+# filter-id
+_COPY = 0
+_PALETTE = 1
+_GRADIENT = 2
+
+# Data shorter than this is sent as it is, not deflated.
+MIN_TO_COMPRESS = 12
+
+# Each byte of a two-colour palette's rows as the eight indices it packs,
+# most significant bit first.
+_BITS = [bytes((byte >> (7 - i)) & 1 for i in range(8)) for byte in range(256)]
+
+
+def _compact_length() -> Generator[int, bytes, int]:
+    """A length in one to three bytes, seven bits to each but the last."""
+    length = 0
+    for shift in (0, 7):
+        (byte,) = yield 1
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return length
+    (byte,) = yield 1
+    return length | byte << 14
+
+
+def _gradient(data: bytes, width: int, height: int) -> bytearray:
+    """Undo the gradient filter on three-byte pixels: each channel was sent
+    as its difference from left + above - above-left, clamped.
+
+    Each value depends on the one to its left, so this is a loop per byte;
+    it goes a channel at a time, which saves indexing on every one.
+    """
+    stride = width * 3
+    out = bytearray(len(data))
+    above = bytes(stride)
+    for start in range(0, stride * height, stride):
+        row = data[start:start + stride]
+        for c in range(3):
+            left = above_left = 0
+            values = bytearray()
+            for up, delta in zip(above[c::3], row[c::3]):
+                predicted = left + up - above_left
+                if predicted < 0:
+                    predicted = 0
+                elif predicted > 255:
+                    predicted = 255
+                left = (predicted + delta) & 0xFF
+                values.append(left)
+                above_left = up
+            out[start + c:start + stride:3] = values
+        above = out[start:start + stride]
+    return out
+
+
+def _palette_pixels(
+    data: bytes, palette: bytes, count: int, tpixel: int, width: int, height: int
+) -> bytes:
+    """The palette filter undone: ``data`` is rows of one bit per pixel for
+    two colours, one index byte per pixel otherwise."""
+    indices = _unpack_bits(data, width, height) if count == 2 else data
+    return _lookup(indices, palette, count, tpixel)
+
+
+def _unpack_bits(rows: bytes, width: int, height: int) -> bytes:
+    """One index byte per pixel from rows of one bit each, every row
+    starting on a byte."""
+    stride = (width + 7) // 8
+    return b"".join(
+        b"".join(_BITS[byte] for byte in rows[start:start + stride])[:width]
+        for start in range(0, stride * height, stride)
+    )
+
+
+def _lookup(indices: bytes, palette: bytes, count: int, tpixel: int) -> bytes:
+    """Each index replaced by its palette colour, one channel byte at a time
+    through a translation table."""
+    if indices and max(indices) >= count:
+        raise DecodeError(f"Tight palette index past its {count} colours")
+    out = bytearray(len(indices) * tpixel)
+    for c in range(tpixel):
+        table = palette[c::tpixel].ljust(256, b"\x00")
+        out[c::tpixel] = indices.translate(table)
+    return bytes(out)
+
+
+def _image(kind: str, data: bytes, width: int, height: int) -> bytes:
+    """A ``kind`` image, JPEG or PNG, the size of its rectangle, as red,
+    green and blue bytes. Needs nothing from the connection, so it can run
+    on any thread."""
+    # Pillow is only needed when a server sends images.
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise DecodeError(f"Tight {kind} needs Pillow") from exc
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format != kind:
+                raise DecodeError(f"Tight {kind} rectangle holds {image.format}")
+            if image.size != (width, height):
+                raise DecodeError(
+                    f"Tight {kind} is {image.width}x{image.height}, not {width}x{height}"
+                )
+            return image.convert("RGB").tobytes()
+    except OSError as exc:
+        raise DecodeError(f"cannot decode Tight {kind}: {exc}") from exc
+
+
+class _TPixelDecoder(PixelDecoder):
+    """What Tight and TightPNG share: TPIXELs, which the images decode to as
+    well."""
+
+    def __init__(self) -> None:
+        self._output_for: PixelFormat | None = None
+        self._output: PixelFormat | None = None
+
+    def output_format(self, pixel_format: "PixelFormat") -> "PixelFormat":
+        """Red, green and blue bytes when pixels come as three-byte TPIXELs,
+        which is also what a JPEG decodes to; the negotiated format
+        otherwise."""
+        if pixel_format is not self._output_for:
+            self._output_for = pixel_format
+            self._output = (
+                pixelformat.RGB888
+                if pixelformat.tpixel_bytes(pixel_format) == 3
+                else pixel_format
+            )
+        assert self._output is not None
+        return self._output
+
+    @staticmethod
+    def _read_image(
+        kind: str, pixel_format: "PixelFormat", width: int, height: int
+    ) -> Generator[int, bytes, Job]:
+        """A JPEG or PNG off the wire, and the decode of it for the pump to
+        run."""
+        if pixelformat.tpixel_bytes(pixel_format) != 3:
+            raise DecodeError(f"Tight {kind} in a {pixel_format.bpp}bpp pixel format")
+        length = yield from _compact_length()
+        data = yield length
+        return partial(_image, kind, bytes(data), width, height)
+
+
+class TightDecoder(_TPixelDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.TIGHT
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Four streams for the whole connection, each carrying on from its
+        # last rectangle until the server resets it.
+        self._streams = [zlib.decompressobj() for _ in range(4)]
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Generator[int, bytes, "Job | None"]:
+        width, height = target.width, target.height
+        tpixel = pixelformat.tpixel_bytes(pixel_format)
+        (control,) = yield 1
+        for i in range(4):
+            if control & (1 << i):
+                self._streams[i] = zlib.decompressobj()
+        compression = control >> 4
+
+        if compression == _FILL:
+            color = yield tpixel
+            target.fill(0, 0, width, height, color)
+            return None
+        if compression == _JPEG:
+            return (yield from self._read_image("JPEG", pixel_format, width, height))
+        if compression > _JPEG:
+            raise DecodeError(f"Tight compression-control {compression:#x} is not supported")
+
+        stream = self._streams[compression & 3]
+        filter_id = _COPY
+        if compression & _EXPLICIT_FILTER:
+            (filter_id,) = yield 1
+
+        if filter_id == _COPY:
+            pixels = yield from self._data(stream, width * height * tpixel)
+            target.blit(0, 0, width, height, pixels)
+            return None
+        if filter_id == _PALETTE:
+            (count,) = yield 1
+            count += 1
+            palette = yield count * tpixel
+            size = (width + 7) // 8 * height if count == 2 else width * height
+            data = yield from self._data(stream, size)
+            job = partial(_palette_pixels, bytes(data), bytes(palette), count, tpixel, width, height)
+        elif filter_id == _GRADIENT:
+            if tpixel != 3:
+                raise DecodeError(f"Tight gradient filter in a {pixel_format.bpp}bpp pixel format")
+            data = yield from self._data(stream, width * height * 3)
+            job = partial(_gradient, bytes(data), width, height)
+        else:
+            raise DecodeError(f"Tight filter-id {filter_id} is not supported")
+        # The stream is done with: what is left needs nothing from the
+        # connection.
+        if self.offload:
+            return job
+        target.blit(0, 0, width, height, job())
+        return None
+
+    @staticmethod
+    def _data(stream: "zlib._Decompress", size: int) -> Generator[int, bytes, bytes]:
+        """``size`` bytes of filtered data: sent as they are when fewer than
+        ``MIN_TO_COMPRESS``, otherwise deflated on ``stream``."""
+        if size < MIN_TO_COMPRESS:
+            return (yield size)
+        length = yield from _compact_length()
+        compressed = yield length
+        # Bounded by what the rectangle needs, whatever the data inflates to.
+        data = stream.decompress(compressed, size)
+        if len(data) != size:
+            raise DecodeError(f"Tight data inflates to {len(data)} bytes, not {size}")
+        # What is left is the flush ending the rectangle, which inflates to
+        # nothing, and goes through the stream all the same.
+        while stream.unconsumed_tail:
+            if stream.decompress(stream.unconsumed_tail, 1):
+                raise DecodeError(f"Tight data inflates past {size} bytes")
+        return data
+
+
+class TightPNGDecoder(_TPixelDecoder):
+    """Tight with its zlib streams left out, as noVNC and the servers built
+    for it send it: fills, JPEG and PNG, each rectangle on its own."""
+
+    ENCODING: ClassVar[Encoding] = Encoding.TIGHT_PNG
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Generator[int, bytes, "Job | None"]:
+        # The low bits reset zlib streams this encoding has none of.
+        (control,) = yield 1
+        compression = control >> 4
+        if compression == _FILL:
+            color = yield pixelformat.tpixel_bytes(pixel_format)
+            target.fill(0, 0, target.width, target.height, color)
+            return None
+        if compression == _JPEG:
+            kind = "JPEG"
+        elif compression == _PNG:
+            kind = "PNG"
+        else:
+            raise DecodeError(f"TightPNG compression-control {compression:#x} is not supported")
+        return (yield from self._read_image(kind, pixel_format, target.width, target.height))
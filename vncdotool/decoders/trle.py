@@ -0,0 +1,99 @@
+"""TRLE. RFC 6143 section 7.7.5."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, ClassVar, Generator, Iterator
+
+from ..const import Encoding
+from .base import DecodeError, PixelDecoder
+from .zrle import _decode_tile, _Layout, _palette_bits, _tiles
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat
+    from .buffer import RectBuffer
+
+
+def _tile_bytes(
+    tw: int, th: int, cpixel: int, previous: list[bytes] | None
+) -> Generator[int, bytes, bytearray]:
+    """The bytes of the tile next on the wire, read to its end and no
+    further: with no length ahead of them, the encoding is walked to find
+    where that is, a run at a time through run-length tiles."""
+    data = bytearray((yield 1))
+    subencoding = data[0]
+    palette_size = subencoding & 127
+    count = tw * th
+    if subencoding in (127, 129) and not previous:
+        raise DecodeError(f"TRLE subencoding {subencoding} reuses a palette before any was sent")
+
+    if subencoding & 0x80:
+        if palette_size == 1:
+            assert previous
+            palette_size = len(previous)
+        elif palette_size:
+            data += yield cpixel * palette_size
+        total = 0
+        while total < count:
+            if not palette_size:
+                block = yield cpixel + 1
+                data += block
+                length = block[-1]
+            else:
+                (index,) = block = yield 1
+                data += block
+                if not index & 0x80:
+                    total += 1
+                    continue
+                (length,) = block = yield 1
+                data += block
+            total += 1 + length
+            while length == 255:
+                (length,) = block = yield 1
+                data += block
+                total += length
+        return data
+
+    if palette_size == 0:
+        data += yield cpixel * count
+    elif palette_size == 1:
+        data += yield cpixel
+    elif palette_size == 127:
+        assert previous
+        data += yield (tw * _palette_bits(len(previous)) + 7) // 8 * th
+    elif palette_size <= 16:
+        data += yield cpixel * palette_size
+        data += yield (tw * _palette_bits(palette_size) + 7) // 8 * th
+    else:
+        raise DecodeError(f"TRLE subencoding {subencoding} is not allowed")
+    return data
+
+
+class TRLEDecoder(PixelDecoder):
+    """ZRLE's tiles, 16x16 and straight off the wire rather than through
+    zlib, and able to reuse the last tile's palette."""
+
+    ENCODING: ClassVar[Encoding] = Encoding.TRLE
+    TILE: ClassVar[int] = 16
+
+    def __init__(self) -> None:
+        self._layout_for: PixelFormat | None = None
+        self._layout: _Layout | None = None
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        if pixel_format is not self._layout_for:
+            self._layout_for = pixel_format
+            self._layout = _Layout(pixel_format)
+        layout = self._layout
+        assert layout is not None
+
+        # Palettes carry over from tile to tile, not between rectangles.
+        palette: list[bytes] | None = None
+        for tx, ty, tw, th in _tiles(target.width, target.height, self.TILE):
+            data = yield from _tile_bytes(tw, th, layout.cpixel, palette)
+            _, color, pixels, palette = _decode_tile(data, 0, tw, th, layout, palette, reuse=True)
+            if color is not None:
+                target.fill(tx, ty, tw, th, color)
+            else:
+                target.blit(tx, ty, tw, th, pixels)
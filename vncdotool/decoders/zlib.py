@@ -0,0 +1,131 @@
+"""ZLIB and ZlibHex, rfbproto sections ZLIB Encoding and ZlibHex Encoding:
+Raw and Hextile through deflate streams that live for the connection."""
+from __future__ import annotations
+
+import zlib
+from struct import unpack
+from typing import TYPE_CHECKING, ClassVar, Generator, Iterator, TypeVar
+
+from ..const import Encoding, HextileEncoding
+from .base import DecodeError, PixelDecoder
+from .hextile import _RAW, _max_tile_bytes, _tile, _tiles
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat
+    from .buffer import RectBuffer
+
+T = TypeVar("T")
+
+# Compressed bytes read off the wire at a time.
+INFLATE_CHUNK = 1 << 16
+
+_ZLIB_RAW = int(HextileEncoding.ZLIB_RAW)
+_ZLIB_HEX = int(HextileEncoding.ZLIB_HEX)
+
+
+def _inflate(stream: "zlib._Decompress", data: bytes, out: bytearray, size: int) -> None:
+    """Inflate ``data`` onto the end of ``out``, which never grows past
+    ``size`` bytes, whatever ``data`` inflates to."""
+    while data:
+        # One byte more than there is room for, to tell too much from
+        # exactly enough.
+        out += stream.decompress(data, size - len(out) + 1)
+        if len(out) > size:
+            raise DecodeError(f"zlib data inflates past {size} bytes")
+        data = stream.unconsumed_tail
+
+
+def _replay(reader: Generator[int, bytes, T], data: bytes) -> T:
+    """Run ``reader`` over ``data`` instead of the wire, each read it asks
+    for being the next slice of it."""
+    pos = 0
+    try:
+        size = next(reader)
+        while True:
+            block = data[pos:pos + size]
+            if len(block) < size:
+                raise DecodeError("ZlibHex tile ends early")
+            pos += size
+            size = reader.send(block)
+    except StopIteration as stop:
+        if pos != len(data):
+            raise DecodeError(f"ZlibHex tile has {len(data) - pos} bytes past its end") from None
+        return stop.value
+
+
+class ZlibDecoder(PixelDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.ZLIB
+
+    def __init__(self) -> None:
+        # One stream for the whole connection: each rectangle's data carries
+        # on from the last one's.
+        self._zlib = zlib.decompressobj()
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        """Raw pixels, inflated as the compressed bytes arrive and bounded by
+        what the rectangle holds."""
+        size = target.width * target.height * target.bypp
+        block = yield 4
+        (remaining,) = unpack("!L", block)
+        pixels = bytearray()
+        while remaining:
+            block = yield min(remaining, INFLATE_CHUNK)
+            remaining -= len(block)
+            _inflate(self._zlib, block, pixels, size)
+        if len(pixels) != size:
+            raise DecodeError(f"ZLIB data inflates to {len(pixels)} bytes, not {size}")
+        target.blit(0, 0, target.width, target.height, pixels)
+
+
+class ZlibHexDecoder(PixelDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.ZLIBHEX
+
+    def __init__(self) -> None:
+        # Two streams for the whole connection: one for raw tiles, one for
+        # the rest of the others' encoding.
+        self._raw = zlib.decompressobj()
+        self._hex = zlib.decompressobj()
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Iterator[int]:
+        """Hextile, but that a tile's raw pixels, or everything after its
+        subencoding, may come deflated."""
+        bypp = target.bypp
+        bg: bytes | None = None
+        fg: bytes | None = None
+        for tx, ty, tw, th in _tiles(target.width, target.height):
+            (subencoding,) = yield 1
+            if subencoding & _ZLIB_RAW:
+                size = tw * th * bypp
+                data = yield from self._compressed(self._raw, size)
+                if len(data) != size:
+                    raise DecodeError(f"ZlibHex raw tile inflates to {len(data)} bytes, not {size}")
+                target.blit(tx, ty, tw, th, data)
+                continue
+            if subencoding & _RAW:
+                data = yield tw * th * bypp
+                target.blit(tx, ty, tw, th, data)
+                continue
+            if subencoding & _ZLIB_HEX:
+                data = yield from self._compressed(self._hex, _max_tile_bytes(bypp))
+                bg, fg, pixels = _replay(_tile(subencoding, tw, th, bypp, bg, fg), data)
+            else:
+                bg, fg, pixels = yield from _tile(subencoding, tw, th, bypp, bg, fg)
+            if pixels is None:
+                target.fill(tx, ty, tw, th, bg)
+            else:
+                target.blit(tx, ty, tw, th, pixels)
+
+    @staticmethod
+    def _compressed(stream: "zlib._Decompress", size: int) -> Generator[int, bytes, bytearray]:
+        """A two-byte length, then that many bytes inflating to at most
+        ``size``."""
+        (length,) = unpack("!H", (yield 2))
+        data = bytearray()
+        if length:
+            _inflate(stream, (yield length), data, size)
+        return data
@@ -0,0 +1,314 @@
+"""ZRLE. RFC 6143 section 7.7.6."""
+from __future__ import annotations
+
+import zlib
+from functools import partial
+from struct import unpack
+from typing import TYPE_CHECKING, ClassVar, Generator, Iterator
+
+from .. import pixelformat
+from ..const import Encoding
+from .base import DecodeError, Job, PixelDecoder
+from .buffer import RectBuffer
+
+# session.py imports this package, so importing from it at runtime is a cycle.
+if TYPE_CHECKING:  # pragma: no cover
+    from ..session import PixelFormat
+
+TILE = 64
+
+# Compressed bytes read off the wire, and bytes inflated from them, at a
+# time. Larger than any one tile's encoding (a raw 64x64 tile is 12 KiB),
+# so a tile never waits on more than one round.
+INFLATE_CHUNK = 1 << 16
+
+# Each byte of a packed palette row as the indices it holds, most
+# significant bits first, for 1, 2 and 4 bits per index.
+_UNPACK = {
+    bits: [
+        bytes((byte >> shift) & ((1 << bits) - 1) for shift in range(8 - bits, -1, -bits))
+        for byte in range(256)
+    ]
+    for bits in (1, 2, 4)
+}
+
+
+def _tiles(width: int, height: int, size: int = TILE) -> Iterator[tuple[int, int, int, int]]:
+    """The rectangle's ``size`` by ``size`` tiles, left to right then top to
+    bottom."""
+    for ty in range(0, height, size):
+        th = min(size, height - ty)
+        for tx in range(0, width, size):
+            yield tx, ty, min(size, width - tx), th
+
+
+class _Layout:
+    """Where a CPIXEL's bytes go in the PIXEL the rect buffer holds: all of
+    it, or three bytes at ``cpixel_offset`` with the rest left zero."""
+
+    def __init__(self, pixel_format: "PixelFormat") -> None:
+        self.bypp = pixel_format.bypp
+        self.cpixel = pixelformat.cpixel_bytes(pixel_format)
+        self.offset = pixelformat.cpixel_offset(pixel_format)
+
+    def pixel(self, cpixel: bytes) -> bytes:
+        if self.cpixel == self.bypp:
+            return bytes(cpixel)
+        return bytes(self.offset) + cpixel + bytes(self.bypp - self.cpixel - self.offset)
+
+    def pixels(self, data: bytearray, start: int, count: int) -> bytes:
+        """``count`` CPIXELs from ``data[start:]`` as PIXELs.
+
+        :raises IndexError: they run past the end of ``data``.
+        """
+        cpixel = self.cpixel
+        end = start + cpixel * count
+        if end > len(data):
+            raise IndexError(end)
+        if cpixel == self.bypp:
+            return bytes(data[start:end])
+        bypp, offset = self.bypp, self.offset
+        out = bytearray(bypp * count)
+        for c in range(cpixel):
+            out[offset + c::bypp] = data[start + c:end:cpixel]
+        return bytes(out)
+
+    def palette(self, data: bytearray, start: int, count: int) -> list[bytes]:
+        pixels = self.pixels(data, start, count)
+        bypp = self.bypp
+        return [pixels[i:i + bypp] for i in range(0, len(pixels), bypp)]
+
+    def lookup(self, indices: bytes, palette: list[bytes]) -> bytes:
+        """Each index replaced by its palette entry, one byte of the pixel at
+        a time through a translation table."""
+        bypp = self.bypp
+        out = bytearray(len(indices) * bypp)
+        for c in range(bypp):
+            table = bytes(entry[c] for entry in palette).ljust(256, b"\x00")
+            out[c::bypp] = indices.translate(table)
+        return bytes(out)
+
+
+def _decode_tile(
+    data: bytearray, pos: int, tw: int, th: int, layout: _Layout,
+    previous: list[bytes] | None = None, reuse: bool = False,
+) -> tuple[int, bytes | None, bytes, list[bytes] | None]:
+    """Decode the tile at ``data[pos:]``: where it ends, either the pixel
+    filling it or its pixels, and the palette it leaves the next tile.
+
+    ``previous`` is the palette the tile before left. Only TRLE (``reuse``)
+    may use it again, with subencodings 127 and 129; to ZRLE they are
+    errors.
+
+    :raises IndexError: the tile runs past the end of ``data``.
+    """
+    count = tw * th
+    cpixel = layout.cpixel
+    subencoding = data[pos]
+    pos += 1
+    palette_size = subencoding & 127
+
+    if subencoding & 0x80:
+        if palette_size == 1:
+            palette = _reused(previous, reuse, subencoding)
+            palette_size = len(palette)
+        elif palette_size:
+            palette = layout.palette(data, pos, palette_size)
+            pos += cpixel * palette_size
+        else:
+            palette = None
+        runs = bytearray()
+        total = 0
+        while total < count:
+            if palette is None:
+                # Runs of CPIXELs, laid out as PIXELs all at once below. A
+                # short slice leaves pos past the end, for the length's
+                # read to raise IndexError.
+                color = data[pos:pos + cpixel]
+                pos += cpixel
+            else:
+                index = data[pos]
+                pos += 1
+                if index & 0x7F >= palette_size:
+                    raise DecodeError(f"palette index {index & 0x7F} past its {palette_size} colours")
+                color = palette[index & 0x7F]
+                if not index & 0x80:
+                    # a run of one
+                    runs += color
+                    total += 1
+                    continue
+            run = 1
+            while True:
+                length = data[pos]
+                pos += 1
+                run += length
+                if length != 255:
+                    break
+            total += run
+            if total > count:
+                raise DecodeError("run past the end of its tile")
+            runs += color * run
+        if palette is None:
+            return pos, None, layout.pixels(runs, 0, count), previous
+        return pos, None, bytes(runs), palette
+
+    if palette_size == 0:
+        return pos + cpixel * count, None, layout.pixels(data, pos, count), previous
+    if palette_size == 1:
+        end = pos + cpixel
+        if end > len(data):
+            raise IndexError(end)
+        return end, layout.pixel(data[pos:end]), b"", previous
+    if palette_size == 127:
+        palette = _reused(previous, reuse, subencoding)
+        palette_size = len(palette)
+        if palette_size > 16:
+            raise DecodeError(f"packed palette of size {palette_size} is not allowed")
+    elif palette_size > 16:
+        raise DecodeError(f"packed palette of size {palette_size} is not allowed")
+    else:
+        palette = layout.palette(data, pos, palette_size)
+        pos += cpixel * palette_size
+    bits = _palette_bits(palette_size)
+    # Each row starts on a byte boundary.
+    stride = (tw * bits + 7) // 8
+    end = pos + stride * th
+    if end > len(data):
+        raise IndexError(end)
+    unpack_byte = _UNPACK[bits]
+    indices = b"".join(
+        b"".join([unpack_byte[byte] for byte in data[row:row + stride]])[:tw]
+        for row in range(pos, end, stride)
+    )
+    if max(indices) >= palette_size:
+        raise DecodeError(f"palette index past its {palette_size} colours")
+    return end, None, layout.lookup(indices, palette), palette
+
+
+def _palette_bits(palette_size: int) -> int:
+    """Bits per index of a packed palette of ``palette_size`` colours."""
+    return 1 if palette_size == 2 else 2 if palette_size <= 4 else 4
+
+
+def _reused(previous: list[bytes] | None, reuse: bool, subencoding: int) -> list[bytes]:
+    if not reuse:
+        raise DecodeError(f"ZRLE subencoding {subencoding} is not allowed")
+    if previous is None:
+        raise DecodeError(f"subencoding {subencoding} reuses a palette before any was sent")
+    return previous
+
+
+def _max_inflated(width: int, height: int, cpixel: int, size: int = TILE) -> int:
+    """The most a rectangle's tiles add up to inflated: each tile's
+    subencoding and a full palette, and every pixel a run of one, whose
+    colour and length bytes are the most a pixel takes in any subencoding."""
+    tiles = -(-width // size) * -(-height // size)
+    return tiles * (1 + 127 * cpixel) + width * height * max(cpixel + 1, 2)
+
+
+def _decode_rect(data: bytes, width: int, height: int, layout: _Layout, size: int = TILE) -> bytes:
+    """A rectangle's tiles, inflated whole, as its pixels. What follows the
+    last tile is left unread."""
+    target = RectBuffer(width, height, layout.bypp)
+    pos = 0
+    for tx, ty, tw, th in _tiles(width, height, size):
+        try:
+            pos, color, pixels, _ = _decode_tile(data, pos, tw, th, layout)
+        except IndexError:
+            raise DecodeError("ZRLE data ends inside a tile") from None
+        if color is not None:
+            target.fill(tx, ty, tw, th, color)
+        else:
+            target.blit(tx, ty, tw, th, pixels)
+    return bytes(target.tobytes())
+
+
+class ZRLEDecoder(PixelDecoder):
+    ENCODING: ClassVar[Encoding] = Encoding.ZRLE
+    TILE: ClassVar[int] = TILE
+
+    def __init__(self) -> None:
+        # One stream for the whole connection: each rectangle's data carries
+        # on from the last one's.
+        self._zlib = zlib.decompressobj(0)
+        self._layout_for: PixelFormat | None = None
+        self._layout: _Layout | None = None
+
+    def decodePixels(
+        self, target: "RectBuffer", pixel_format: "PixelFormat"
+    ) -> Generator[int, bytes, "Job | None"]:
+        """Inflate as the compressed bytes arrive, at most ``INFLATE_CHUNK``
+        at a time, and write each tile into ``target`` once it is whole:
+        what is held besides ``target`` is one chunk and the tile it ends
+        inside, whatever the data inflates to.
+
+        With :attr:`offload`, inflate the whole rectangle instead, and hand
+        back its tiles to decode.
+        """
+        if pixel_format is not self._layout_for:
+            self._layout_for = pixel_format
+            self._layout = _Layout(pixel_format)
+        layout = self._layout
+        assert layout is not None
+
+        block = yield 4
+        (remaining,) = unpack("!L", block)
+        if self.offload:
+            return (yield from self._inflateWhole(remaining, target.width, target.height, layout))
+        stream = self._zlib
+        data = bytearray()
+        pos = 0
+
+        for tx, ty, tw, th in _tiles(target.width, target.height, self.TILE):
+            while True:
+                try:
+                    pos, color, pixels, _ = _decode_tile(data, pos, tw, th, layout)
+                    break
+                except IndexError:
+                    pass
+                # The tile is incomplete: drop the tiles before it and
+                # inflate more of the stream.
+                del data[:pos]
+                pos = 0
+                if stream.unconsumed_tail:
+                    more = stream.decompress(stream.unconsumed_tail, INFLATE_CHUNK)
+                elif remaining:
+                    block = yield min(remaining, INFLATE_CHUNK)
+                    remaining -= len(block)
+                    more = stream.decompress(block, INFLATE_CHUNK)
+                else:
+                    more = stream.decompress(b"", INFLATE_CHUNK)
+                    if not more:
+                        raise DecodeError("ZRLE data ends inside a tile")
+                data += more
+            if color is not None:
+                target.fill(tx, ty, tw, th, color)
+            else:
+                target.blit(tx, ty, tw, th, pixels)
+
+        # Whatever follows the last tile -- a flush marker, usually -- still
+        # goes through the stream, which the next rectangle carries on.
+        while remaining or stream.unconsumed_tail:
+            if stream.unconsumed_tail:
+                stream.decompress(stream.unconsumed_tail, INFLATE_CHUNK)
+            else:
+                block = yield min(remaining, INFLATE_CHUNK)
+                remaining -= len(block)
+                stream.decompress(block, INFLATE_CHUNK)
+        return None
+
+    def _inflateWhole(
+        self, remaining: int, width: int, height: int, layout: _Layout
+    ) -> Generator[int, bytes, Job]:
+        """The rectangle's ``remaining`` compressed bytes inflated, here and
+        in order, and the decode of its tiles for the pump to run."""
+        stream = self._zlib
+        limit = _max_inflated(width, height, layout.cpixel, self.TILE)
+        data = bytearray()
+        while remaining:
+            block = yield min(remaining, INFLATE_CHUNK)
+            remaining -= len(block)
+            data += stream.decompress(block, limit + 1 - len(data))
+            if len(data) > limit:
+                raise DecodeError(f"ZRLE data inflates past the {limit} bytes a {width}x{height} rectangle can take")
+        return partial(_decode_rect, bytes(data), width, height, layout, self.TILE)
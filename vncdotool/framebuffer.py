@@ -0,0 +1,596 @@
+"""
+The client's copy of the remote screen, kept by a
+:class:`~vncdotool.session.RFBSession` subclass that needs no IO, so the
+Twisted and the asyncio clients share it: as the pixels the server sent, in
+the negotiated pixel format, converted to RGB only when something reads
+:attr:`FramebufferSession.screen`.
+"""
+from __future__ import annotations
+
+import functools
+import logging
+import math
+import os
+import warnings
+from typing import IO, Any, Union
+
+from . import pixelformat
+from .const import Encoding
+from .damage import DamageLog, overlaps
+from .session import PixelFormat, Rect, RFBSession
+
+log = logging.getLogger(__name__)
+
+# Enable using vncdotool without PIL. Of course capture and expect
+# won't work but at least we can still offer key, type, press and
+# move.
+try:
+    from PIL import Image
+
+    # Init PIL to make sure it will not try to import plugin libraries
+    # in a thread.
+    Image.preinit()
+    Image.init()
+except ImportError:
+    # If there is no PIL, raise ImportError where someone tries to use
+    # it.
+    class _RuntimeImportError:
+        def __getattr__(self, _: str) -> Any:
+            raise ImportError("PIL")
+
+    Image = _RuntimeImportError()  # type: ignore[assignment]
+    PIL = _RuntimeImportError()
+
+# Pillow modes holding pixels of 1 to 4 bytes as they are: the
+# framebuffer keeps the server's bytes in one, untouched until converted
+# with the format's raw mode -- "RGB" holds BGR bytes just the same.
+_STORAGE_MODES = {1: "L", 2: "I;16", 3: "RGB", 4: "RGBA"}
+
+
+# Expect targets kept decoded, for the paths most recently read.
+TARGET_CACHE = 32
+
+
+def histogram_rms(image: Image.Image, expected: list[int]) -> float | None:
+    """Root mean square between the histogram of ``image`` and ``expected``,
+    or None when the two are of different modes and cannot be compared."""
+    hist = image.histogram()
+    if len(hist) != len(expected):
+        return None
+    # The distance between the two as points, in C, over the root of the
+    # number of bins.
+    return math.dist(hist, expected) / math.sqrt(len(hist))
+
+
+def load_target(filename: Union[str, "os.PathLike[str]", IO[bytes]]) -> tuple[tuple[int, int], list[int]]:
+    """The size and histogram of the image an expect compares against, in
+    ``filename``, a path or a binary file. A path is read again only once
+    the file is modified; callers share what is returned and must not
+    change it."""
+    if isinstance(filename, (str, os.PathLike)):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            pass  # for Image.open to raise
+        else:
+            return _load_cached(os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    return _load_target(filename)
+
+
+@functools.lru_cache(maxsize=TARGET_CACHE)
+def _load_cached(path: str, mtime_ns: int, size: int) -> tuple[tuple[int, int], list[int]]:
+    return _load_target(path)
+
+
+def _load_target(filename: Union[str, "os.PathLike[str]", IO[bytes]]) -> tuple[tuple[int, int], list[int]]:
+    image = Image.open(filename)
+    try:
+        return image.size, image.histogram()
+    finally:
+        image.close()
+
+
+class FramebufferSession(RFBSession):
+    """Paints the rectangles the server sends into a framebuffer, read as
+    :attr:`screen`, with the cursor the server shapes drawn at the pointer
+    position ``(x, y)``.
+
+    Paints write the server's pixels into the framebuffer as they are and
+    note the area; reading :attr:`screen` converts the areas painted since it
+    was last read, and nothing else, into the image it returns. The cursor is
+    never in the framebuffer: it is drawn over the image as it is read, and
+    when it moves, only the boxes it left and went to are converted again.
+    """
+
+    requested_pixel_format: PixelFormat | None = None
+    # Offered most preferred first; None leaves the choice to the client.
+    encodings: list[Encoding] | None = None
+    # zlib and JPEG levels, 0-9; None leaves them to the server.
+    compress_level: int | None = None
+    quality_level: int | None = None
+    x = 0
+    y = 0
+    _image_mode = pixelformat.raw_mode(PixelFormat())
+    _raw_mode_format: PixelFormat | None = None
+    _raw_mode = ""
+
+    cursor: Image.Image | None = None
+    cmask: Image.Image | None = None
+    # Leave the cursor out of the screen, even when the server shapes it.
+    nocursor = False
+    # Ask only for the regions a capture or an expect looks at; False asks
+    # for the whole screen every time.
+    region_requests = True
+
+    MAX_DESKTOP_SIZE = 0x10000
+    BAND_ROWS = 64
+
+    # Painted areas kept apart until the next read; past this many they are
+    # one box around them all.
+    DIRTY_RECTS = 64
+    # Areas kept for damage_since(); past this many the oldest are one box.
+    DAMAGE_RECTS = 64
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._painted = DamageLog(self.DAMAGE_RECTS)
+        # The framebuffer: pixels in _fb_format, held in the storage mode
+        # of their size, or None before anything is painted.
+        self._fb: Image.Image | None = None
+        self._fb_format = self.pixel_format
+        # The image screen returns, and what it lacks of the framebuffer:
+        # the areas painted since, or all of it.
+        self._screen: Image.Image | None = None
+        self._dirty: list[Rect] = []
+        self._stale = False
+        # Where the cursor is drawn over the image, and whether it still
+        # is: a paint converted straight into the image may cover it.
+        self._cursor_box: Rect | None = None
+        self._cursor_drawn = False
+        # Whether the image was read during this update, and during the
+        # last one.
+        self._screen_read = False
+        self._convert_on_paint = False
+        # The last expect that did not match -- its area, maxrms and
+        # histogram -- and the damage token it was compared at.
+        self._mismatch: tuple[Rect, float, list[int], int] | None = None
+        # The regions the last update request asked for, None for the whole
+        # screen, and whether it was incremental.
+        self._requested: list[Rect] | None = None
+        self._requested_incremental = False
+        # The damage token when the update being received began.
+        self._update_token = 0
+
+    @property
+    def image_mode(self) -> str:
+        warnings.warn(
+            "image_mode will change in a future release; please comment on "
+            "https://github.com/sibson/vncdotool/issues/385 if you rely on it",
+            FutureWarning,
+            stacklevel=2,
+        )
+        return self._image_mode
+
+    def _rawModeFor(self, pixel_format: PixelFormat) -> str:
+        # Called once per rectangle. A PixelFormat is a frozen dataclass, so
+        # hashing one for a cache lookup costs more than the identity check
+        # a decoder handing back the same instance every time satisfies.
+        if pixel_format is not self._raw_mode_format:
+            self._raw_mode_format = pixel_format
+            self._raw_mode = pixelformat.raw_mode(pixel_format)
+        return self._raw_mode
+
+    def setImageMode(self) -> None:
+        """Check support for PixelFormats announced by server or select client supported alternative."""
+        pixel_format = self.requested_pixel_format
+        if pixel_format is None:
+            try:
+                self._image_mode = pixelformat.raw_mode(self.pixel_format)
+                return
+            except pixelformat.UnsupportedPixelFormat as exc:
+                log.debug("cannot unpack the server's format (%s), asking for another", exc)
+                if self._version_server == (3, 889):  # Apple Remote Desktop
+                    pixel_format = pixelformat.PIXEL_FORMATS["rgb565"]
+                else:
+                    pixel_format = pixelformat.PIXEL_FORMATS["rgbx8888"]
+
+        # Resolved before the request goes out: failing afterwards would
+        # leave the server sending pixels in a format we cannot read.
+        try:
+            image_mode = pixelformat.raw_mode(pixel_format)
+        except pixelformat.UnsupportedPixelFormat as exc:
+            self.vncProtocolError(f"cannot decode the requested pixel format: {exc}")
+            self._close()
+            return
+
+        self.setPixelFormat(pixel_format)
+        self._image_mode = image_mode
+
+    def _levelEncodings(self) -> list[Encoding]:
+        """The pseudo-encodings asking for :attr:`compress_level` and
+        :attr:`quality_level`. Quality asks for JPEG, which Tight sends only
+        as 24-bit colour, so it is left out for any other pixel format."""
+        encodings = []
+        if self.compress_level is not None:
+            encodings.append(Encoding.compress_level(self.compress_level))
+        if self.quality_level is not None and pixelformat.tpixel_bytes(self.pixel_format) == 3:
+            encodings.append(Encoding.quality_level(self.quality_level))
+        return encodings
+
+    def _matches(self, box: Rect, maxrms: float, expected: list[int]) -> bool:
+        """Whether the screen within ``box`` is within ``maxrms`` of the
+        ``expected`` histogram.
+
+        The same comparison failed before is made again only once something
+        has been painted inside ``box``; until then the screen is not even
+        read. A screen set from outside may be changed in place, which is no
+        paint, so it is compared every time.
+        """
+        x0, y0, x1, y1 = box
+        area = (x0, y0, x1 - x0, y1 - y0)
+        last = self._mismatch
+        if (
+            last is not None and self._fb is not None
+            and last[0] == area and last[1] == maxrms and last[2] is expected
+        ):
+            rects, token = self.damage_since(last[3])
+            if not any(overlaps(rect, area) for rect in rects):
+                self._mismatch = (area, maxrms, expected, token)
+                return False
+        else:
+            _, token = self.damage_since(self._painted.token)
+        self._mismatch = None
+        screen = self.screen
+        if not screen:
+            return False
+        rms = histogram_rms(screen.crop(box), expected)
+        if rms is not None:
+            log.debug("rms:%f maxrms:%f", rms, maxrms)
+            if rms <= maxrms:
+                return True
+        self._mismatch = (area, maxrms, expected, token)
+        return False
+
+    def damage_since(self, token: int = 0) -> tuple[list[Rect], int]:
+        """The areas of the screen painted since ``token``, overlapping ones
+        merged, and the token to pass next time; with no token, every area
+        painted so far. A reader keeping its own token can skip its work when
+        nothing it looks at has changed since it last looked."""
+        self._trackCursor()
+        return self._painted.since(token)
+
+    def requestUpdate(self, regions: list[Rect] | None = None, incremental: bool = False) -> None:
+        """Ask for an update of the ``(x, y, width, height)`` ``regions``,
+        clipped to the desktop, one request each. With none, none left once
+        clipped, or :attr:`region_requests` cleared, ask for the whole
+        screen."""
+        clipped = []
+        if regions and self.region_requests:
+            for x, y, width, height in regions:
+                left, top = max(x, 0), max(y, 0)
+                right, bottom = min(x + width, self.width), min(y + height, self.height)
+                if left < right and top < bottom:
+                    clipped.append((left, top, right - left, bottom - top))
+        self._requested = clipped or None
+        self._requested_incremental = incremental
+        if not clipped:
+            self.framebufferUpdateRequest(incremental=incremental)
+            return
+        with self.batch():
+            for x, y, width, height in clipped:
+                self.framebufferUpdateRequest(x, y, width, height, incremental)
+
+    def _requestAlso(self, regions: list[Rect] | None = None, incremental: bool = False) -> None:
+        """Ask for ``regions``, or the whole screen, on top of the request
+        still unanswered."""
+        requested, was_incremental = self._requested, self._requested_incremental
+        if requested is None:
+            return  # the whole screen is on its way
+        self.requestUpdate(regions, incremental)
+        if self._requested is not None:
+            self._requested = requested + self._requested
+            self._requested_incremental = was_incremental or incremental
+
+    def _regionsIgnored(self) -> bool:
+        """Whether the update just received, answering a request for
+        regions of the screen whole, painted pixels and none of them inside
+        those regions: the server ignored the regions. It is asked for the
+        whole screen then, this once.
+
+        Pseudo-encodings, such as a cursor shape, paint nothing and count
+        for neither; nor does anything the server pushes as continuous
+        updates, which answers no request.
+        """
+        requested = self._requested
+        if requested is None or self._requested_incremental or self.continuous_updates:
+            return False
+        painted, _ = self._painted.since(self._update_token)
+        if not painted or any(overlaps(rect, region) for rect in painted for region in requested):
+            return False
+        log.debug("server ignored the regions asked for; asking for the whole screen")
+        self.requestUpdate()
+        return True
+
+    @property
+    def screen(self) -> Image.Image | None:
+        """The screen as an RGB image, None before anything is painted.
+
+        Brought up to date when read: the same image each time, with what
+        was painted since the last read converted into it.
+        """
+        self._screen_read = True
+        self._trackCursor()
+        if self._fb is not None and (self._stale or self._dirty):
+            self._refreshScreen()
+        elif not self._cursor_drawn:
+            self.drawCursor()
+        return self._screen
+
+    def _hasScreen(self) -> bool:
+        """Whether there is a screen, without reading it: a read converts
+        what was painted since the last one."""
+        return self._fb is not None or self._screen is not None
+
+    @screen.setter
+    def screen(self, image: Image.Image | None) -> None:
+        """Replace the screen. Its pixels become the framebuffer's when
+        something is next painted."""
+        self._screen = image
+        self._fb = None
+        self._dirty.clear()
+        self._stale = False
+        self._cursor_box = None
+        self._cursor_drawn = False
+        self._painted.add(0, 0, self.width, self.height)
+
+    def _refreshScreen(self) -> None:
+        fb = self._fb
+        assert fb is not None
+        mode = self._rawModeFor(self._fb_format)
+        if self._screen is None or self._screen.size != fb.size:
+            self._screen = Image.frombytes("RGB", fb.size, fb.tobytes(), "raw", mode)
+        elif self._stale:
+            self._screen.frombytes(fb.tobytes(), "raw", mode)
+        else:
+            for x, y, w, h in self._dirty:
+                area = fb.crop((x, y, x + w, y + h)).tobytes()
+                self._screen.paste(Image.frombytes("RGB", (w, h), area, "raw", mode), (x, y))
+        self._dirty.clear()
+        self._stale = False
+        self.drawCursor()
+
+    def _paintedScreen(self) -> Image.Image | None:
+        """The image, when a paint goes into it as well as the framebuffer:
+        while it is read every update, converting each area as it is
+        painted costs less than noting it and converting it at the read."""
+        screen = self._screen
+        if (
+            not self._convert_on_paint or self._stale or self._dirty
+            or screen is None or self._fb is None or screen.size != self._fb.size
+        ):
+            return None
+        self._cursor_drawn = False
+        return screen
+
+    def _cursorBox(self) -> Rect | None:
+        """Where the cursor goes, with the pointer where it is now."""
+        if not self.cursor or self.nocursor:
+            return None
+        width, height = self.cursor.size
+        return self.x - self.cfocus[0], self.y - self.cfocus[1], width, height
+
+    def _trackCursor(self) -> None:
+        """When the cursor has moved or changed, note the box it left and
+        the one it went to: painted, for :meth:`damage_since`, and for the
+        image to have converted again from the framebuffer, which the
+        cursor is never drawn into."""
+        box = self._cursorBox()
+        if box == self._cursor_box:
+            return
+        if box is not None and self._fb is None and self._screen is not None:
+            # A screen set from outside: keep it apart from the cursor too.
+            self._loadScreen()
+        self._dropCursor()
+        if box is not None:
+            self._cursorDamage(box)
+        self._cursor_box = box
+
+    def _dropCursor(self) -> None:
+        """Note the box the cursor is drawn in, for it to come off."""
+        if self._cursor_box is not None:
+            self._cursorDamage(self._cursor_box)
+            self._cursor_box = None
+        self._cursor_drawn = False
+
+    def _cursorDamage(self, box: Rect) -> None:
+        self._painted.add(*box)
+        if self._fb is None:
+            return
+        # Clipped to the framebuffer: the cursor may hang off its edges.
+        fb_width, fb_height = self._fb.size
+        left, top = max(box[0], 0), max(box[1], 0)
+        right = min(box[0] + box[2], fb_width)
+        bottom = min(box[1] + box[3], fb_height)
+        if left < right and top < bottom:
+            self._damage(left, top, right - left, bottom - top)
+
+    def _damage(self, x: int, y: int, width: int, height: int) -> None:
+        """Note an area of the framebuffer the image has yet to be given."""
+        if self._stale:
+            return
+        assert self._fb is not None
+        if (width, height) == self._fb.size:
+            self._stale = True
+            self._dirty.clear()
+            return
+        dirty = self._dirty
+        if dirty:
+            last_x, last_y, last_width, last_height = dirty[-1]
+            if (last_x, last_width) == (x, width) and last_y + last_height == y:
+                # The next band of the same rectangle.
+                dirty[-1] = (x, last_y, width, last_height + height)
+                return
+        dirty.append((x, y, width, height))
+        if len(dirty) > self.DIRTY_RECTS:
+            left = min(r[0] for r in dirty)
+            top = min(r[1] for r in dirty)
+            right = max(r[0] + r[2] for r in dirty)
+            bottom = max(r[1] + r[3] for r in dirty)
+            dirty[:] = [(left, top, right - left, bottom - top)]
+
+    def _fbFor(self, x: int, y: int, width: int, height: int) -> Image.Image:
+        """The framebuffer, made or grown to hold the rectangle, in the
+        negotiated pixel format."""
+        fb = self._fb
+        if fb is None or self._fb_format is not self.pixel_format:
+            fb = self._loadScreen()
+        # track upward screen resizes, often occurs during os boot of VMs
+        # When the screen is sent in chunks (as observed on VMWare ESXi), the canvas
+        # needs to be resized to fit all existing contents and the update.
+        fb_width, fb_height = fb.size
+        if fb_width < x + width or fb_height < y + height:
+            fb = self._resize(max(x + width, fb_width), max(y + height, fb_height))
+        return fb
+
+    def _loadScreen(self) -> Image.Image:
+        """A framebuffer in the negotiated format from the screen as it
+        stands -- black at the desktop's size when there is none."""
+        pixel_format = self.pixel_format
+        storage = _STORAGE_MODES[pixel_format.bypp]
+        screen = self._screen
+        if screen is None:
+            fb = Image.new(storage, (self.width, self.height))
+        else:
+            rgb = screen.convert("RGB")
+            try:
+                pixels = rgb.tobytes("raw", self._rawModeFor(pixel_format))
+            except ValueError:
+                # Pillow reads 16bpp layouts, but cannot write them.
+                pixels = pixelformat.pack_rgb(rgb.tobytes(), pixel_format)
+            fb = Image.frombytes(storage, screen.size, pixels)
+        self._fb = fb
+        self._fb_format = pixel_format
+        self._dirty.clear()
+        self._stale = screen is None
+        return fb
+
+    def _resize(self, width: int, height: int) -> Image.Image:
+        """The framebuffer at ``width`` by ``height``, what it held kept at
+        the top left and the rest black."""
+        assert self._fb is not None
+        fb = Image.new(self._fb.mode, (width, height))
+        fb.paste(self._fb, (0, 0))
+        self._fb = fb
+        self._stale = True
+        return fb
+
+    def updateRectangle(
+        self,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        data: bytes,
+        pixel_format: PixelFormat,
+    ) -> None:
+        # ignore empty updates
+        if not data:
+            return
+
+        fb = self._fbFor(x, y, width, height)
+        screen = self._paintedScreen()
+        pixels = data
+        if pixel_format is not self._fb_format or screen is not None:
+            update = Image.frombytes(
+                "RGB", (width, height), data, "raw", self._rawModeFor(pixel_format)
+            )
+            if screen is not None:
+                screen.paste(update, (x, y))
+            if pixel_format is not self._fb_format:
+                # Tight's TPIXELs and images, three bytes a pixel: written
+                # into the framebuffer in its own format.
+                pixels = update.tobytes("raw", self._rawModeFor(self._fb_format))
+        fb.paste(Image.frombytes(fb.mode, (width, height), pixels), (x, y))
+        self._painted.add(x, y, width, height)
+        if screen is None:
+            self._damage(x, y, width, height)
+
+    def fillRectangle(
+        self, x: int, y: int, width: int, height: int, color: bytes
+    ) -> None:
+        fb = self._fbFor(x, y, width, height)
+        # The colour as the storage mode's pixel value, its bytes unchanged.
+        value = Image.frombytes(fb.mode, (1, 1), bytes(color)).getpixel((0, 0))
+        if fb.mode == "I;16":
+            # Pillow pastes a 16-bit value as its low byte twice.
+            fb.paste(Image.new(fb.mode, (width, height), value), (x, y))
+        else:
+            fb.paste(value, (x, y, x + width, y + height))
+        screen = self._paintedScreen()
+        self._painted.add(x, y, width, height)
+        if screen is None:
+            self._damage(x, y, width, height)
+            return
+        rgb = Image.frombytes("RGB", (1, 1), bytes(color), "raw", self._rawModeFor(self._fb_format))
+        screen.paste(rgb.getpixel((0, 0)), (x, y, x + width, y + height))
+
+    def copyRectangle(
+        self, srcx: int, srcy: int, x: int, y: int, width: int, height: int
+    ) -> None:
+        if self._fb is None and self._screen is None:
+            return
+        fb = self._fbFor(x, y, width, height)
+        # crop() copies the source out before anything is written, so the
+        # two may overlap, as they do whenever a window scrolls.
+        source = (srcx, srcy, srcx + width, srcy + height)
+        fb.paste(fb.crop(source), (x, y))
+        screen = self._paintedScreen()
+        self._painted.add(x, y, width, height)
+        if screen is None or self._cursor_box is not None and overlaps(self._cursor_box, (srcx, srcy, width, height)):
+            # The image under the cursor is not the framebuffer's to copy.
+            self._damage(x, y, width, height)
+        else:
+            screen.paste(screen.crop(source), (x, y))
+
+    def beginUpdate(self) -> None:
+        self._convert_on_paint, self._screen_read = self._screen_read, False
+        self._update_token = self._painted.token
+
+    def updateCursor(
+        self, x: int, y: int, width: int, height: int, image: bytes, mask: bytes
+    ) -> None:
+        if self.nocursor:
+            return
+
+        if not width or not height:
+            self.cursor = None
+
+        self.cursor = Image.frombytes(
+            "RGB", (width, height), image, "raw", self._image_mode
+        )
+        self.cmask = Image.frombytes("1", (width, height), mask)
+        self.cfocus = x, y
+        # Whatever its box, the old shape comes off and the new goes on.
+        self._dropCursor()
+
+    def drawCursor(self) -> None:
+        """Draw the cursor over the image :attr:`screen` returns, where the
+        pointer is."""
+        self._cursor_drawn = True
+        box = self._cursorBox()
+        if box is None or not self._screen:
+            return
+        self._screen.paste(self.cursor, box[:2], self.cmask)
+
+    def updateDesktopSize(self, width: int, height: int) -> None:
+        if not (
+            0 <= width < self.MAX_DESKTOP_SIZE and 0 <= height < self.MAX_DESKTOP_SIZE
+        ):
+            raise ValueError((width, height))
+        if self._fb is None or self._fb_format is not self.pixel_format:
+            self._loadScreen()
+        self._resize(width, height)
+        self._painted.add(0, 0, width, height)
+        if self.continuous_updates:
+            # The area asked for was the old desktop; cover the new one.
+            self.enableContinuousUpdates(width=width, height=height)
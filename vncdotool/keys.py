@@ -154,3 +154,22 @@ KEYMAP = {
     "kpenter": Key.KP_Enter,
     "minus": ord('-'),  # Literal `-` will get split while decoding
 }
+
+# Characters typed with shift on a US keyboard, for servers that need the
+# shift sent explicitly.
+SPECIAL_KEYS_US = '~!@#$%^&*()_+{}|:"<>?'
+
+
+def decode_key(key: str, force_caps: bool = False) -> list[int]:
+    """The keysyms ``key`` presses: a character, or names from
+    :data:`KEYMAP` joined by ``-`` such as ``ctrl-alt-del``."""
+    if force_caps:
+        if key.isupper() or key in SPECIAL_KEYS_US:
+            key = "shift-%c" % key
+
+    if len(key) == 1:
+        keys = [key]
+    else:
+        keys = key.split("-")
+
+    return [KEYMAP.get(k) or ord(k) for k in keys]
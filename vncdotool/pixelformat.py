@@ -1,6 +1,6 @@
 """
-Pixel format resolution: :class:`rfb.PixelFormat` -> Pillow raw mode, and the
-CPIXEL width/offset rules ZRLE depends on.
+:class:`PixelFormat`, its resolution to a Pillow raw mode, and the CPIXEL
+and TPIXEL width/offset rules ZRLE and Tight depend on.
 
 Reference:
 https://www.rfc-editor.org/rfc/rfc6143#section-7.7.5
@@ -9,18 +9,65 @@ https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst (ZRLE Encoding)
 from __future__ import annotations
 
 import functools
-
-from . import rfb
+from dataclasses import astuple, dataclass
+from struct import Struct
+from typing import ClassVar, cast
 
 _32BPP_MODES = {"RGBX", "BGRX", "XRGB", "XBGR"}
 _24BPP_MODES = {"RGB", "BGR"}
 
 
+@dataclass(frozen=True)
+class PixelFormat:
+    """:rfc:`6143` §7.4. Pixel Format Data Structure."""
+
+    bpp: int = 32  # u8: bits-per-pixel
+    depth: int = 24  # u8
+    bigendian: bool = False  # u8
+    truecolor: bool = True  # u8
+    redmax: int = 255  # u16
+    greenmax: int = 255  # u16
+    bluemax: int = 255  # u16
+    redshift: int = 0  # u8
+    greenshift: int = 8  # u8
+    blueshift: int = 16  # u8
+
+    STRUCT: ClassVar = Struct("!BB??HHHBBBxxx")
+    VALIDATE: ClassVar = False
+
+    def __post_init__(self) -> None:
+        if not self.VALIDATE:
+            return
+        assert self.bpp in {8, 16, 24, 32}, f"bpp={self.bpp}"
+        assert 1 <= self.depth <= self.bpp, f"depth={self.depth} <= bpp={self.bpp}"
+        if self.truecolor:
+            for max, shift in zip(
+                (self.redmax, self.greenmax, self.bluemax),
+                (self.redshift, self.greenshift, self.blueshift),
+            ):
+                assert 1 <= max <= 0xFFFF, f"1 <= max={max} <= 0xffff"
+                assert max & (max + 1) == 0, f"max={max} not a 2**n-1"
+                assert (
+                    0 <= shift <= self.bpp - max.bit_length()
+                ), f"shift={shift} not in bpp={self.bpp}"
+
+    @property
+    def bypp(self) -> int:  # bytes-per-pixel
+        return (7 + self.bpp) // 8
+
+    @classmethod
+    def from_bytes(cls, block: bytes) -> PixelFormat:
+        return cls(*cls.STRUCT.unpack(block))
+
+    def to_bytes(self) -> bytes:
+        return cast(bytes, self.STRUCT.pack(*astuple(self)))
+
+
 class UnsupportedPixelFormat(Exception):
-    """No Pillow raw mode exists for this :class:`rfb.PixelFormat`."""
+    """No Pillow raw mode exists for this :class:`PixelFormat`."""
 
 
-def _channel_widths(pixel_format: rfb.PixelFormat) -> tuple[int, int, int]:
+def _channel_widths(pixel_format: PixelFormat) -> tuple[int, int, int]:
     return (
         pixel_format.redmax.bit_length(),
         pixel_format.greenmax.bit_length(),
@@ -29,7 +76,7 @@ def _channel_widths(pixel_format: rfb.PixelFormat) -> tuple[int, int, int]:
 
 
 def _byte_positions(
-    pixel_format: rfb.PixelFormat, nbytes: int
+    pixel_format: PixelFormat, nbytes: int
 ) -> dict[int, str]:
     positions: dict[int, str] = {}
     for shift, channel in (
@@ -48,7 +95,7 @@ def _byte_positions(
 
 
 @functools.lru_cache(maxsize=None)
-def raw_mode(pixel_format: rfb.PixelFormat) -> str:
+def raw_mode(pixel_format: PixelFormat) -> str:
     """The Pillow raw mode that reads bytes in this layout, ignoring depth."""
     if not pixel_format.truecolor:
         raise UnsupportedPixelFormat("colour-mapped pixel formats are not supported")
@@ -98,7 +145,7 @@ def raw_mode(pixel_format: rfb.PixelFormat) -> str:
     raise UnsupportedPixelFormat(f"bpp={pixel_format.bpp} is not supported")
 
 
-def _cpixel_placement(pixel_format: rfb.PixelFormat) -> str | None:
+def _cpixel_placement(pixel_format: PixelFormat) -> str | None:
     widths = _channel_widths(pixel_format)
     shifts = (pixel_format.redshift, pixel_format.greenshift, pixel_format.blueshift)
     fits_low = all(shift + width <= 24 for shift, width in zip(shifts, widths))
@@ -112,7 +159,7 @@ def _cpixel_placement(pixel_format: rfb.PixelFormat) -> str | None:
     return None
 
 
-def cpixel_bytes(pixel_format: rfb.PixelFormat) -> int:
+def cpixel_bytes(pixel_format: PixelFormat) -> int:
     """3 for a CPIXEL-eligible format, otherwise ``bypp`` (a PIXEL)."""
     if (
         pixel_format.truecolor
@@ -124,7 +171,7 @@ def cpixel_bytes(pixel_format: rfb.PixelFormat) -> int:
     return pixel_format.bypp
 
 
-def cpixel_offset(pixel_format: rfb.PixelFormat) -> int:
+def cpixel_offset(pixel_format: PixelFormat) -> int:
     """Byte offset of the 3 CPIXEL bytes within a PIXEL: 0 or ``bypp - 3``.
 
     The placement is in value space and the offset is in byte space, so
@@ -137,8 +184,48 @@ def cpixel_offset(pixel_format: rfb.PixelFormat) -> int:
     return 0 if low != pixel_format.bigendian else pixel_format.bypp - 3
 
 
-PIXEL_FORMATS: dict[str, rfb.PixelFormat] = {
-    "bgrx8888": rfb.PixelFormat(32, 24, False, True, 255, 255, 255, 16, 8, 0),
-    "rgbx8888": rfb.PixelFormat(32, 24, False, True, 255, 255, 255, 0, 8, 16),
-    "rgb565": rfb.PixelFormat(16, 16, False, True, 31, 63, 31, 11, 5, 0),
+def tpixel_bytes(pixel_format: PixelFormat) -> int:
+    """3 when Tight sends a pixel as red, green and blue bytes, otherwise
+    ``bypp`` (a PIXEL). rfbproto, Tight Encoding.
+
+    Narrower than CPIXEL: exactly depth 24 and 8-bit channels, and the
+    bytes are in that order whatever the shifts and endianness.
+    """
+    if (
+        pixel_format.truecolor
+        and pixel_format.bpp == 32
+        and pixel_format.depth == 24
+        and (pixel_format.redmax, pixel_format.greenmax, pixel_format.bluemax) == (255, 255, 255)
+    ):
+        return 3
+    return pixel_format.bypp
+
+
+def pack_rgb(rgb: bytes, pixel_format: PixelFormat) -> bytes:
+    """Red, green and blue bytes as pixels in ``pixel_format``, one at a
+    time: for the layouts Pillow can read but has no packer for, 16bpp
+    ones among them."""
+    code = {1: "B", 2: "H", 4: "I"}[pixel_format.bypp]
+    pixel = Struct((">" if pixel_format.bigendian else "<") + code)
+    channels = (
+        (pixel_format.redmax, pixel_format.redshift),
+        (pixel_format.greenmax, pixel_format.greenshift),
+        (pixel_format.bluemax, pixel_format.blueshift),
+    )
+    out = bytearray()
+    for i in range(0, len(rgb), 3):
+        value = 0
+        for level, (maximum, shift) in zip(rgb[i:i + 3], channels):
+            value |= (level * maximum + 127) // 255 << shift
+        out += pixel.pack(value)
+    return bytes(out)
+
+
+# Three bytes, red first: what a TPIXEL and a decoded JPEG are laid out in.
+RGB888 = PixelFormat(24, 24, False, True, 255, 255, 255, 0, 8, 16)
+
+PIXEL_FORMATS: dict[str, PixelFormat] = {
+    "bgrx8888": PixelFormat(32, 24, False, True, 255, 255, 255, 16, 8, 0),
+    "rgbx8888": PixelFormat(32, 24, False, True, 255, 255, 255, 0, 8, 16),
+    "rgb565": PixelFormat(16, 16, False, True, 31, 63, 31, 11, 5, 0),
 }
@@ -0,0 +1,1217 @@
+"""
+RFB protocol, client side, as a state machine with no IO: the bytes the
+server sends go in through :meth:`RFBSession.feed`, the bytes to send back
+come out of :meth:`RFBSession.data_to_send`, and what happens in between is
+reported through the session's callbacks. :mod:`vncdotool.rfb` runs one on
+Twisted.
+
+Reference:
+https://www.rfc-editor.org/rfc/rfc6143
+https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst
+"""
+# (C) 2003 cliechti@gmx.net
+#
+# MIT License
+
+from __future__ import annotations
+
+import getpass
+import ipaddress
+import logging
+import os
+import socket
+import time
+import warnings
+import zlib
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from struct import error as StructError, pack, unpack, unpack_from
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Iterator,
+    List,
+    Tuple,
+    cast,
+)
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.asymmetric import dh
+from cryptography.hazmat.primitives import hashes
+from cryptography.utils import CryptographyDeprecationWarning
+
+from . import decoders, trace
+from .const import Encoding, FenceFlags, AuthTypes, MsgC2S, MsgS2C
+from .keys import Key
+from .pixelformat import PixelFormat
+
+log = logging.getLogger(__name__)
+
+Rect = Tuple[int, int, int, int]
+Ver = Tuple[int, int]
+
+# What a decoder raises on data it cannot decode.
+DECODE_ERRORS = (decoders.DecodeError, StructError, MemoryError, zlib.error)
+
+_decode_pool: ThreadPoolExecutor | None = None
+
+
+def decode_pool() -> ThreadPoolExecutor:
+    """The threads :meth:`RFBSession.decodeInBackground` runs decodes on in
+    the Twisted and asyncio clients, shared by every session and started
+    when one first needs it. One per core: a decode keeps a core busy, and
+    more threads than cores would only take turns with the one parsing.
+    """
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="vncdotool-decode")
+    return _decode_pool
+
+
+def _run_job(job: decoders.Job) -> bytes | Exception:
+    """``job``'s pixels, or what it raised: anything raised on another
+    thread or process would be lost, and the connection left waiting on a
+    paint that never comes. At module level, so a process pool can pickle
+    it."""
+    try:
+        return job()
+    except Exception as exc:
+        return exc
+
+
+class VNCDoException(Exception):
+    pass
+
+
+class AuthenticationError(VNCDoException):
+    """VNC Server requires Authentication"""
+
+
+class ProtocolError(VNCDoException):
+    """VNC Server sent something we cannot handle"""
+
+
+class ReceiveBuffer:
+    """Bytes received and not yet parsed, read through a cursor.
+
+    Chunks are kept as the transport delivered them instead of being appended
+    to one bytearray, so nothing is copied on arrival and nothing is moved
+    when the front is consumed. A block lying inside one chunk is handed out
+    as a read-only memoryview of it; only a block straddling chunks is
+    copied, once, to join it. Blocks shorter than ``VIEW_MIN`` are sliced to
+    ``bytes`` instead: the copy is cheaper than the view, and the handlers
+    reading message headers get the type they index and compare most easily.
+    """
+
+    VIEW_MIN = 4096
+
+    def __init__(self) -> None:
+        self._chunks: deque[bytes] = deque()
+        self._pos = 0  # read cursor into _chunks[0]
+        self._len = 0
+        # Bytes copied handing blocks out, which the benchmark reports.
+        self.copied = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iadd__(self, data: bytes) -> ReceiveBuffer:
+        self.extend(data)
+        return self
+
+    def extend(self, data: bytes) -> None:
+        if data:
+            # bytes() of a bytes object is that object; anything mutable has
+            # to be copied, or the caller could change it under a held view.
+            self._chunks.append(bytes(data))
+            self._len += len(data)
+
+    def clear(self) -> None:
+        self._chunks.clear()
+        self._pos = 0
+        self._len = 0
+
+    def peek(self, size: int) -> bytes:
+        """Up to ``size`` bytes from the front, without consuming them."""
+        parts = []
+        start = self._pos
+        for chunk in self._chunks:
+            part = chunk[start:start + size]
+            parts.append(part)
+            size -= len(part)
+            start = 0
+            if not size:
+                break
+        return b"".join(parts)
+
+    def take(self, size: int) -> bytes | memoryview:
+        """Consume ``size`` bytes, which the caller has checked are there."""
+        if not size:
+            return b""
+        chunks = self._chunks
+        first = chunks[0]
+        start = self._pos
+        end = start + size
+        self._len -= size
+        if end <= len(first):
+            if end == len(first):
+                chunks.popleft()
+                self._pos = 0
+            else:
+                self._pos = end
+            if size < self.VIEW_MIN:
+                self.copied += size
+                return first[start:end]
+            return memoryview(first)[start:end]
+
+        parts: list[bytes | memoryview] = [memoryview(first)[start:]]
+        chunks.popleft()
+        self._pos = 0
+        needed = end - len(first)
+        while needed:
+            chunk = chunks[0]
+            if len(chunk) <= needed:
+                parts.append(chunk)
+                chunks.popleft()
+                needed -= len(chunk)
+            else:
+                parts.append(memoryview(chunk)[:needed])
+                self._pos = needed
+                needed = 0
+        self.copied += size
+        return b"".join(parts)
+
+
+# ------------------------------------------------------
+# client -> server messages, as bytes
+# ------------------------------------------------------
+
+FENCE_PAYLOAD_MAX = 64
+
+
+def pack_set_pixel_format(pixel_format: PixelFormat) -> bytes:
+    return pack("!Bxxx16s", MsgC2S.SET_PIXEL_FORMAT, pixel_format.to_bytes())
+
+
+def pack_set_encodings(encodings: Collection[int]) -> bytes:
+    count = len(encodings)
+    return pack(f"!BxH{count}i", MsgC2S.SET_ENCODING, count, *encodings)
+
+
+def pack_framebuffer_update_request(
+    x: int, y: int, width: int, height: int, incremental: bool = False
+) -> bytes:
+    return pack("!BBHHHH", MsgC2S.FRAMEBUFFER_UPDATE_REQUEST, incremental, x, y, width, height)
+
+
+def pack_key_event(key: int, down: bool = True) -> bytes:
+    return pack("!BBxxI", MsgC2S.KEY_EVENT, down, key)
+
+
+def pack_pointer_event(x: int, y: int, buttonmask: int = 0) -> bytes:
+    return pack("!BBHH", MsgC2S.POINTER_EVENT, buttonmask, x, y)
+
+
+def pack_client_cut_text(text: str) -> bytes:
+    data = text.encode("iso-8859-1")
+    return pack("!BxxxI", MsgC2S.CLIENT_CUT_TEXT, len(data)) + data
+
+
+def pack_enable_continuous_updates(
+    enable: bool, x: int, y: int, width: int, height: int
+) -> bytes:
+    return pack("!BBHHHH", MsgC2S.ENABLE_CONTINUOUS_UPDATES, enable, x, y, width, height)
+
+
+def pack_client_fence(flags: int, payload: bytes = b"") -> bytes:
+    if len(payload) > FENCE_PAYLOAD_MAX:
+        raise ValueError(f"fence payload of {len(payload)} bytes, more than {FENCE_PAYLOAD_MAX}")
+    return pack("!BxxxIB", MsgC2S.CLIENT_FENCE, flags, len(payload)) + payload
+
+
+class RFBSession:
+    """The client side of one RFB connection, with no IO of its own.
+
+    :meth:`feed` it the bytes the server sends; it parses them, calling the
+    callbacks below as messages arrive, and queues its answers and whatever
+    the client sends for :meth:`data_to_send`. :class:`rfb.RFBClient` drives
+    one from Twisted.
+    """
+
+    # https://www.rfc-editor.org/rfc/rfc6143#section-7.1.1
+    SUPPORTED_SERVER_VERSIONS = {
+        (3, 3),
+        # (3, 5),
+        (3, 7),
+        (3, 8),
+        (3, 889),  # Apple Remote Desktop
+        (4, 0),  # Intel AMT KVM
+        (4, 1),  # RealVNC 4.6
+        (5, 0),  # RealVNC 5.3
+    }
+    MAX_CLIENT_VERSION = (3, 8)
+    SUPPORTED_AUTHS = {
+        AuthTypes.NONE,
+        AuthTypes.VNC_AUTHENTICATION,
+        AuthTypes.DIFFIE_HELLMAN,
+    }
+    # What a rectangle has a decoder for, and the extensions handled as
+    # messages of their own.
+    SUPPORTED_ENCODINGS = set(decoders.DECODERS) | {
+        Encoding.PSEUDO_CONTINUOUS_UPDATES,
+        Encoding.PSEUDO_FENCE,
+    }
+
+    # The flags a fence request from the server is answered with, when it
+    # asks for them: parsing is strictly in order, so every one holds.
+    FENCE_FLAGS = FenceFlags.BLOCK_BEFORE | FenceFlags.BLOCK_AFTER | FenceFlags.SYNC_NEXT
+    FENCE_PAYLOAD_MAX = FENCE_PAYLOAD_MAX
+
+    # Greater than any u16 dimension, so it refuses nothing until a subclass
+    # narrows it.
+    MAX_DESKTOP_SIZE = 0x10000
+
+    # Rows a decoder that can stream a rectangle in bands (Raw) is pumped
+    # at: each band is painted as it arrives instead of the whole rectangle
+    # piling up first. None decodes every rectangle whole.
+    BAND_ROWS: int | None = None
+
+    # Where the Twisted and asyncio clients run decodes off the parsing
+    # thread: None is decode_pool(), and takes images alone. An executor of
+    # the session's own -- a process pool too -- also takes every ZRLE,
+    # Tight and RRE rectangle read whole; see PixelDecoder.offload. Read
+    # when the session is made, like BAND_ROWS.
+    decode_executor: Executor | None = None
+
+    # Structured events, see vncdotool/trace.py; assign a Tracer with sinks
+    # to a client or a subclass to turn them on.
+    tracer: trace.Tracer = trace.DISABLED
+
+    # Credentials, asked for through vncRequestPassword and
+    # ardRequestCredentials when unset, and the ClientInit shared flag.
+    username: str | None = None
+    password: str | None = None
+    shared: bool = False
+
+    _HEADER = b"RFB 000.000\n"
+    _HEADER_TRANSLATE = bytes.maketrans(b"0123456789", b"0" * 10)
+
+    _CHANGING_HOOKS = ("fillRectangle", "updateRectangle")
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        for name in cls._CHANGING_HOOKS:
+            if not getattr(cls, name).__module__.startswith("vncdotool."):
+                warnings.warn(
+                    f"{name} will change in a future release; please comment "
+                    "on https://github.com/sibson/vncdotool/issues/385 if "
+                    "you rely on it",
+                    FutureWarning,
+                    stacklevel=2,
+                )
+
+    def __init__(self) -> None:
+        self._packet = ReceiveBuffer()
+        self._outgoing: list[bytes] = []
+        self._batching = 0
+        self.closed = False
+        self._handler = self._handleInitial
+        self._expected_len = 12
+        self._expected_args: tuple[Any, ...] = ()
+        self._expected_kwargs: dict[str, Any] = {}
+        self._already_expecting = False
+        self._aborted = False
+        self._version: Ver = (0, 0)
+        self._version_server: Ver = (0, 0)
+        self.negotiated_encodings = {
+            Encoding.RAW,
+        }
+        self.continuous_updates = False
+        self._fences: dict[bytes, float] = {}
+        self._fence_serial = 0
+        self.rtt: float | None = None
+        self.pixel_format = PixelFormat()
+        self.width = 0
+        self.height = 0
+        self._rect_backing = bytearray()
+        self._decoders = {
+            encoding: (decoder, self._pumpFor(decoder))
+            for encoding, decoder in decoders.for_connection(
+                offload=self.decode_executor is not None
+            ).items()
+        }
+        # Paints behind a rectangle still decoding in the background, in
+        # the order they arrived: each a one-item list holding the paint,
+        # or None while its decode runs.
+        self._paints: deque[list[Callable[[], None] | None]] = deque()
+        # What parsing carries on with once they are all painted, having
+        # reached something that has to come after them.
+        self._parked: Callable[[], None] | None = None
+
+    @property
+    def bypp(self) -> int:
+        return self.pixel_format.bypp
+
+    # ------------------------------------------------------
+    # states used on connection startup
+    # ------------------------------------------------------
+
+    def _handleInitial(self) -> None:
+        head = self._packet.peek(12)
+        norm = head.translate(self._HEADER_TRANSLATE)
+        if norm == self._HEADER:
+            version_server = (int(head[4:7]), int(head[8:11]))
+            if version_server not in self.SUPPORTED_SERVER_VERSIONS:
+                log.info("Protocol version %d.%d not supported" % version_server)
+
+            version = max(
+                v for v in self.SUPPORTED_SERVER_VERSIONS if v <= version_server
+            )
+            if version > self.MAX_CLIENT_VERSION:
+                version = self.MAX_CLIENT_VERSION
+
+            self._packet.take(12)
+            log.info("Using protocol version %d.%d" % version)
+            self._write(b"RFB %03d.%03d\n" % version)
+            self._handler = self._handleExpected
+            self._version = version
+            self._version_server = version_server
+            if version < (3, 7):
+                self.expect(self._handleAuth, 4)
+            else:
+                self.expect(self._handleNumberSecurityTypes, 1)
+        elif not self._HEADER.startswith(norm):
+            self.vncProtocolError(f"invalid initial server response {head!r}")
+            self._close()
+
+    def _handleNumberSecurityTypes(self, block: bytes) -> None:
+        (num_types,) = unpack("!B", block)
+        if num_types:
+            self.expect(self._handleSecurityTypes, num_types)
+        else:
+            self.expect(self._handleConnFailed, 4)
+
+    def _handleSecurityTypes(self, block: bytes) -> None:
+        types = unpack(f"!{len(block)}B", block)
+        for sec_type in types:
+            log.info(f"Offered {AuthTypes.lookup(sec_type)!r}")
+        valid_types = set(types) & self.SUPPORTED_AUTHS
+        if valid_types:
+            sec_type = max(valid_types)
+            self._write(pack("!B", sec_type))
+            if sec_type == AuthTypes.NONE:
+                if self._version < (3, 8):
+                    self._doClientInitialization()
+                else:
+                    self.expect(self._handleVNCAuthResult, 4)
+            elif sec_type == AuthTypes.VNC_AUTHENTICATION:
+                self.expect(self._handleVNCAuth, 16)
+            elif sec_type == AuthTypes.DIFFIE_HELLMAN:
+                self.expect(self._handleDHAuth, 4)
+        else:
+            self.vncProtocolError(f"unknown security types: {types!r}")
+            self._close()
+
+    def _handleAuth(self, block: bytes) -> None:
+        (auth,) = unpack("!I", block)
+        # ~ print(f"{auth=}")
+        if auth == AuthTypes.INVALID:
+            self.expect(self._handleConnFailed, 4)
+        elif auth == AuthTypes.NONE:
+            self._doClientInitialization()
+        elif auth == AuthTypes.VNC_AUTHENTICATION:
+            self.expect(self._handleVNCAuth, 16)
+        else:
+            self.vncProtocolError(f"unknown auth response {AuthTypes.lookup(auth)!r}")
+            self._close()
+
+    def _handleConnFailed(self, block: bytes) -> None:
+        (waitfor,) = unpack("!I", block)
+        self.expect(self._handleConnMessage, waitfor)
+
+    def _handleConnMessage(self, block: bytes) -> None:
+        self.vncProtocolError(f"Connection refused: {bytes(block)!r}")
+        self._close()
+
+    def _handleVNCAuth(self, block: bytes) -> None:
+        self._challenge = bytes(block)
+        self.vncRequestPassword()
+        self.expect(self._handleVNCAuthResult, 4)
+
+    def _handleDHAuth(self, block: bytes) -> None:
+        self.generator, self.keyLen = unpack("!HH", block)
+        self.expect(self._handleDHAuthKey, self.keyLen)
+
+    def _handleDHAuthKey(self, block: bytes) -> None:
+        self.modulus = bytes(block)
+        self.expect(self._handleDHAuthCert, self.keyLen)
+
+    def _handleDHAuthCert(self, block: bytes) -> None:
+        self.serverKey = bytes(block)
+
+        self.ardRequestCredentials()
+
+        self._encryptArd()
+        self.expect(self._handleVNCAuthResult, 4)
+
+    def _encryptArd(self) -> None:
+        userStruct = f"{self.username:\0<64}{self.password:\0<64}"
+
+        p = int.from_bytes(self.modulus, "big")
+        sk = int.from_bytes(self.serverKey, "big")
+        with warnings.catch_warnings():
+            # ARD auth is specified over classic finite-field DH; the server
+            # picks p/g and there is no other algorithm to negotiate into.
+            # Tracking upstream removal: https://github.com/sibson/vncdotool/issues/388
+            warnings.simplefilter("ignore", CryptographyDeprecationWarning)
+            param_nums = dh.DHParameterNumbers(p=p, g=self.generator)
+            server_key = dh.DHPublicNumbers(sk, param_nums).public_key()
+
+        params = param_nums.parameters()
+        private_key = params.generate_private_key()
+        shared_key = private_key.exchange(server_key)
+
+        h = hashes.Hash(hashes.MD5())
+        h.update(shared_key)
+        key_digest = h.finalize()
+
+        cipher = Cipher(algorithms.AES(key_digest), modes.ECB())
+        encryptor = cipher.encryptor()
+        ciphertext = encryptor.update(userStruct.encode("utf-8"))
+        ciphertext += encryptor.finalize()
+
+        public_key = private_key.public_key()
+        y = public_key.public_numbers().y.to_bytes(self.keyLen, "big")
+
+        self._write(ciphertext + y)
+
+    def ardRequestCredentials(self) -> None:
+        if self.username is None:
+            self.username = input("username: ")
+        if self.password is None:
+            self.password = getpass.getpass("password:")
+
+    def sendPassword(self, password: str) -> None:
+        """send password"""
+        self._write(des_encrypt(_vnc_des(password), self._challenge))
+
+    def _handleVNCAuthResult(self, block: bytes) -> None:
+        (result,) = unpack("!I", block)
+        # ~ print(f"{auth=}")
+        if result == 0:  # OK
+            self._doClientInitialization()
+            return
+        elif result == 1:  # failed
+            if self._version < (3, 8):
+                self.vncAuthFailed("authentication failed")
+                self._close()
+            else:
+                self.expect(self._handleAuthFailed, 4)
+        elif result == 2:  # too many
+            if self._version < (3, 8):
+                self.vncAuthFailed("too many tries to log in")
+                self._close()
+            else:
+                self.expect(self._handleAuthFailed, 4)
+        else:
+            log.info(f"unknown auth response ({result})")
+            self._close()
+
+    def _handleAuthFailed(self, block: bytes) -> None:
+        (waitfor,) = unpack("!I", block)
+        self.expect(self._handleAuthFailedMessage, waitfor)
+
+    def _handleAuthFailedMessage(self, block: bytes) -> None:
+        self.vncAuthFailed(bytes(block))
+        self._close()
+
+    def _doClientInitialization(self) -> None:
+        self._write(pack("!B", self.shared))
+        self.expect(self._handleServerInit, 24)
+
+    def _handleServerInit(self, block: bytes) -> None:
+        (self.width, self.height, pixformat, namelen) = unpack("!HH16sI", block)
+        self.pixel_format = PixelFormat.from_bytes(pixformat)
+        if self.tracer.enabled:
+            self.tracer.emit(
+                "server_init", width=self.width, height=self.height,
+                pixel_format=self.pixel_format, bypp=self.pixel_format.bypp,
+            )
+        self.expect(self._handleServerName, namelen)
+
+    def _handleServerName(self, block: bytes) -> None:
+        self.name = bytes(block)
+        # callback:
+        self.vncConnectionMade()
+        self.expect(self._handleConnection, 1)
+
+    # ------------------------------------------------------
+    # Server to client messages
+    # ------------------------------------------------------
+    def _handleConnection(self, block: bytes) -> None:
+        (msgid,) = unpack("!B", block)
+        if self.tracer.enabled:
+            self.tracer.emit("message", type=msgid)
+        if msgid == MsgS2C.FRAMEBUFFER_UPDATE:
+            self.expect(self._handleFramebufferUpdate, 3)
+        elif msgid == MsgS2C.SET_COLOUR_MAP_ENTRIES:
+            self.expect(self._handleColourMapEntries, 5)
+        elif msgid == MsgS2C.BELL:
+            self.bell()
+            self.expect(self._handleConnection, 1)
+        elif msgid == MsgS2C.SERVER_CUT_TEXT:
+            self.expect(self._handleServerCutText, 7)
+        elif msgid == MsgS2C.SERVER_FENCE:
+            self.expect(self._handleServerFence, 8)
+        elif msgid == MsgS2C.END_OF_CONTINUOUS_UPDATES:
+            self._handleEndOfContinuousUpdates()
+            self.expect(self._handleConnection, 1)
+        else:
+            self.vncProtocolError(f"unknown message received {MsgS2C.lookup(msgid)!r}")
+            self._close()
+
+    def _handleEndOfContinuousUpdates(self) -> None:
+        # The first one answers SetEncodings, announcing the server supports
+        # the extension; any later one confirms updates were switched off.
+        if Encoding.PSEUDO_CONTINUOUS_UPDATES not in self.negotiated_encodings:
+            self.negotiated_encodings.add(Encoding.PSEUDO_CONTINUOUS_UPDATES)
+            self.continuousUpdatesSupported()
+        else:
+            self.continuous_updates = False
+            self.endOfContinuousUpdates()
+
+    def _handleServerFence(self, block: bytes) -> None:
+        (flags, length) = unpack("!xxxIB", block)
+        if length > self.FENCE_PAYLOAD_MAX:
+            self.abortConnection(f"fence payload of {length} bytes, more than {self.FENCE_PAYLOAD_MAX}")
+            return
+        self.expect(self._handleServerFencePayload, length, flags)
+
+    def _handleServerFencePayload(self, block: bytes, flags: int) -> None:
+        payload = bytes(block)
+        # A server supporting fences sends one unasked, to say so.
+        self.negotiated_encodings.add(Encoding.PSEUDO_FENCE)
+        if flags & FenceFlags.REQUEST:
+            self.clientFence(flags & self.FENCE_FLAGS, payload)
+        else:
+            sent = self._fences.pop(payload, None)
+            if sent is not None:
+                self.rtt = time.monotonic() - sent
+                if self.tracer.enabled:
+                    self.tracer.emit("fence", rtt=self.rtt)
+            self.serverFence(flags, payload)
+        self.expect(self._handleConnection, 1)
+
+    def _handleFramebufferUpdate(self, block: bytes) -> None:
+        (self.rectangles,) = unpack("!xH", block)
+        self.rectanglePos: list[Rect] = []
+        if self.tracer.enabled:
+            self.tracer.emit("update_begin", rectangles=self.rectangles)
+        self.beginUpdate()
+        self._doConnection()
+
+    def _doConnection(self) -> None:
+        if self.rectangles:
+            self.expect(self._handleRectangle, 12)
+        elif self._paints:
+            self._parked = self._doConnection
+        else:
+            if self.tracer.enabled:
+                self.tracer.emit("update_commit", rectangles=len(self.rectanglePos))
+            self.commitUpdate(self.rectanglePos)
+            self.expect(self._handleConnection, 1)
+
+    def _handleRectangle(self, block: bytes) -> None:
+        (x, y, width, height, encoding) = unpack("!HHHHi", block)
+        if self.tracer.enabled:
+            self.tracer.emit("rect", x=x, y=y, width=width, height=height, encoding=encoding)
+        entry = self._decoders.get(encoding)
+        if entry is None:
+            self.vncProtocolError(f"unknown encoding received {Encoding.lookup(encoding)!r}")
+            self._close()
+            return
+        self.rectangles -= 1
+        self.rectanglePos.append((x, y, width, height))
+        decoder, pump = entry
+        pump(decoder, x, y, width, height)
+
+    def _pumpFor(self, decoder: decoders.Decoder) -> Callable[..., None]:
+        if isinstance(decoder, decoders.PixelDecoder):
+            if self.BAND_ROWS and decoder.ROW_BANDS:
+                return self._pumpBands
+            return self._pumpPixels
+        if isinstance(decoder, decoders.ControlDecoder):
+            return self._pumpControl
+        return self._pumpForClient
+
+    def _pumpPixels(
+        self, decoder: decoders.PixelDecoder, x: int, y: int, width: int, height: int
+    ) -> None:
+        target = self._rectBuffer(
+            width, height, decoder.output_format(self.pixel_format).bypp
+        )
+        if target is None:
+            return
+        self._pumpBlock(
+            None,
+            decoder.decodePixels(target, self.pixel_format),
+            (decoder, target, (x, y, width, height)),
+        )
+
+    def _pumpBands(
+        self, decoder: decoders.PixelDecoder, x: int, y: int, width: int, height: int
+    ) -> None:
+        """Decode a rectangle ``BAND_ROWS`` rows at a time, painting each band
+        as it completes, so no more than one band is ever held."""
+        if not self._rectFits(width, height):
+            return
+        self._pumpBand(decoder, x, y, width, height)
+
+    def _pumpBand(
+        self, decoder: decoders.PixelDecoder, x: int, y: int, width: int, height: int
+    ) -> None:
+        rows = min(height, self.BAND_ROWS)
+        target = self._rectBuffer(
+            width, rows, decoder.output_format(self.pixel_format).bypp
+        )
+        if target is None:
+            return
+        rest = (decoder, x, y + rows, width, height - rows) if height > rows else None
+        self._pumpBlock(
+            None,
+            decoder.decodePixels(target, self.pixel_format),
+            (decoder, target, (x, y, width, rows)),
+            rest,
+        )
+
+    def _pumpForClient(
+        self, decoder: decoders.ClientDecoder, x: int, y: int, width: int, height: int
+    ) -> None:
+        if self._paints:
+            # CopyRect reads the screen and DesktopSize resizes it, so
+            # neither may overtake a paint.
+            self._parked = partial(self._pumpForClient, decoder, x, y, width, height)
+            return
+        rect = (x, y, width, height)
+        self._pumpBlock(
+            None, decoder.decodeForClient(self, rect, self.pixel_format), None
+        )
+
+    def _pumpControl(
+        self, decoder: decoders.ControlDecoder, x: int, y: int, width: int, height: int
+    ) -> None:
+        del self.rectanglePos[-1]  # no area of the screen
+        self._pumpForClient(decoder, x, y, width, height)
+
+    def _finishRectangle(
+        self, decoder: decoders.PixelDecoder, target: decoders.RectBuffer, rect: Rect
+    ) -> None:
+        x, y, width, height = rect
+        output = decoder.output_format(self.pixel_format)
+        color = target.solid
+        if color is not None and output is self.pixel_format:
+            # One colour from edge to edge: paint it, rather than expand it
+            # to every pixel first.
+            paint = partial(self.fillRectangle, x, y, width, height, color)
+        else:
+            paint = partial(self.updateRectangle, x, y, width, height, target.tobytes(), output)
+        if self._paints:
+            self._paints.append([paint])
+        else:
+            paint()
+
+    def _finishInBackground(
+        self, decoder: decoders.PixelDecoder, job: decoders.Job, rect: Rect
+    ) -> None:
+        """Run the rest of a rectangle's decode through
+        :meth:`decodeInBackground`, and paint it once every rectangle before
+        it is painted."""
+        x, y, width, height = rect
+        output = decoder.output_format(self.pixel_format)
+        entry: list[Callable[[], None] | None] = [None]
+        self._paints.append(entry)
+
+        def done(pixels: bytes | Exception) -> None:
+            if self._aborted:
+                return
+            if isinstance(pixels, Exception):
+                self.abortConnection(f"cannot decode this rectangle: {pixels}")
+                return
+            entry[0] = partial(self.updateRectangle, x, y, width, height, pixels, output)
+            self._paintDecoded()
+
+        self.decodeInBackground(partial(_run_job, job), done)
+
+    def _paintDecoded(self) -> None:
+        """Paint what is ready at the front of the queue, and carry on
+        parsing if it was waiting on the queue to empty."""
+        paints = self._paints
+        with self.batch():
+            while paints and paints[0][0] is not None:
+                paint = paints.popleft()[0]
+                assert paint is not None
+                paint()
+            if not paints and self._parked is not None:
+                parked, self._parked = self._parked, None
+                parked()
+
+    def _rectFits(self, width: int, height: int) -> bool:
+        """Whether a rectangle fits the framebuffer, having failed the
+        connection if not."""
+        limit_w = self.width or self.MAX_DESKTOP_SIZE
+        limit_h = self.height or self.MAX_DESKTOP_SIZE
+        if not (0 <= width <= limit_w and 0 <= height <= limit_h):
+            self.abortConnection(
+                f"rectangle {width}x{height} does not fit a {limit_w}x{limit_h} framebuffer"
+            )
+            return False
+        return True
+
+    def _rectBuffer(
+        self, width: int, height: int, bypp: int | None = None
+    ) -> decoders.RectBuffer | None:
+        """A buffer for one rectangle of ``bypp``-byte pixels, the
+        negotiated format's by default, or None having failed the
+        connection."""
+        if not self._rectFits(width, height):
+            return None
+        if bypp is None:
+            bypp = self.bypp
+        needed = width * height * bypp
+        try:
+            if len(self._rect_backing) < needed:
+                self._rect_backing = bytearray(needed)
+            return decoders.RectBuffer(width, height, bypp, self._rect_backing)
+        except MemoryError:
+            self.abortConnection(f"no memory for a {width}x{height} rectangle")
+            return None
+
+    def _pumpBlock(
+        self,
+        block: bytes | None,
+        generator: Iterator[int],
+        finish: tuple[decoders.PixelDecoder, decoders.RectBuffer, Rect] | None,
+        rest: tuple[decoders.PixelDecoder, int, int, int, int] | None = None,
+    ) -> None:
+        try:
+            size = generator.send(block)
+        except StopIteration as stop:
+            if finish is not None:
+                if stop.value is not None:
+                    decoder, _, rect = finish
+                    self._finishInBackground(decoder, stop.value, rect)
+                    if self._aborted:
+                        # decoded there and then, and failed
+                        return
+                else:
+                    self._finishRectangle(*finish)
+            if rest is not None:
+                self._pumpBand(*rest)
+            else:
+                self._doConnection()
+            return
+        except DECODE_ERRORS as exc:
+            generator.close()
+            self.abortConnection(f"cannot decode this rectangle: {exc}")
+            return
+
+        if size < 0:
+            generator.close()
+            self.abortConnection(f"decoder asked for {size} bytes")
+            return
+        self.expect(self._pumpBlock, size, generator, finish, rest)
+
+    # ---  other server messages
+
+    def _handleColourMapEntries(self, block: bytes) -> None:
+        (first_color, number_of_colors) = unpack("!xHH", block)
+        self.expect(
+            self._handleColourMapEntriesValue, 6 * number_of_colors, first_color
+        )
+
+    def _handleColourMapEntriesValue(self, block: bytes, first_color: int) -> None:
+        colors = [
+            unpack_from("!HHH", block, offset) for offset in range(0, len(block), 6)
+        ]
+        self.set_color_map(first_color, cast(List[Tuple[int, int, int]], colors))
+        self.expect(self._handleConnection, 1)
+
+    def _handleServerCutText(self, block: bytes) -> None:
+        (length,) = unpack("!xxxI", block)
+        self.expect(self._handleServerCutTextValue, length)
+
+    def _handleServerCutTextValue(self, block: bytes) -> None:
+        self.copy_text(str(block, "iso-8859-1"))
+        self.expect(self._handleConnection, 1)
+
+    # ------------------------------------------------------
+    # incomming data redirector
+    # ------------------------------------------------------
+    def feed(self, data: bytes) -> None:
+        """Parse bytes received from the server."""
+        if self._aborted:
+            return
+        if self.tracer.enabled:
+            self.tracer.emit("received", bytes=len(data))
+        self._packet.extend(data)
+        # Whatever the handlers answer with goes out in one write.
+        with self.batch():
+            self._handler()
+
+    def data_to_send(self) -> bytes:
+        """The bytes queued for the server since the last call."""
+        data = b"".join(self._outgoing)
+        self._outgoing.clear()
+        return data
+
+    def _handleExpected(self) -> None:
+        packet = self._packet
+        if len(packet) >= self._expected_len:
+            # `expect` is the only thing that re-arms the parked handler, so
+            # a handler that gives up without calling it would be re-entered
+            # by this loop with the next block.
+            while len(packet) >= self._expected_len and not self._aborted and self._parked is None:
+                self._already_expecting = True
+                # Possibly a memoryview into the received data: a handler
+                # keeping any of it past its return copies it with bytes().
+                block = packet.take(self._expected_len)
+                # ~ log.info(f"handle {block!r} with {self._expected_handler.__name__!r}")
+                self._expected_handler(
+                    block, *self._expected_args, **self._expected_kwargs
+                )
+            self._already_expecting = False
+
+    def _close(self) -> None:
+        """Ask for the connection to be closed, once what is queued is sent."""
+        self.closed = True
+
+    def abortConnection(self, reason: str) -> None:
+        """Report a protocol failure and stop parsing for good.
+
+        Closing is asynchronous and bytes already received are still
+        delivered, so the parser has to be stopped here as well.
+        """
+        self._aborted = True
+        self._packet.clear()
+        self._paints.clear()
+        self.vncProtocolError(reason)
+        self._close()
+
+    def expect(
+        self, handler: Callable[..., None], size: int, *args: Any, **kwargs: Any
+    ) -> None:
+        # ~ log.info(f"expect({handler.__name__!r}, {size!r}, {args!r}, {kwargs!r})")
+        self._expected_handler = handler
+        self._expected_len = size
+        self._expected_args = args
+        self._expected_kwargs = kwargs
+        if not self._already_expecting:
+            self._handleExpected()  # just in case that there is already enough data
+
+    # ------------------------------------------------------
+    # client -> server messages
+    # ------------------------------------------------------
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Hold the client-to-server messages sent inside the block and
+        :meth:`flush` them together when it ends, instead of one each.
+
+        Batches nest; only the outermost one flushes. Everything the client
+        writes answering one :meth:`feed` is batched already.
+        """
+        self._batching += 1
+        try:
+            yield
+        finally:
+            self._batching -= 1
+            if not self._batching and self._outgoing:
+                self.flush()
+
+    def flush(self) -> None:
+        """Hand the queued messages to the IO layer. A bare session leaves
+        them queued for :meth:`data_to_send`."""
+
+    def _write(self, data: bytes) -> None:
+        self._outgoing.append(data)
+        if not self._batching:
+            self.flush()
+
+    def setPixelFormat(self, pixel_format: PixelFormat) -> None:
+        log.info(f"Requesting {pixel_format}")
+        self._write(pack_set_pixel_format(pixel_format))
+        self.pixel_format = pixel_format
+
+    def setEncodings(self, list_of_encodings: Collection[Encoding]) -> None:
+        if self.tracer.enabled:
+            self.tracer.emit("encodings", encodings=[int(e) for e in list_of_encodings])
+        self._write(pack_set_encodings(list_of_encodings))
+
+    def framebufferUpdateRequest(
+        self,
+        x: int = 0,
+        y: int = 0,
+        width: int | None = None,
+        height: int | None = None,
+        incremental: bool = False,
+    ) -> None:
+        if width is None:
+            width = self.width - x
+        if height is None:
+            height = self.height - y
+        self._write(pack_framebuffer_update_request(x, y, width, height, incremental))
+
+    def enableContinuousUpdates(
+        self,
+        enable: bool = True,
+        x: int = 0,
+        y: int = 0,
+        width: int | None = None,
+        height: int | None = None,
+    ) -> None:
+        """Ask the server to send updates for the area as it changes, without
+        waiting for a :meth:`framebufferUpdateRequest`, or to stop. Only for a
+        server that announced support, see :meth:`continuousUpdatesSupported`.
+        """
+        if width is None:
+            width = self.width - x
+        if height is None:
+            height = self.height - y
+        self._write(pack_enable_continuous_updates(enable, x, y, width, height))
+        self.continuous_updates = enable
+
+    def clientFence(self, flags: int, payload: bytes = b"") -> None:
+        """Send a fence, see :class:`FenceFlags`; only to a server that
+        supports them, which ``negotiated_encodings`` records."""
+        self._write(pack_client_fence(flags, payload))
+
+    def requestFence(self, flags: int = FenceFlags.BLOCK_BEFORE) -> bytes:
+        """Ask the server to answer a fence once it has handled everything
+        sent before it, timing the round trip into :attr:`rtt`.
+
+        :returns: the payload :meth:`serverFence` is called with when the
+            answer arrives.
+        """
+        self._fence_serial = (self._fence_serial + 1) & 0xFFFFFFFF
+        payload = pack("!I", self._fence_serial)
+        self._fences[payload] = time.monotonic()
+        self.clientFence(flags | FenceFlags.REQUEST, payload)
+        return payload
+
+    def keyEvent(self, key: Key | int, down: bool = True) -> None:
+        """For most ordinary keys, the "keysym" is the same as the corresponding ASCII value.
+        Other common keys are shown in the ``Key`` constants."""
+        self._write(pack_key_event(key, down))
+
+    def pointerEvent(self, x: int, y: int, buttonmask: int = 0) -> None:
+        """Indicates either pointer movement or a pointer button press or release. The pointer is
+        now at (x-position, y-position), and the current state of buttons 1 to 8 are represented
+        by bits 0 to 7 of button-mask respectively, 0 meaning up, 1 meaning down (pressed).
+        """
+        self._write(pack_pointer_event(x, y, buttonmask))
+
+    def clientCutText(self, message: str) -> None:
+        """The client has new ISO 8859-1 (Latin-1) text in its cut buffer.
+        (aka clipboard)
+        """
+        self._write(pack_client_cut_text(message))
+
+    # ------------------------------------------------------
+    # callbacks
+    # override these in your application
+    # ------------------------------------------------------
+    def vncConnectionMade(self) -> None:
+        """connection is initialized and ready.
+        typicaly, the pixel format is set here."""
+
+    def vncRequestPassword(self) -> None:
+        """a password is needed to log on, use :meth:`sendPassword` to
+        send one."""
+        if self.password is None:
+            log.info("need a password")
+            self._close()
+            return
+        self.sendPassword(self.password)
+
+    def vncAuthFailed(self, reason: bytes | str) -> None:
+        """called when the authentication failed.
+        the connection is closed."""
+        log.info(f"Cannot connect {reason}")
+
+    def vncProtocolError(self, reason: str) -> None:
+        """called when the server sends something we cannot handle.
+        the connection is closed."""
+        log.info(reason)
+
+    def beginUpdate(self) -> None:
+        """called before a series of :meth:`updateRectangle`,
+        :meth:`copyRectangle` or :meth:`fillRectangle`."""
+
+    def commitUpdate(self, rectangles: list[Rect] | None = None) -> None:
+        """called after a series of :meth:`updateRectangle`, :meth:`copyRectangle`
+        or :meth:`fillRectangle` are finished.
+
+        Typicaly, here is the place to request the next screen
+        update with :meth:`framebufferUpdateRequest` with ``incremental=True``.
+
+        :param rectangles: a list of tuples (x,y,w,h) with the updated rectangles.
+        """
+
+    def decodeInBackground(
+        self, job: Callable[[], Any], done: Callable[[Any], None]
+    ) -> None:
+        """Run ``job``, the slow end of decoding a rectangle -- a JPEG or a
+        PNG, or with :attr:`decode_executor` set any rectangle read whole --
+        off the thread parsing the connection, and call ``done`` with what
+        it returns, or an exception, back on that thread. ``job`` raises
+        nothing, and pickles for a process pool.
+
+        Rectangles are painted in the order they arrived whatever order
+        their decodes finish in, and the update is committed after all of
+        them. A bare session has no other thread, and runs ``job`` there
+        and then.
+        """
+        done(job())
+
+    def continuousUpdatesSupported(self) -> None:
+        """the server supports continuous updates, which
+        :meth:`enableContinuousUpdates` can now turn on."""
+
+    def endOfContinuousUpdates(self) -> None:
+        """the server stopped sending continuous updates."""
+
+    def serverFence(self, flags: int, payload: bytes) -> None:
+        """the server answered a fence, one from :meth:`requestFence`
+        when ``payload`` is what it returned."""
+
+    def updateRectangle(
+        self,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        data: bytes,
+        pixel_format: PixelFormat,
+    ) -> None:
+        """new bitmap data.
+
+        :param data: bytes in `pixel_format`, which is the negotiated format
+            for every encoding in use today but need not be. Possibly a
+            read-only memoryview of the received data rather than ``bytes``;
+            copy it with ``bytes(data)`` to keep it past the call.
+        """
+
+    def copyRectangle(
+        self, srcx: int, srcy: int, x: int, y: int, width: int, height: int
+    ) -> None:
+        """used for copyrect encoding. copy the given rectangle
+        (src, srxy, width, height) to the target coords (x,y)"""
+
+    def fillRectangle(
+        self, x: int, y: int, width: int, height: int, color: bytes
+    ) -> None:
+        """fill the area with the color.
+
+        :param color: bytes in the pixel format set up earlier.
+        """
+        # fallback variant, use update recatngle
+        # override with specialized function for better performance
+        self.updateRectangle(
+            x, y, width, height, color * width * height, self.pixel_format
+        )
+
+    def updateCursor(
+        self, x: int, y: int, width: int, height: int, image: bytes, mask: bytes
+    ) -> None:
+        """New cursor, focuses at (x, y)"""
+
+    def updateDesktopSize(self, width: int, height: int) -> None:
+        """New desktop size of width*height."""
+
+    def set_color_map(self, first: int, colors: list[tuple[int, int, int]]) -> None:
+        """The server is using a new color map."""
+
+    def bell(self) -> None:
+        """bell"""
+
+    def copy_text(self, text: str) -> None:
+        """The server has new ISO 8859-1 (Latin-1) text in its cut buffer.
+        (aka clipboard)"""
+
+
+def parse_server(server: str) -> tuple[socket.AddressFamily, str, int]:
+    """The address family, host and port a ``host[:display]``,
+    ``host::port``, ``[ipv6]:display`` or UNIX socket path names."""
+    if server.startswith("["):
+        host, sep, server = server[1:].partition("]")
+        if not sep:
+            raise ValueError(server)
+        ipaddress.IPv6Address(host)
+        split = server.split(":")
+        address_family = socket.AF_INET6
+    else:
+        split = server.split(":")
+        if not split[0]:
+            host = "127.0.0.1"
+        else:
+            host = split[0]
+
+        if hasattr(socket, "AF_UNIX") and os.path.exists(host):
+            address_family = socket.AF_UNIX
+        else:
+            try:
+                ipaddress.IPv4Address(host)
+            except ipaddress.AddressValueError:
+                address_family = socket.AF_UNSPEC
+            else:
+                address_family = socket.AF_INET
+
+    if len(split) == 3:  # ::port
+        port = int(split[2])
+    elif len(split) == 2:  # :display
+        port = int(split[1]) + 5900
+    elif len(split) == 1:  # default
+        port = 5900
+    else:
+        raise ValueError(server)
+
+    return address_family, host, port
+
+
+def des_encrypt(key: bytes, data: bytes) -> bytes:
+    """Encrypt with single DES, as the VNC family's password handling uses.
+
+    Single DES in ECB is weak, and is what RFB specifies: both the
+    authentication challenge response (RFC 6143 section 7.2.2) and the
+    password file format are defined in terms of it, so a stronger
+    algorithm here would simply fail to talk to any VNC server."""
+    # Triple-DES with the same 56-bit key repeated three times is
+    # equivalent to single-DES
+    encryptor = Cipher(algorithms.TripleDES(key * 3), modes.ECB()).encryptor()
+    return encryptor.update(data) + encryptor.finalize()
+
+
+def reverse_bits(data: bytes) -> bytes:
+    """The bit-reversal the VNC family applies to a DES key before using it,
+    both for the authentication challenge response here and for the
+    password obfuscation in ~/.vnc/passwd files."""
+    return bytes(
+        sum((128 >> i) if (k & (1 << i)) else 0 for i in range(8)) for k in data
+    )
+
+
+def _vnc_des(password: str) -> bytes:
+    """Custom DES variant for RFB protocol.
+
+    RFB protocol for authentication requires client to encrypt
+    challenge sent by server with password using DES method. However,
+    bits in each byte of the password are put in reverse order before
+    using it as encryption key."""
+    pw = f"{password:\0<8.8}"  # make sure its 8 chars long, zero padded
+    key = pw.encode(
+        "ASCII"
+    )  # unspecified https://www.rfc-editor.org/rfc/rfc6143#section-7.2.2
+    return reverse_bits(key)
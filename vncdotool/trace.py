@@ -0,0 +1,113 @@
+"""
+Structured tracing of what the protocol does, for the per-rectangle and
+per-message detail too frequent to format on the chance someone logs it.
+
+A :class:`Tracer` with no sinks is disabled, and the protocol tests
+``tracer.enabled`` before building an event, so tracing costs one attribute
+check when it is off::
+
+    client.tracer = Tracer(RingSink(1000))
+
+Events are a name and keyword fields of plain values:
+
+``server_init``     width, height, pixel_format, bypp
+``encodings``       encodings, the encoding-types offered
+``message``         type, a server-to-client message-type
+``update_begin``    rectangles, the count the server announced
+``rect``            x, y, width, height, encoding
+``update_commit``   rectangles, the count that carried pixels
+``received``        bytes
+``flush``           messages, bytes; one transport write of client messages
+``fence``           rtt, seconds until the server answered a requested fence
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from collections import deque
+from typing import IO, Any, Callable, Deque, Dict, List, Tuple
+
+from .const import Encoding, MsgS2C
+
+Sink = Callable[[str, Dict[str, Any]], None]
+
+
+class Tracer:
+    def __init__(self, *sinks: Sink) -> None:
+        self.sinks: List[Sink] = list(sinks)
+        self.enabled = bool(self.sinks)
+
+    def add(self, sink: Sink) -> None:
+        self.sinks.append(sink)
+        self.enabled = True
+
+    def remove(self, sink: Sink) -> None:
+        self.sinks.remove(sink)
+        self.enabled = bool(self.sinks)
+
+    def emit(self, event: str, **fields: Any) -> None:
+        for sink in self.sinks:
+            sink(event, fields)
+
+
+# Shared by every client not given one of its own; it has no sinks, so
+# nothing ever reaches it.
+DISABLED = Tracer()
+
+
+def _encodings(fields: Dict[str, Any]) -> str:
+    return ", ".join(repr(Encoding.lookup(e)) for e in fields["encodings"])
+
+
+class LoggingSink:
+    """Formats events as the log lines the protocol used to write itself."""
+
+    MESSAGES: Dict[str, Callable[[Dict[str, Any]], str]] = {
+        "server_init": lambda f: f"Native {f['pixel_format']} bytes={f['bypp']}",
+        "encodings": lambda f: f"Offering {_encodings(f)}",
+        "message": lambda f: f"message {MsgS2C.lookup(f['type'])!r}",
+        "update_begin": lambda f: f"update of {f['rectangles']} rectangles",
+        "rect": lambda f: (
+            f"x={f['x']} y={f['y']} w={f['width']} h={f['height']} "
+            f"{Encoding.lookup(f['encoding'])!r}"
+        ),
+        "update_commit": lambda f: f"update committed, {f['rectangles']} rectangles",
+        "received": lambda f: f"received {f['bytes']} bytes",
+        "flush": lambda f: f"sent {f['messages']} messages, {f['bytes']} bytes",
+        "fence": lambda f: f"fence answered in {f['rtt'] * 1000:.1f} ms",
+    }
+
+    def __init__(
+        self, logger: logging.Logger | None = None, level: int = logging.INFO
+    ) -> None:
+        self.logger = logger or logging.getLogger("vncdotool.rfb")
+        self.level = level
+
+    def __call__(self, event: str, fields: Dict[str, Any]) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+        message = self.MESSAGES.get(event)
+        text = message(fields) if message else f"{event} {fields}"
+        self.logger.log(self.level, text)
+
+
+class JSONLinesSink:
+    """One JSON object per event, with the event name and a timestamp."""
+
+    def __init__(self, fp: IO[str]) -> None:
+        self.fp = fp
+
+    def __call__(self, event: str, fields: Dict[str, Any]) -> None:
+        record = {"event": event, "time": time.time(), **fields}
+        self.fp.write(json.dumps(record, default=str) + "\n")
+
+
+class RingSink:
+    """The last ``size`` events, kept in memory."""
+
+    def __init__(self, size: int = 1024) -> None:
+        self.events: Deque[Tuple[str, Dict[str, Any]]] = deque(maxlen=size)
+
+    def __call__(self, event: str, fields: Dict[str, Any]) -> None:
+        self.events.append((event, fields))